@@ -0,0 +1,319 @@
+# Headless benchmarks of the pipeline stages and the dashboards.
+#
+# Generates a synthetic data directory (synthetic.py) at one of synthetic.SCALES, then times
+# each step below and records its memory: the resident set size after the step, its change
+# over the step, and the peak during the step (Linux only, from /proc/self; the peak is
+# restarted before every step so it isn't the running maximum of the whole process):
+#
+#   pipeline:<stage>        the union, dedup and join stages and the aggregates built on
+#                           them, in pipeline order (see run_pipeline)
+#   <app>:<interaction>     the dashboards replayed through Streamlit's app testing harness
+#                           (streamlit.testing.v1.AppTest): the first run with cold caches,
+#                           then the widget interactions of INTERACTIONS, one script rerun each;
+#                           each dashboard is replayed --repeats times, every time in a fresh
+#                           interpreter (imports, caches and memory all cold), and every step
+#                           reports its median
+#
+# The timings are compared with baselines/<scale>.json: a metric slower than the baseline
+# by more than --tolerance (a ratio, ignoring differences under MIN_REGRESSION_SECONDS)
+# is a regression and the runner exits with status 1. Every run is appended to
+# results/<scale>.jsonl. Everything runs offline against the synthetic data; the repo's
+# data/ is only read for the ZIP centroids and the small dashboard CSVs.
+#
+# Usage (from the repo root):
+#   python website/benchmarks/run_benchmarks.py [scale] [--data-dir DIR] [--update-baseline]
+#   python website/benchmarks/run_benchmarks.py 1m --skip-dashboards --tolerance 1.5
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD_DIR = os.path.join(BENCHMARKS_DIR, '..', 'dashboard')
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, 'baselines')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+TOLERANCE = 1.25
+# Absolute slowdowns below this are run-to-run noise at the small scales
+MIN_REGRESSION_SECONDS = 0.25
+# Cold starts of each dashboard (one interpreter each); its timings are the medians
+REPEATS = 3
+APP_TIMEOUT = 600
+# Permutation resamples of the hypothesis tests (the tests themselves, not the p-values, are timed)
+N_RESAMPLES = 200
+
+# Widget interactions replayed on each dashboard: (name, widget type, label, action, value).
+# Widgets are found by label (and by option for the repeated 'Select View:' boxes), and
+# an interaction whose widget the page doesn't show is skipped. A 'tabs' interaction opens
+# the tab `value` of the tabs keyed `label`.
+INTERACTIONS = {
+    'targeted_city_analysis': [
+        ('section_transparency', 'tabs', 'section', 'open', 'Financial Transparency and Accountability'),
+        ('section_trends', 'tabs', 'section', 'open', 'Trends over Time'),
+        ('ruling_decade', 'selectbox', 'Select View:', 'select', 'Decade'),
+        ('ntee_environment', 'selectbox', 'Select View:', 'select', 'Environment & Civil Rights Focused'),
+        ('momentum_assets', 'selectbox', 'Select Amount:', 'select', 'Assets'),
+        ('section_clusters', 'tabs', 'section', 'open', 'Machine Learning Focus'),
+        ('clusters_environment', 'selectbox', 'Select View:', 'select', 'Environmental and civil rights nonprofits'),
+        ('scatter_full_detail', 'select_slider', 'Detail:', 'set_value', 'Full'),
+        ('filing_environment', 'selectbox', 'Select View:', 'select', 'Among environmental and civil rights nonprofits'),
+        ('map_zoom', 'select_slider', 'Map detail (zoom level):', 'set_value', -1),
+        ('drop_city', 'multiselect', 'Cities of interest:', 'unselect', 0),
+    ],
+    'streamlit': [
+        ('city_median', 'radio', 'Select Statistic', 'set_value', 'median'),
+        ('category_median', 'radio', 'Select Statistic', 'set_value', 'median'),
+        ('custom_category', 'multiselect', None, 'select', 'officexpns'),
+    ],
+}
+
+
+def _memory_mb():
+    # (current, peak) resident set size of the process in MB, (None, None) without /proc
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None, None
+    return tuple(round(int(fields[name].split()[0]) / 2**10, 1) for name in ('VmRSS', 'VmHWM'))
+
+
+def _reset_peak():
+    # Restart the peak from the current resident set size (Linux, see proc(5) clear_refs);
+    # False where it can't be, and the peak would be that of the whole process
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _measure(function, *args, **kwargs):
+    # (result, {'seconds', 'rss_mb', 'rss_delta_mb', 'peak_rss_mb'}) of one call
+    before, _ = _memory_mb()
+    reset = _reset_peak()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    after, peak = _memory_mb()
+    return result, {
+        'seconds': seconds,
+        'rss_mb': after,
+        'rss_delta_mb': round(after - before, 1) if after is not None else None,
+        'peak_rss_mb': peak if reset else None,
+    }
+
+
+def _timed(metrics, name, function, *args, **kwargs):
+    result, measured = _measure(function, *args, **kwargs)
+    metrics[name] = dict(measured, seconds=round(measured['seconds'], 4))
+    print(f"{name:<45} {metrics[name]['seconds']:9.3f} s")
+    return result
+
+
+def run_pipeline(data_dir, metrics):
+    import aggregate_cube
+    import data_store
+    import density_bins
+    import ebmf_union
+    import financial_clusters
+    import form990_panel
+    import form990_union
+    import hypothesis_tests
+    import synthetic
+
+    pipeline = [
+        ('ebmf_union', ebmf_union.union_regions, {'force': True}),
+        ('form990_join_dedup', ebmf_union.join_form990, {}),
+        ('form990_union', form990_union.write_form990_embf, {}),
+        ('form990_panel', form990_panel.build_panel, {}),
+        ('data_store', lambda: [data_store.convert(name) for name in data_store.available()], {}),
+        ('aggregate_cube', aggregate_cube.build_cube, {}),
+        ('financial_clusters', financial_clusters.fit, {}),
+        ('cluster_tables', synthetic.write_cluster_tables, {'data_dir': data_dir}),
+        ('density_bins', density_bins.build_bins, {}),
+        ('hypothesis_tests', hypothesis_tests.run_all, {'n_resamples': N_RESAMPLES}),
+    ]
+    for name, function, kwargs in pipeline:
+        _timed(metrics, f'pipeline:{name}', function, **kwargs)
+
+
+def _widget(at, kind, label, value):
+    widgets = [w for w in getattr(at, kind) if label is None or w.label == label]
+    if kind in ('selectbox', 'multiselect') and isinstance(value, str):
+        widgets = [w for w in widgets if value in w.options]
+    return widgets[0] if widgets else None
+
+
+def _interact(at, kind, label, action, value):
+    if kind == 'tabs':
+        at.session_state[label] = value
+        at.run()
+        return True
+    widget = _widget(at, kind, label, value)
+    if widget is None:
+        return False
+    if kind == 'select_slider' and isinstance(value, int):
+        value = widget.options[value]
+    elif kind == 'multiselect' and isinstance(value, int):
+        if not widget.value:
+            return False
+        value = widget.value[value]
+    getattr(widget, action)(value)
+    at.run()
+    return True
+
+
+def _dashboard_run(app):
+    # One cold start of the app and its interactions: {name: measurements (see _measure)}.
+    # Runs in a fresh interpreter started by run_dashboard
+    from streamlit.testing.v1 import AppTest
+
+    run = {}
+    at = AppTest.from_file(os.path.join(DASHBOARD_DIR, f'{app}.py'), default_timeout=APP_TIMEOUT)
+    steps = [('first_run', at.run), ('rerun', at.run)]
+    steps += [(name, lambda kind=kind, label=label, action=action, value=value: _interact(at, kind, label, action, value))
+              for name, kind, label, action, value in INTERACTIONS[app]]
+    for name, step in steps:
+        shown, measured = _measure(step)
+        if shown is False:
+            continue
+        run[name] = measured
+        if at.exception:
+            raise RuntimeError(f'{app} ({name}): {at.exception[0].message}')
+    return run
+
+
+def _dashboard_subprocess(app, scale, data_dir):
+    # _dashboard_run(app) in a new interpreter, so nothing (imports, Streamlit and
+    # data_store caches, allocator state) carries over from the pipeline or earlier runs
+    with tempfile.NamedTemporaryFile(suffix='.json') as output:
+        subprocess.run([sys.executable, os.path.abspath(__file__), scale, '--data-dir', data_dir,
+                        '--dashboard-run', app, output.name], check=True)
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def run_dashboard(app, metrics, scale, data_dir, repeats=REPEATS):
+    # Median of each step over `repeats` cold starts: a single sub-second rerun varies by
+    # tens of milliseconds from one run to the next
+    runs = [_dashboard_subprocess(app, scale, data_dir) for _ in range(repeats)]
+    for name in dict.fromkeys(['first_run', 'rerun'] + [interaction[0] for interaction in INTERACTIONS[app]]):
+        samples = [run[name] for run in runs if name in run]
+        if not samples:
+            print(f'{app}:{name:<45} skipped (widget not shown)')
+            continue
+        metrics[f'{app}:{name}'] = {
+            'seconds': round(statistics.median(sample['seconds'] for sample in samples), 4),
+            **{field: None if samples[0][field] is None else statistics.median(sample[field] for sample in samples)
+               for field in ('rss_mb', 'rss_delta_mb', 'peak_rss_mb')},
+        }
+        print(f"{app + ':' + name:<45} {metrics[f'{app}:{name}']['seconds']:9.3f} s")
+
+
+def compare(metrics, baseline, tolerance=TOLERANCE):
+    # Metrics slower than the baseline beyond the tolerance: [(name, baseline s, current s)]
+    regressions = []
+    for name, current in metrics.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        slower = current['seconds'] - previous['seconds']
+        if current['seconds'] > previous['seconds'] * tolerance and slower > MIN_REGRESSION_SECONDS:
+            regressions.append((name, previous['seconds'], current['seconds']))
+    return regressions
+
+
+def baseline_path(scale):
+    return os.path.join(BASELINES_DIR, f'{scale}.json')
+
+
+def load_baseline(scale):
+    try:
+        with open(baseline_path(scale)) as f:
+            return json.load(f)['metrics']
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(scale, rows, metrics):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    with open(baseline_path(scale), 'w') as f:
+        json.dump({'scale': scale, 'rows': rows, 'machine': platform.machine(), 'metrics': metrics}, f, indent=2)
+        f.write('\n')
+
+
+def append_result(scale, record):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, f'{scale}.jsonl'), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scale', nargs='?', default='10k', choices=['10k', '100k', '1m', '10m'])
+    parser.add_argument('--data-dir', help='synthetic data directory (default: a temporary directory)')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='cold starts of each dashboard (medians are reported)')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--skip-dashboards', action='store_true')
+    # Internal: one cold run of a dashboard, written as JSON to OUTPUT (see run_dashboard)
+    parser.add_argument('--dashboard-run', nargs=2, metavar=('APP', 'OUTPUT'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    data_dir = os.path.abspath(args.data_dir or tempfile.mkdtemp(prefix=f'philanthropy-bench-{args.scale}-'))
+    # paths.py reads PHILANTHROPY_DATA_DIR when it is first imported, so it is set before
+    # any pipeline module (synthetic.py included) is
+    os.environ['PHILANTHROPY_DATA_DIR'] = data_dir
+    sys.path.append(DASHBOARD_DIR)
+    if args.dashboard_run:
+        app, output = args.dashboard_run
+        with open(output, 'w') as f:
+            json.dump(_dashboard_run(app), f)
+        return 0
+    import synthetic
+
+    rows = synthetic.SCALES[args.scale]
+    metrics = {}
+    print(f'{args.scale}: {rows:,} organizations in {data_dir}')
+    _timed(metrics, 'generate', synthetic.generate, data_dir, rows)
+    run_pipeline(data_dir, metrics)
+    if not args.skip_dashboards:
+        for app in INTERACTIONS:
+            run_dashboard(app, metrics, args.scale, data_dir, args.repeats)
+
+    append_result(args.scale, {
+        'scale': args.scale,
+        'rows': rows,
+        'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'metrics': metrics,
+    })
+    if args.update_baseline:
+        save_baseline(args.scale, rows, metrics)
+        print(f'baseline written to {baseline_path(args.scale)}')
+        return 0
+
+    baseline = load_baseline(args.scale)
+    if not baseline:
+        print(f'no baseline for {args.scale} (run with --update-baseline to record one)')
+        return 0
+    regressions = compare(metrics, baseline, args.tolerance)
+    for name, previous, current in regressions:
+        print(f'REGRESSION {name}: {previous:.3f} s -> {current:.3f} s ({current / previous:.2f}x)')
+    print(f'{len(regressions)} regression(s) against {baseline_path(args.scale)}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
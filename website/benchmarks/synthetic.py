@@ -0,0 +1,254 @@
+# Synthetic EO BMF and Form 990 data for the benchmarks.
+#
+# generate(data_dir, rows) writes a complete data directory that the pipeline stages and
+# the dashboards can run against (PHILANTHROPY_DATA_DIR=<data_dir>), at any scale from
+# 10k to 10M organizations, without network access:
+#
+#   EBMF/<regional file>.csv        the EO BMF layout of ebmf_union.EBMF_SCHEMA, split over
+#                                   the regions of ebmf_union.REGIONS; DUPLICATE_SHARE of
+#                                   the organizations are listed in two regions
+#   22eoextract990.csv              one Form 990 extract (EIN, tax_pd and the expense columns)
+#   form990/year=<yyyy>/            the converted yearly extracts form990_union.py reads, with
+#                                   AMENDED_SHARE of the filers filing twice in a year
+#   *.csv                           the small dashboard CSVs, copied from the repo's data/
+#
+# The distributions follow the real files where it matters for performance: organizations
+# concentrate in a long tail of ZIP codes (the cities of interest weighted up), NTEE
+# codes follow the national mix of major groups, about half of the organizations report
+# zero amounts and the rest are log-normal, and Form 990 amounts drift from year to year.
+# Everything comes from one seed, so a scale always produces the same files.
+#
+# Usage (from the repo root):
+#   python website/benchmarks/synthetic.py <data dir> [rows]
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pv
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'data_preprocessing'))
+import cities
+import ebmf_union
+import expense_categories
+
+# The repo's data directory: ZIP centroids and the small dashboard CSVs
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+SEED = 42
+CHUNK_ROWS = 1_000_000
+
+# Share of the rows written to each region (eo1 is the national file)
+REGION_SHARES = {'eo1': 0.62, 'mid_atlantic': 0.18, 'gulf_coast': 0.16, 'puerto_rico': 0.02, 'intl': 0.02}
+DUPLICATE_SHARE = 0.01
+
+FORM990_YEARS = [2020, 2021, 2022]
+FORM990_SHARE = 0.3  # organizations filing a Form 990
+FORM990_RETENTION = 0.9  # filers who file again the next year
+AMENDED_SHARE = 0.02
+
+ZERO_AMOUNT_SHARE = 0.45
+TARGET_CITY_WEIGHT = 20
+
+# Approximate national mix of NTEE major groups
+NTEE_MAJOR_SHARES = {
+    'A': 0.10, 'B': 0.12, 'C': 0.02, 'D': 0.01, 'E': 0.04, 'F': 0.015, 'G': 0.015, 'H': 0.005,
+    'I': 0.02, 'J': 0.01, 'K': 0.01, 'L': 0.03, 'M': 0.02, 'N': 0.08, 'O': 0.03, 'P': 0.12,
+    'Q': 0.01, 'R': 0.015, 'S': 0.08, 'T': 0.06, 'U': 0.005, 'V': 0.003, 'W': 0.04, 'X': 0.12,
+    'Y': 0.04, 'Z': 0.005,
+}
+NTEE_SUFFIXES = ['01', '02', '03', '05', '11', '12', '19', '20', '22', '30', '32', '40', '50', '60', '80', '99']
+MISSING_NTEE_SHARE = 0.1
+
+# CSVs produced by the pipeline in the benchmarks rather than copied from data/
+GENERATED_CSVS = {'form990_embf.csv', 'df_city_nteena_cluster.csv', 'df_env_city_cluster.csv'}
+
+
+def _locations(rng, n):
+    # ZIP (ZIP+4, ZIP5 or missing), CITY and STATE of n organizations
+    centroids = pd.read_csv(os.path.join(SOURCE_DIR, 'zip_centroids.csv'), dtype={'ZIP': str})
+    targets = cities.mask(centroids, cities.target_labels())
+    weights = rng.lognormal(0, 1.5, len(centroids)) * np.where(targets, TARGET_CITY_WEIGHT, 1)
+    picked = centroids.iloc[rng.choice(len(centroids), n, p=weights / weights.sum())]
+    zips = picked['ZIP'].to_numpy(dtype=object)
+    style = rng.random(n)
+    plus4 = np.char.zfill(rng.integers(0, 10_000, n).astype(str), 4).astype(object)
+    zips = np.where(style < 0.6, zips + '-' + plus4, np.where(style < 0.95, zips, None))
+    return zips, picked['CITY'].to_numpy(dtype=object), picked['STATE'].to_numpy(dtype=object)
+
+
+def _ntee_codes(rng, n):
+    letters = np.array(list(NTEE_MAJOR_SHARES), dtype=object)
+    shares = np.array(list(NTEE_MAJOR_SHARES.values()))
+    codes = rng.choice(letters, n, p=shares / shares.sum()) + rng.choice(np.array(NTEE_SUFFIXES, dtype=object), n)
+    return np.where(rng.random(n) < MISSING_NTEE_SHARE, None, codes)
+
+
+def _amounts(rng, n, mean=12.0, sigma=2.5):
+    amounts = np.round(rng.lognormal(mean, sigma, n))
+    return np.where(rng.random(n) < ZERO_AMOUNT_SHARE, 0.0, amounts)
+
+
+def _amount_code(amounts):
+    # EO BMF ASSET_CD/INCOME_CD: 0 for none, then one code per bracket ($1 to $10M+)
+    return np.digitize(amounts, [1, 5_000, 10_000, 25_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000]).astype(np.int8)
+
+
+def ebmf_frame(rng, ein):
+    # EO BMF rows of the organizations in ein
+    n = len(ein)
+    zips, cities, states = _locations(rng, n)
+    ruling_year = np.clip(np.round(2024 - rng.gamma(2.0, 12.0, n)), 1910, 2023).astype(np.int32)
+    assets = _amounts(rng, n)
+    income = np.where(assets > 0, np.round(assets * rng.lognormal(-0.5, 1.0, n)), _amounts(rng, n, 10.0, 2.0))
+    revenue = np.round(income * rng.uniform(0.6, 1.0, n))
+    names = np.char.add('ORGANIZATION ', ein.astype(str)).astype(object)
+    return pa.table({
+        'EIN': pa.array(ein, pa.int64()),
+        'NAME': pa.array(names, pa.string()),
+        'ICO': pa.array(np.where(rng.random(n) < 0.3, '% ' + names, None), pa.string()),
+        'STREET': pa.array(np.char.add(rng.integers(1, 9999, n).astype(str), ' MAIN ST').astype(object), pa.string()),
+        'CITY': pa.array(cities, pa.string()),
+        'STATE': pa.array(states, pa.string()),
+        'ZIP': pa.array(zips, pa.string()),
+        'GROUP': pa.array(np.where(rng.random(n) < 0.9, 0, rng.integers(1, 9999, n)), pa.int16()),
+        'SUBSECTION': pa.array(rng.choice([3, 4, 5, 6, 7, 8, 13, 19], n, p=[0.72, 0.06, 0.03, 0.04, 0.04, 0.03, 0.02, 0.06]), pa.int8()),
+        'AFFILIATION': pa.array(rng.choice([3, 6, 9], n, p=[0.85, 0.1, 0.05]), pa.int8()),
+        'CLASSIFICATION': pa.array(rng.choice([1000, 1200, 2000, 7000], n), pa.int16()),
+        'RULING': pa.array(ruling_year * 100 + rng.integers(1, 13, n), pa.int32()),
+        'DEDUCTIBILITY': pa.array(rng.choice([1, 2], n, p=[0.8, 0.2]), pa.int8()),
+        'FOUNDATION': pa.array(rng.choice([0, 4, 10, 15, 16, 17], n, p=[0.2, 0.1, 0.05, 0.45, 0.1, 0.1]), pa.int8()),
+        'ACTIVITY': pa.array(np.where(rng.random(n) < 0.7, 0, rng.integers(1, 999_999_999, n)), pa.int32()),
+        'ORGANIZATION': pa.array(rng.choice([1, 2, 3, 5], n, p=[0.9, 0.04, 0.04, 0.02]), pa.int8()),
+        'STATUS': pa.array(np.ones(n), pa.int8()),
+        'TAX_PERIOD': pa.array(np.where(rng.random(n) < 0.2, None, rng.choice([2020, 2021, 2022], n) * 100 + 12), pa.int32()),
+        'ASSET_CD': pa.array(_amount_code(assets), pa.int8()),
+        'INCOME_CD': pa.array(_amount_code(income), pa.int8()),
+        'FILING_REQ_CD': pa.array(rng.choice([0, 1, 2, 6, 13], n, p=[0.15, 0.45, 0.3, 0.05, 0.05]), pa.int8()),
+        'PF_FILING_REQ_CD': pa.array(np.zeros(n), pa.int8()),
+        'ACCT_PD': pa.array(rng.choice([12, 6, 9], n, p=[0.8, 0.1, 0.1]), pa.int8()),
+        'ASSET_AMT': pa.array(assets, pa.float64()),
+        'INCOME_AMT': pa.array(income, pa.float64()),
+        'REVENUE_AMT': pa.array(revenue, pa.float64()),
+        'NTEE_CD': pa.array(_ntee_codes(rng, n), pa.string()),
+        'SORT_NAME': pa.array(np.full(n, None), pa.string()),
+    }, schema=ebmf_union.EBMF_SCHEMA)
+
+
+def organizations(rng, rows):
+    # rows distinct EINs in random order
+    spacing = 89
+    return rng.permutation(10_000_000 + np.arange(rows, dtype=np.int64) * spacing + rng.integers(0, spacing, rows))
+
+
+def write_ebmf(data_dir, rows, rng):
+    # Regional CSVs; returns the EINs of the organizations
+    ein = organizations(rng, rows)
+    region = rng.choice(list(REGION_SHARES), rows, p=list(REGION_SHARES.values()))
+    # A few organizations are also listed in another region
+    duplicated = rng.random(rows) < DUPLICATE_SHARE
+    other = rng.choice(list(REGION_SHARES), rows)
+
+    source_dir = os.path.join(data_dir, 'EBMF')
+    os.makedirs(source_dir, exist_ok=True)
+    writers = {
+        name: pv.CSVWriter(os.path.join(source_dir, ebmf_union.REGIONS[name]), ebmf_union.EBMF_SCHEMA)
+        for name in REGION_SHARES
+    }
+    try:
+        for start in range(0, rows, CHUNK_ROWS):
+            chunk = slice(start, start + CHUNK_ROWS)
+            table = ebmf_frame(rng, ein[chunk])
+            for name, writer in writers.items():
+                listed = (region[chunk] == name) | (duplicated[chunk] & (other[chunk] == name))
+                writer.write_table(table.filter(pa.array(listed)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return ein
+
+
+def _expenses(rng, totals):
+    # Expense columns of the filings: shares of the total functional expenses, some missing
+    n = len(totals)
+    columns = {}
+    for column in expense_categories.EXPENSE_COLUMNS:
+        amounts = np.round(totals * rng.beta(1, 7, n))
+        columns[column] = np.where(rng.random(n) < 0.3, np.nan, amounts)
+    columns['totfuncexpns'] = totals
+    return columns
+
+
+def write_form990(data_dir, ein, rng):
+    # Yearly converted extracts (form990/year=<yyyy>/) and the single-year 22eoextract990.csv
+    filers = ein[rng.random(len(ein)) < FORM990_SHARE]
+    revenue = np.round(rng.lognormal(12.5, 2.0, len(filers)))
+    active = np.ones(len(filers), dtype=bool)
+    for year in FORM990_YEARS:
+        # Filers drop out and amounts drift from year to year
+        active &= rng.random(len(filers)) < FORM990_RETENTION
+        revenue = np.round(revenue * rng.lognormal(0.03, 0.25, len(filers)))
+        keep = np.flatnonzero(active)
+        amended = keep[rng.random(len(keep)) < AMENDED_SHARE]
+        rows = np.concatenate([keep, amended])
+        periods = np.where(np.arange(len(rows)) < len(keep), year * 100 + 12, year * 100 + 6)
+        totals = np.round(revenue[rows] * rng.uniform(0.7, 1.1, len(rows)))
+        frame = pl.DataFrame({
+            'ein': pl.Series(filers[rows], dtype=pl.Int64),
+            'tax_pd': pl.Series(periods, dtype=pl.Float64),
+            'totrevenue': pl.Series(revenue[rows], dtype=pl.Float64),
+            'totassetsend': pl.Series(np.round(revenue[rows] * rng.lognormal(0.5, 1.0, len(rows))), dtype=pl.Float64),
+            **{column: pl.Series(values, dtype=pl.Float64, nan_to_null=True) for column, values in _expenses(rng, totals).items()},
+            'year': pl.Series(np.full(len(rows), year), dtype=pl.Int16),
+        })
+        out_dir = os.path.join(data_dir, 'form990', f'year={year}')
+        os.makedirs(out_dir, exist_ok=True)
+        frame.write_parquet(os.path.join(out_dir, 'part-0.parquet'))
+
+    # Single-year extract read by ebmf_union.join_form990 (uppercase EIN, as the IRS file has it)
+    extract = frame.drop('year', 'totrevenue', 'totassetsend').rename({'ein': 'EIN'})
+    extract.write_csv(os.path.join(data_dir, '22eoextract990.csv'))
+    return frame.height
+
+
+def copy_dashboard_csvs(data_dir):
+    for filename in os.listdir(SOURCE_DIR):
+        if filename.endswith('.csv') and filename not in GENERATED_CSVS:
+            shutil.copy(os.path.join(SOURCE_DIR, filename), os.path.join(data_dir, filename))
+
+
+def write_cluster_tables(data_dir, sample_rows=50_000, seed=SEED):
+    # df_city_nteena_cluster.csv / df_env_city_cluster.csv as the clustering notebook
+    # exported them: EO BMF rows of the cities of interest with their k-means cluster.
+    # Run after financial_clusters.py has labelled the organizations.
+    import ntee
+    ebmf = ebmf_union.read_ebmf()
+    clusters = pd.read_parquet(os.path.join(data_dir, 'ebmf_clusters.parquet'))
+    ebmf = ebmf[cities.mask(ebmf, cities.target_labels())].merge(clusters, on='EIN')
+    ebmf = ebmf.sample(min(sample_rows, len(ebmf)), random_state=seed).sort_index()
+    majors = ntee.major_group(ebmf['NTEE_CD'])
+    ebmf = ebmf.assign(RULING_YEAR=ebmf['RULING'] // 100, NTEE_NAME=ntee.major_name(majors).to_numpy())
+    columns = [field.name for field in ebmf_union.EBMF_SCHEMA] + ['RULING_YEAR', 'NTEE_NAME', 'CLUSTER_KMEANS']
+    ebmf[columns].to_csv(os.path.join(data_dir, 'df_city_nteena_cluster.csv'), index=False)
+    ebmf.loc[majors.isin(ntee.ENV_CIVIL_RIGHTS).to_numpy(), columns].to_csv(os.path.join(data_dir, 'df_env_city_cluster.csv'), index=False)
+
+
+def generate(data_dir, rows, seed=SEED):
+    # Write the synthetic data directory; returns (EO BMF rows, Form 990 rows of the last year)
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    copy_dashboard_csvs(data_dir)
+    ein = write_ebmf(data_dir, rows, rng)
+    return len(ein), write_form990(data_dir, ein, rng)
+
+
+if __name__ == '__main__':
+    data_dir = sys.argv[1]
+    rows = int(SCALES.get(sys.argv[2], sys.argv[2])) if len(sys.argv) > 2 else SCALES['10k']
+    organizations_written, filings = generate(data_dir, rows)
+    print(f'{organizations_written:,} organizations, {filings:,} Form 990 filings per year in {data_dir}')
@@ -0,0 +1,430 @@
+# Frames and figures of the city dashboards, independent of the UI framework.
+#
+# The Streamlit dashboard (targeted_city_analysis.py, through the cached views of
+# city_views.py) and the Shiny port (city_shiny/) draw the same charts. This module holds
+# what they share:
+#   - frame functions that load or derive the data of a chart (load_slice, load_clusters,
+#     cluster_medians, ntee_cluster_distribution, ...),
+#   - figure functions that take those frames and return a plotly figure.
+# A chart is a frame function feeding a figure function, so each framework can cache or
+# recompute the frames on its own terms: city_views caches whole views per widget option,
+# the Shiny app shares each frame between the outputs that read it.
+# Nothing here imports streamlit or shiny.
+
+import os
+import sys
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'data_preprocessing'))
+import aggregate_cube
+import cities as city_labels
+import data_store
+import density_bins
+import financial_clusters
+import form990_panel
+import ntee
+import quantile_sketch
+import scatter_lod
+
+FUND_COLUMNS = ['ASSET_AMT', 'INCOME_AMT', 'REVENUE_AMT']
+CLUSTER_DATASETS = {
+    'All nonprofits': 'df_city_nteena_cluster',
+    'Environmental and civil rights nonprofits': 'df_env_city_cluster',
+    'Among all nonprofits': 'df_city_nteena_cluster',
+    'Among environmental and civil rights nonprofits': 'df_env_city_cluster',
+}
+
+# Slices behind the views with a Year/Decade and a Top 5/Environment option
+RULING_SLICES = {'Year': 'df_city_rulingyear', 'Decade': 'df_city_decade'}
+NTEE_RULING_SLICES = {
+    'Top 5 Nonprofits': 'df_city_rulingname_all',
+    'Environment & Civil Rights Focused': 'df_city_rulingname_grouped',
+}
+
+# Form 990 amounts offered by the funding momentum view
+MOMENTUM_METRICS = {'Revenue': 'totrevenue', 'Total expenses': 'totfuncexpns', 'Assets': 'totassetsend'}
+
+# Most bins the density map sends to the browser, whatever the zoom level
+MAX_MAP_BINS = 20_000
+
+
+##################################################
+# Frames
+
+def cube_available():
+    return aggregate_cube.signature() is not None
+
+
+def cube_cities():
+    # "CITY, ST" labels of the cities in the cube (see cities.py)
+    counts, _ = aggregate_cube.load_cube()
+    pairs = counts[['CITY', 'STATE']].dropna().drop_duplicates()
+    return sorted(city_labels.label(pairs['CITY'], pairs['STATE']))
+
+
+def target_cities(cities):
+    # The original cities of interest among `cities`
+    return [city for city in city_labels.target_labels() if city in cities]
+
+
+def density_zooms():
+    # Zoom levels of the density map, empty until density_bins.py has been run
+    return density_bins.available_zooms() if density_bins.signature() is not None else []
+
+
+def panel_available():
+    return data_store.exists('form990_panel')
+
+
+def load_slice(name, cities):
+    # data/<name>.csv, or the same slice rolled up from the cube for the selected cities
+    if cities is not None and cube_available():
+        return aggregate_cube.dashboard_slice(name, cities)
+    return data_store.load(name)
+
+
+def load_clusters(dataset):
+    return data_store.load(dataset).astype({'CLUSTER_KMEANS': str})
+
+
+# Columns of the static hypothesis_testing_results.csv table
+HYPOTHESIS_COLUMNS = {'FUND_TYPE': 'Fund Type', 'T_STAT': 'T-stat', 'P_VALUE': 'P-value'}
+HYPOTHESIS_DETAIL_COLUMNS = {
+    'P_PERMUTATION': 'Permutation p-value',
+    'P_VALUE_BH': 'P-value (Benjamini-Hochberg)',
+    'P_VALUE_HOLM': 'P-value (Holm)',
+}
+
+
+def hypothesis_tests():
+    # Target vs non-target cities, from hypothesis_tests.py when it has been run
+    if not data_store.exists('hypothesis_tests'):
+        return data_store.load('hypothesis_testing_results')
+    results = data_store.load('hypothesis_tests')
+    results = results[results['FAMILY'] == 'CITY_TARGET']
+    columns = {**HYPOTHESIS_COLUMNS, **HYPOTHESIS_DETAIL_COLUMNS}
+    return results[list(columns)].rename(columns=columns).reset_index(drop=True)
+
+
+def city_hypothesis_tests(cities):
+    # Each selected city vs all other organizations (None when hypothesis_tests.py has not been run)
+    if not data_store.exists('hypothesis_tests'):
+        return None
+    cities = cities if cities is not None else city_labels.target_labels()
+    results = data_store.load('hypothesis_tests')
+    results = results[(results['FAMILY'] == 'CITY') & results['GROUP'].isin(cities)]
+    columns = {'GROUP': 'City', 'N_GROUP': 'EINs', **HYPOTHESIS_COLUMNS, **HYPOTHESIS_DETAIL_COLUMNS}
+    return results[list(columns)].rename(columns=columns).reset_index(drop=True)
+
+
+def momentum(option, cities):
+    # Median year-over-year growth per city and year, from the panel built by form990_panel.py
+    metric = MOMENTUM_METRICS[option]
+    growth = form990_panel.rollup(('CITY', 'STATE', 'year'), [metric], cities).dropna(subset=[f'{metric}_growth'])
+    return growth.assign(CITY=city_labels.label(growth['CITY'], growth['STATE'])).drop(columns='STATE')
+
+
+def cluster_labels(df_clusters):
+    return sorted(df_clusters['CLUSTER_KMEANS'].unique())
+
+
+def ntee_cluster_distribution(df_env_city_cluster):
+    ntee_distribution = df_env_city_cluster.groupby(['CLUSTER_KMEANS', 'NTEE_NAME'], observed=True).size().unstack().fillna(0).reset_index()
+    return ntee_distribution.melt(id_vars=['CLUSTER_KMEANS'], value_vars=['Civil Rights, Social Action & Advocacy','Environment'], var_name='NTEE',value_name='Number of Nonprofits')
+
+
+def cluster_medians(option):
+    # Medians from quantile sketches (see quantile_sketch.py): the full-population sketches
+    # from financial_clusters.py when it has been run, sketches of the exported CSV otherwise
+    if data_store.exists('cluster_sketches'):
+        sketches = data_store.load('cluster_sketches')
+        if CLUSTER_DATASETS[option] == 'df_env_city_cluster':
+            sketches = sketches[sketches['NTEE_MAJOR'].isin(ntee.ENV_CIVIL_RIGHTS)]
+        medians = quantile_sketch.quantiles(sketches, ['CLUSTER_KMEANS', 'FUND_TYPE'], 0.5)
+        return medians.rename(columns={'VALUE': 'AMOUNT'}).astype({'CLUSTER_KMEANS': str})
+
+    cluster_analysis = quantile_sketch.group_quantiles(load_clusters(CLUSTER_DATASETS[option]), ['CLUSTER_KMEANS'], FUND_COLUMNS, 0.5)
+    return cluster_analysis.melt(id_vars=['CLUSTER_KMEANS'], value_vars=['INCOME_AMT', 'ASSET_AMT', 'REVENUE_AMT'], var_name='FUND_TYPE', value_name='AMOUNT')
+
+
+def high_finance_names(cities):
+    # Full-population clusters from financial_clusters.py, when it has been run
+    if data_store.exists('cluster_high_impact'):
+        df_names_highfinance = data_store.load('cluster_high_impact')
+        if cities is not None:
+            df_names_highfinance = df_names_highfinance[city_labels.mask(df_names_highfinance, cities)]
+        df_names_highfinance = df_names_highfinance[['NAME', 'CITY', 'STATE', 'NTEE_NAME', 'CLUSTER_KMEANS']].astype({'CLUSTER_KMEANS': str})
+        return df_names_highfinance.reset_index(drop=True)
+
+    df_env_city_cluster = load_clusters('df_env_city_cluster')
+    df_names_highfinance = df_env_city_cluster[(df_env_city_cluster['CLUSTER_KMEANS']=='1') | (df_env_city_cluster['CLUSTER_KMEANS']=='2')]
+    df_names_highfinance = df_names_highfinance[['NAME', 'CITY', 'NTEE_NAME','CLUSTER_KMEANS']]
+    return df_names_highfinance.reset_index(drop=True)
+
+
+##################################################
+# Map and Section 1: Distribution and Allocation of Funds
+
+def density_map(zoom):
+    # zoom is a zoom level with density bins (see density_bins.py), None for the city map
+    if zoom is not None:
+        # Sparse cells are merged into coarser ones rather than dropped, and the title says so
+        bins, levels = density_bins.coarsen(density_bins.read_bins(zoom), MAX_MAP_BINS)
+        title = 'Density Map of EINs'
+        if levels:
+            title += f' ({2 ** levels}x{2 ** levels} cells merged per point, at most {MAX_MAP_BINS:,} points)'
+        fig = px.scatter_mapbox(
+            bins,
+            lat='Latitude',
+            lon='Longitude',
+            size='EIN',
+            color='EIN',
+            color_continuous_scale='Viridis',
+            hover_data={'EIN': True, 'Latitude': False, 'Longitude': False},
+            labels={'EIN': 'EINs'},
+            size_max=15,
+            zoom=zoom,
+            center={'lat': np.average(bins['Latitude'], weights=bins['EIN']), 'lon': np.average(bins['Longitude'], weights=bins['EIN'])} if len(bins) else None,
+            mapbox_style='carto-positron',
+            title=title
+        )
+        fig.update_layout(height=700)
+        return fig
+
+    fig = px.scatter_mapbox(
+        data_store.load('df_org_locals'),
+        lat='Latitude',
+        lon='Longitude',
+        size='COUNT',
+        hover_name='CITY',
+        hover_data={'COUNT': True, 'Latitude': False, 'Longitude': False},
+        size_max=15,
+        zoom=3,
+        mapbox_style='carto-positron',
+        title='Density Map of EINs in Selected Cities'
+    )
+    fig.update_layout(height=700)
+    return fig
+
+
+def city_funds(melted_city_funds):
+    fig = px.bar(melted_city_funds, x='CITY', y='AMOUNT', color='FUND_TYPE', barmode='group')
+    fig.update_layout(title='Median Nonprofit Financial Breakdown By City',
+        xaxis_tickfont_size=14,
+        height=500,
+        yaxis=dict(
+            title='USD (billions)',
+            titlefont_size=16,
+            tickfont_size=14,
+        ),
+        xaxis=dict(
+            title='City'
+        ),
+        legend=dict(
+            bgcolor='rgba(255, 255, 255, 0)',
+            bordercolor='rgba(255, 255, 255, 0)'
+        ),
+        bargap=0.15,  # gap between bars of adjacent location coordinates.
+        bargroupgap=0.1  # gap between bars of the same location coordinate.
+    )
+    return fig
+
+
+def income_box(df_combined):
+    fig = px.box(
+        df_combined[df_combined['FUND_TYPE'] == 'INCOME_AMT'],
+        x='CITY_TARGET',
+        y='AMOUNT',
+        title='Comparison of Income between Targeted and Non-Targeted Cities'
+    )
+    fig.update_layout(
+        yaxis=dict(type='log', title='Amount (log scale)'),
+        xaxis=dict(title='City Target (1 = Yes, 0 = No)'),
+        title=dict(
+            text='Comparison of Income between Targeted and Non-Targeted Cities',
+            x=0.5,
+            xanchor='center'
+        ),
+        height=500,
+    )
+    return fig
+
+
+##################################################
+# Section 2: Financial Transparency and Accountability
+
+def filing_percentage(df_filing_percentage):
+    fig = px.bar(df_filing_percentage, x='CITY', y='Percentage_Not_Required_to_File', title='Percentage of Total EINs Not Required to File by City')
+    fig.update_layout(
+        yaxis=dict(
+            title='Percentage of Total EINs Not Required to File'
+        ),
+        xaxis=dict(
+            title='City'
+        ),
+        height=500,
+    )
+    return fig
+
+
+##################################################
+# Section 3: Trends over Time
+
+def ruling_trend(df, option):
+    if option == "Year":
+        # Plot ruling year
+        fig = px.line(df, x='RULING_YEAR', y='EIN')
+        fig.update_layout(
+            title='Number of Nonprofits in Targeted Cities by Ruling Year',
+            xaxis=dict(title='Ruling Year'),
+            yaxis=dict(title='Number of Nonprofits'),
+            height=500,
+        )
+    else:
+        # Plot ruling decade
+        fig = px.line(df, x='RULING', y='EIN')
+        fig.update_layout(
+            title='Number of Nonprofits in Targeted Cities by Ruling Decade',
+            xaxis=dict(title='Ruling Decade'),
+            yaxis=dict(title='Number of Nonprofits'),
+            height=500,
+        )
+    return fig
+
+
+def ntee_names(df_nteename_groupby):
+    # plot group by name and count
+    fig = px.bar(df_nteename_groupby, x='EIN', y='NTEE_NAME')
+    fig.update_layout(
+        title='NTEE Name Distribution',
+        xaxis=dict(title='Number of Nonprofits'),
+        yaxis=dict(title='NTEE Name'),
+        width=1000,
+        height=600,)
+    return fig
+
+
+def ntee_names_by_city(df_nteename_city_groupby):
+    # plot by city and name
+    fig = px.bar(df_nteename_city_groupby, x='CITY', y='EIN', color='NTEE_NAME', barmode='group')
+    fig.update_layout(
+        title='NTEE Name Distribution by City',
+        xaxis=dict(title='City'),
+        yaxis=dict(title='Number of Nonprofits'),
+        width=1000,
+        height=500,)
+    return fig
+
+
+def ntee_ruling_trend(df, option):
+    if option == "Top 5 Nonprofits":
+        # NTEE Name Distribution by Ruling Years of Interest
+        title = 'Top 5 NTEE Distribution by Ruling Years'
+    else:
+        # Targeted NTEE Name Distribution by Ruling Year
+        title = 'Environmental & Civil Rights NTEE Distribution by Ruling Year'
+    fig = px.line(df, x='RULING_YEAR', y='EIN', color='NTEE_NAME')
+    fig.update_layout(
+        title=title,
+        xaxis=dict(title='Ruling Year'),
+        yaxis=dict(title='Number of Nonprofits'),
+        width=1000,
+        height=600,)
+    return fig
+
+
+def funding_momentum(df, option):
+    metric = MOMENTUM_METRICS[option]
+    fig = px.line(
+        df,
+        x='year',
+        y=f'{metric}_growth',
+        color='CITY',
+        markers=True,
+        hover_data={'EIN': True, metric: ':,.0f', f'{metric}_volatility': ':.2f'},
+        labels={'EIN': 'Form 990 filers', metric: f'Total {option.lower()}', f'{metric}_volatility': 'Median volatility'},
+    )
+    fig.update_layout(
+        title=f'Median Year-over-Year {option} Growth of Form 990 Filers',
+        xaxis=dict(title='Year', dtick=1),
+        yaxis=dict(title='Median Growth Rate', tickformat='.0%'),
+        height=500,
+    )
+    return fig
+
+
+##################################################
+# Section 4: ML Trends
+
+def cluster_scatter(df_clusters, option, detail, clusters):
+    # (figure, stats) where stats reports the points sent and the figure's size
+    if option == "All nonprofits":
+        title = '3D Clusters of All Organizations by Financial Health'
+    else:
+        title = '3D Clusters of Environmental and Civil Rights Organizations by Financial Health'
+    if clusters:
+        df_clusters = df_clusters[df_clusters['CLUSTER_KMEANS'].isin(clusters)]
+    # Level of detail: stratified sample, outliers and cluster centers (see scatter_lod.py)
+    points, outliers = scatter_lod.sample(df_clusters, scatter_lod.DETAIL_LEVELS[detail])
+    fig = px.scatter_3d(points,
+                    x='ASSET_AMT',
+                    y='INCOME_AMT',
+                    z='REVENUE_AMT',
+                    color='CLUSTER_KMEANS',
+                    color_discrete_sequence=px.colors.qualitative.G10,
+                    category_orders={'CLUSTER_KMEANS': sorted(df_clusters['CLUSTER_KMEANS'].unique())},
+                    hover_data={'NTEE_NAME': True, 'NAME': True})
+    # The k-means centroids (back in dollars) when financial_clusters.py has been run,
+    # the per-cluster medians otherwise
+    if os.path.exists(financial_clusters.MODEL_PATH):
+        centers, kind = financial_clusters.centers(financial_clusters.load_model()).astype({'CLUSTER_KMEANS': str}), 'centroid'
+        centers = centers[centers['CLUSTER_KMEANS'].isin(df_clusters['CLUSTER_KMEANS'].unique())]
+    else:
+        centers, kind = scatter_lod.medians(df_clusters), 'median'
+    fig.add_trace(go.Scatter3d(
+        x=centers['ASSET_AMT'], y=centers['INCOME_AMT'], z=centers['REVENUE_AMT'],
+        mode='markers', name=f'Cluster {kind}s', text=centers['CLUSTER_KMEANS'],
+        marker=dict(symbol='diamond', size=8, color='black'),
+        hovertemplate=f'Cluster %{{text}}<extra>{kind}</extra>',
+    ))
+    fig.update_layout(
+        title=title,
+        scene = dict(
+                        xaxis_title='Asset Amount',
+                        yaxis_title='Income Amount',
+                        zaxis_title='Revenue Amount',
+                    ),
+        width=700,
+        height=500,
+    )
+    stats = {
+        'points': len(points),
+        'total': len(df_clusters),
+        'outliers': outliers,
+        'payload_bytes': len(fig.to_json()),
+    }
+    return fig, stats
+
+
+def ntee_cluster_figure(ntee_distribution):
+    fig = px.bar(ntee_distribution, x='CLUSTER_KMEANS', y='Number of Nonprofits', color='NTEE', barmode='group')
+    fig.update_layout(title='Number of Environmental and Civil Rights Nonprofits by Cluster (Log Transformed)',
+                      xaxis=dict(title='Cluster'),
+                      yaxis=dict( type='log'),
+                      width=800,
+                      height=500,)
+    return fig
+
+
+def cluster_medians_figure(medians):
+    fig = px.bar(medians, x='CLUSTER_KMEANS', y='AMOUNT', color='FUND_TYPE', barmode='group')
+    fig.update_layout(title='KMeans Clusters by Median Funding Amount',
+                    xaxis=dict(title='Cluster'),
+        yaxis=dict(title='Amount (Log Transformed)', type='log'),  # Log transformation
+        width=1000,
+        height=600,
+    )
+    return fig
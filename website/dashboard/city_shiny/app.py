@@ -0,0 +1,248 @@
+# Shiny port of targeted_city_analysis.py.
+#
+# Streamlit reruns the whole script on every input change. Here each derived frame is a
+# reactive.calc that the outputs reading it share (the filing percentages feed the bar
+# chart and the table, the cluster frame feeds the scatter and the cluster choices, ...),
+# and Shiny tracks which inputs each calc and output reads: changing the detail of the
+# cluster scatter redraws the scatter only, changing the cities recomputes the city
+# slices and the outputs drawn from them, and outputs in hidden tabs wait until their
+# tab is shown. The frames and figures are the ones of the Streamlit dashboard
+# (city_charts.py); the data_store and cube caches behind them are shared by all sessions.
+#
+# Usage (from the repo root):
+#   shiny run website/dashboard/city_shiny/app.py
+
+import time
+
+import plotly.io as pio
+from shared import all_cities, city_charts, target_cities, zooms
+from shiny import reactive
+from shiny.express import input, render, ui
+from shinywidgets import render_plotly
+
+# On the path set up by shared.py
+import data_store
+import scatter_lod
+
+
+def widget(fig):
+    # shinywidgets sends figures through json.dumps, which rejects the NaNs of missing hover
+    # values (e.g. NTEE_NAME); plotly's own encoder writes them as nulls
+    return pio.from_json(fig.to_json())
+
+
+ui.page_opts(title="Philanthropic Analysis in Cities of Interest", fillable=False)
+
+with ui.sidebar():
+    if all_cities:
+        # An empty selection falls back to the original cities of interest
+        ui.input_selectize("cities", "Cities of interest:", all_cities, selected=target_cities, multiple=True)
+    if len(zooms) > 1:
+        ui.input_select("zoom", "Map detail (zoom level):", [str(zoom) for zoom in zooms])
+
+ui.markdown("""
+This dashboard provides an overview of philanthropic funds in various cities that are US based, contain a presence of Environmental Justice (EJ) communities,
+and individuals who engage with digital divide and climate change.
+The following analysis includes a density map of EINs, a breakdown of philanthropic fund types by city, and the results of hypothesis testing on fund amounts.
+""")
+
+
+@reactive.calc
+def cities():
+    # Selected cities, None for the exported CSVs of the original cities of interest
+    if not all_cities:
+        return None
+    return tuple(sorted(input.cities())) or None
+
+
+@render_plotly
+def density_map():
+    # With density bins (density_bins.py) the map shows every organization, binned for the
+    # selected zoom level; otherwise one point per city of interest
+    zoom = int(input.zoom()) if len(zooms) > 1 else (zooms or [None])[0]
+    return widget(city_charts.density_map(zoom))
+
+
+with ui.navset_tab(id="section"):
+
+    ##################################################
+    # Section 1: Distribution and Allocation of Funds
+    with ui.nav_panel("Distribution and Allocation of Funds"):
+
+        @reactive.calc
+        def melted_city_funds():
+            return city_charts.load_slice('melted_city_funds', cities())
+
+        ui.h4("How are philanthropic finances distributed across these cities?")
+
+        @render_plotly
+        def city_funds():
+            return widget(city_charts.city_funds(melted_city_funds()))
+
+        ui.h4("Are there significant differences in the allocation of funds between these cities engaged in addressing the digital divide and climate change compared to those that are not?")
+
+        @render.data_frame
+        def hypothesis_tests():
+            return city_charts.hypothesis_tests()
+
+        @render.data_frame
+        def city_hypothesis_tests():
+            # Each city of interest vs all other organizations, when hypothesis_tests.py has been run
+            return city_charts.city_hypothesis_tests(cities())
+
+        ui.h4("How does income compare between targeted and non-targeted cities?")
+
+        @render_plotly
+        def income_box():
+            return widget(city_charts.income_box(data_store.load('df_combined')))
+
+    ##################################################
+    # Section 2: Financial Transparency and Accountability
+    with ui.nav_panel("Financial Transparency and Accountability"):
+
+        @reactive.calc
+        def filing():
+            return city_charts.load_slice('df_filing_percentage', cities())
+
+        ui.h4("How transparent are the financial activities or organizations in these cities?")
+
+        @render_plotly
+        def filing_percentage():
+            return widget(city_charts.filing_percentage(filing()))
+
+        @render.data_frame
+        def filing_table():
+            return filing()
+
+    ##################################################
+    # Section 3: Trends over Time
+    with ui.nav_panel("Trends over Time"):
+
+        @reactive.calc
+        def ruling():
+            return city_charts.load_slice(city_charts.RULING_SLICES[input.ruling_view()], cities())
+
+        @reactive.calc
+        def ntee_names_frame():
+            return city_charts.load_slice('df_nteename_groupby', cities())
+
+        @reactive.calc
+        def ntee_names_by_city_frame():
+            return city_charts.load_slice('df_nteename_city_groupby', cities())
+
+        @reactive.calc
+        def ntee_ruling():
+            return city_charts.load_slice(city_charts.NTEE_RULING_SLICES[input.ntee_view()], cities())
+
+        ui.h4("How has the growth of nonprofit organizations evolved over time in these cities?")
+        ui.input_radio_buttons("ruling_view", "Select View:", list(city_charts.RULING_SLICES), inline=True)
+
+        @render_plotly
+        def ruling_trend():
+            return widget(city_charts.ruling_trend(ruling(), input.ruling_view()))
+
+        ui.h4("Can we use the nonprofit categories (NTEE Codes) to help explain this futher?")
+
+        @render_plotly
+        def ntee_names():
+            return widget(city_charts.ntee_names(ntee_names_frame()))
+
+        @render_plotly
+        def ntee_names_by_city():
+            return widget(city_charts.ntee_names_by_city(ntee_names_by_city_frame()))
+
+        ui.input_radio_buttons("ntee_view", "Select View:", list(city_charts.NTEE_RULING_SLICES), inline=True)
+
+        @render_plotly
+        def ntee_ruling_trend():
+            return widget(city_charts.ntee_ruling_trend(ntee_ruling(), input.ntee_view()))
+
+        # Funding momentum of Form 990 filers, from the panel built by form990_panel.py
+        if city_charts.panel_available():
+
+            @reactive.calc
+            def momentum():
+                return city_charts.momentum(input.momentum_metric(), cities())
+
+            ui.h4("Is funding momentum building in these cities?")
+            ui.input_radio_buttons("momentum_metric", "Select Amount:", list(city_charts.MOMENTUM_METRICS), inline=True)
+
+            @render_plotly
+            def funding_momentum():
+                return widget(city_charts.funding_momentum(momentum(), input.momentum_metric()))
+
+    ##################################################
+    # Section 4: ML Trends
+    with ui.nav_panel("Machine Learning Focus"):
+
+        @reactive.calc
+        def clusters_frame():
+            return city_charts.load_clusters(city_charts.CLUSTER_DATASETS[input.cluster_view()])
+
+        @reactive.calc
+        def cluster_scatter_result():
+            start = time.perf_counter()
+            fig, stats = city_charts.cluster_scatter(clusters_frame(), input.cluster_view(), input.detail(), input.clusters())
+            return fig, {**stats, 'build_ms': (time.perf_counter() - start) * 1000}
+
+        @reactive.calc
+        def ntee_distribution():
+            return city_charts.ntee_cluster_distribution(city_charts.load_clusters('df_env_city_cluster'))
+
+        @reactive.calc
+        def medians():
+            return city_charts.cluster_medians(input.medians_view())
+
+        @reactive.calc
+        def high_finance():
+            return city_charts.high_finance_names(cities())
+
+        ui.h4("Can we segment organizations into distinct clusters based on their financial health indicators (assets, income, revenue)?")
+        ui.input_radio_buttons("cluster_view", "Select View:", ["All nonprofits", "Environmental and civil rights nonprofits"], inline=True)
+        # Level of detail: a stratified sample per cluster plus every outlier and the cluster medians.
+        # More detail, or fewer clusters, adds points to the ones already shown.
+        with ui.layout_columns():
+            ui.input_radio_buttons("detail", "Detail:", list(scatter_lod.DETAIL_LEVELS), selected='Medium', inline=True)
+
+            @render.ui
+            def cluster_choices():
+                # Rebuilt, with nothing selected, when the view changes
+                return ui.input_selectize("clusters", "Clusters:", city_charts.cluster_labels(clusters_frame()), multiple=True)
+
+        @render_plotly
+        def cluster_scatter():
+            fig, _ = cluster_scatter_result()
+            return widget(fig)
+
+        @render.text
+        def cluster_scatter_stats():
+            _, stats = cluster_scatter_result()
+            return (f"{stats['points']:,} of {stats['total']:,} organizations shown ({stats['outliers']:,} outliers) + cluster medians; "
+                    f"figure payload {stats['payload_bytes'] / 1e6:.2f} MB, built in {stats['build_ms']:.0f} ms")
+
+        ui.h4("What is the distribution of environmental and civil rights nonprofits across the clusters?")
+
+        @render_plotly
+        def ntee_cluster_figure():
+            return widget(city_charts.ntee_cluster_figure(ntee_distribution()))
+
+        @render.data_frame
+        def ntee_cluster_table():
+            return ntee_distribution()
+
+        ui.h4("Which clusters of organizations have the highest potential financial impact?")
+        ui.input_radio_buttons("medians_view", "Select View:", ["Among all nonprofits", "Among environmental and civil rights nonprofits"], inline=True)
+
+        @render_plotly
+        def cluster_medians():
+            return widget(city_charts.cluster_medians_figure(medians()))
+
+        @render.data_frame
+        def cluster_medians_table():
+            return medians()
+
+        ui.h4("What nonprofits fall into clusters identified as having highest potential financial impact?")
+
+        @render.data_frame
+        def high_finance_names():
+            return high_finance()
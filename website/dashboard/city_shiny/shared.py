@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The frames and figures are shared with the Streamlit dashboard (see city_charts.py)
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import city_charts
+
+# Cities to roll the EO BMF views up to; empty without the aggregate cube (aggregate_cube.py)
+all_cities = city_charts.cube_cities() if city_charts.cube_available() else []
+target_cities = city_charts.target_cities(all_cities)
+zooms = city_charts.density_zooms()
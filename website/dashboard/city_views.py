@@ -0,0 +1,257 @@
+# Cached derived frames and figures for targeted_city_analysis.py.
+#
+# The frames and figures themselves are drawn by city_charts.py. Every view is a builder
+# registered with @view(name, *datasets). build(name, option, cities) runs the builder
+# through st.cache_data, keyed by the view name, the widget option, the selected cities
+# and the signatures of the data it reads, so:
+#   - toggling a selectbox back to a view already seen is a cache lookup,
+#   - the cache is shared by every session of the app,
+#   - editing one of the CSVs invalidates only the views that read it.
+# Views over slices of the EO BMF (ruling years, NTEE names, filing, median funds) are
+# rolled up from the aggregate cube for the selected cities once aggregate_cube.py has
+# been run, and fall back to the exported CSVs otherwise.
+# The cache is bounded (FIGURE_CACHE_ENTRIES, least recently used entries are evicted
+# first) and values are stored pickled, so each hit hands back a fresh copy.
+# Every build() and data load is timed as an instrumentation.py section.
+#
+# The dashboard's sections are registered with @section(title, *views). show(title, cities)
+# first loads the datasets of the section's views concurrently (PREFETCH_WORKERS threads;
+# Arrow reads and CSV conversion release the GIL), then renders it, so a section's data
+# is only read once the section is shown.
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'data_preprocessing'))
+import aggregate_cube
+import city_charts
+import data_store
+import density_bins
+import instrumentation
+
+FIGURE_CACHE_ENTRIES = 64
+FIGURE_CACHE_TTL = 24 * 60 * 60  # seconds
+
+# Pseudo-datasets for views that read the aggregate cube and the density bins
+CUBE = 'aggregate_cube'
+DENSITY = 'density_bins'
+
+# Threads loading the datasets of a section
+PREFETCH_WORKERS = 4
+# Datasets their views query in place (polars scans) rather than load through data_store
+SCANNED = {DENSITY, 'form990_panel'}
+
+_views = {}
+_sections = {}
+
+
+def view(name, *datasets):
+    # Register a builder(option, cities) under name; datasets are the CSVs (or CUBE) it reads
+    def register(builder):
+        _views[name] = (builder, datasets)
+        return builder
+    return register
+
+
+@st.cache_data(max_entries=FIGURE_CACHE_ENTRIES, ttl=FIGURE_CACHE_TTL, show_spinner=False)
+def _build(name, option, cities, version):
+    builder, _ = _views[name]
+    return builder(option, cities)
+
+
+def _signature(dataset):
+    if dataset == CUBE:
+        return aggregate_cube.signature()
+    if dataset == DENSITY:
+        return density_bins.signature()
+    try:
+        return data_store.signature(dataset)
+    except FileNotFoundError:
+        return None
+
+
+def build(name, option=None, cities=None):
+    # Cached result of the view registered as name for a widget option and city selection
+    _, datasets = _views[name]
+    version = tuple(_signature(dataset) for dataset in datasets)
+    if cities is not None:
+        cities = tuple(sorted(cities))
+    with instrumentation.section(f'view:{name}'):
+        return _build(name, option, cities, version)
+
+
+def cube_available():
+    return city_charts.cube_available()
+
+
+@st.cache_data(show_spinner=False)
+def _cube_cities(version):
+    return city_charts.cube_cities()
+
+
+def cube_cities():
+    return _cube_cities(aggregate_cube.signature())
+
+
+def section(title, *views):
+    # Register a section renderer(cities) under title; views are the views it builds
+    def register(renderer):
+        _sections[title] = (renderer, views)
+        return renderer
+    return register
+
+
+def sections():
+    return list(_sections)
+
+
+def section_datasets(title, cities):
+    # Datasets the views of a section load: the cube in place of the CSVs it rolls up
+    # when cities are selected, only the datasets that exist
+    use_cube = cities is not None and cube_available()
+    datasets = []
+    for name in _sections[title][1]:
+        view_datasets = _views[name][1]
+        if CUBE in view_datasets:
+            view_datasets = [CUBE] if use_cube else [d for d in view_datasets if d != CUBE]
+        datasets += [d for d in view_datasets if d not in datasets and d not in SCANNED]
+    return [d for d in datasets if (d == CUBE and use_cube) or (d != CUBE and data_store.exists(d))]
+
+
+def _load(dataset):
+    return aggregate_cube.load_cube() if dataset == CUBE else data_store.load(dataset)
+
+
+def prefetch(datasets):
+    # Load datasets into the data_store (and cube) caches concurrently
+    if not datasets:
+        return
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, len(datasets))) as pool:
+        list(pool.map(_load, datasets))
+
+
+def show(title, cities):
+    # Load the section's datasets, then render it
+    renderer, _ = _sections[title]
+    with instrumentation.section(f'section:{title}'):
+        with instrumentation.section('prefetch'):
+            prefetch(section_datasets(title, cities))
+        renderer(cities)
+
+
+def load_slice(name, cities):
+    with instrumentation.section(f'load:{name}'):
+        return city_charts.load_slice(name, cities)
+
+
+def load_clusters(dataset):
+    with instrumentation.section(f'load:{dataset}'):
+        return city_charts.load_clusters(dataset)
+
+
+##################################################
+# Map and Section 1: Distribution and Allocation of Funds
+
+@view('density_map', 'df_org_locals', DENSITY)
+def density_map(option, cities):
+    # option is a zoom level with density bins (see density_bins.py), None for the city map
+    return city_charts.density_map(option)
+
+
+@view('city_funds', 'melted_city_funds', CUBE)
+def city_funds(option, cities):
+    return city_charts.city_funds(load_slice('melted_city_funds', cities))
+
+
+@view('hypothesis_tests', 'hypothesis_tests', 'hypothesis_testing_results')
+def hypothesis_tests(option, cities):
+    return city_charts.hypothesis_tests()
+
+
+@view('city_hypothesis_tests', 'hypothesis_tests', 'df_org_locals')
+def city_hypothesis_tests(option, cities):
+    return city_charts.city_hypothesis_tests(cities)
+
+
+@view('income_box', 'df_combined')
+def income_box(option, cities):
+    return city_charts.income_box(data_store.load('df_combined'))
+
+
+##################################################
+# Section 2: Financial Transparency and Accountability
+
+@view('filing_percentage', 'df_filing_percentage', CUBE)
+def filing_percentage(option, cities):
+    return city_charts.filing_percentage(load_slice('df_filing_percentage', cities))
+
+
+##################################################
+# Section 3: Trends over Time
+
+@view('ruling_trend', 'df_city_rulingyear', 'df_city_decade', CUBE)
+def ruling_trend(option, cities):
+    return city_charts.ruling_trend(load_slice(city_charts.RULING_SLICES[option], cities), option)
+
+
+@view('ntee_names', 'df_nteename_groupby', CUBE)
+def ntee_names(option, cities):
+    return city_charts.ntee_names(load_slice('df_nteename_groupby', cities))
+
+
+@view('ntee_names_by_city', 'df_nteename_city_groupby', CUBE)
+def ntee_names_by_city(option, cities):
+    return city_charts.ntee_names_by_city(load_slice('df_nteename_city_groupby', cities))
+
+
+@view('ntee_ruling_trend', 'df_city_rulingname_all', 'df_city_rulingname_grouped', CUBE)
+def ntee_ruling_trend(option, cities):
+    return city_charts.ntee_ruling_trend(load_slice(city_charts.NTEE_RULING_SLICES[option], cities), option)
+
+
+@view('funding_momentum', 'form990_panel')
+def funding_momentum(option, cities):
+    # Median year-over-year growth per city, from the panel built by form990_panel.py
+    return city_charts.funding_momentum(city_charts.momentum(option, cities), option)
+
+
+##################################################
+# Section 4: ML Trends
+
+def cluster_labels(option):
+    return city_charts.cluster_labels(load_clusters(city_charts.CLUSTER_DATASETS[option]))
+
+
+@view('cluster_scatter', 'df_city_nteena_cluster', 'df_env_city_cluster')
+def cluster_scatter(option, cities):
+    # option is (dataset option, detail level, clusters to show); returns (figure, stats)
+    option, detail, clusters = option
+    return city_charts.cluster_scatter(load_clusters(city_charts.CLUSTER_DATASETS[option]), option, detail, clusters)
+
+
+@view('ntee_cluster_distribution', 'df_env_city_cluster')
+def ntee_cluster_distribution(option, cities):
+    return city_charts.ntee_cluster_distribution(load_clusters('df_env_city_cluster'))
+
+
+@view('ntee_cluster_figure', 'df_env_city_cluster')
+def ntee_cluster_figure(option, cities):
+    return city_charts.ntee_cluster_figure(build('ntee_cluster_distribution'))
+
+
+@view('cluster_medians', 'df_city_nteena_cluster', 'df_env_city_cluster', 'cluster_sketches')
+def cluster_medians(option, cities):
+    return city_charts.cluster_medians(option)
+
+
+@view('cluster_medians_figure', 'df_city_nteena_cluster', 'df_env_city_cluster', 'cluster_sketches')
+def cluster_medians_figure(option, cities):
+    return city_charts.cluster_medians_figure(build('cluster_medians', option))
+
+
+@view('high_finance_names', 'df_env_city_cluster', 'cluster_high_impact')
+def high_finance_names(option, cities):
+    return city_charts.high_finance_names(cities)
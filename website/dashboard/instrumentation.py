@@ -0,0 +1,215 @@
+# Timing and memory instrumentation for the Streamlit dashboards.
+#
+# A dashboard calls start_run(app) at the top of the script and finish_run() at the end.
+# In between:
+#
+#   with instrumentation.section('load'):              # times a block
+#   @instrumentation.timed('expense_statistics')       # times every call of a function
+#   instrumentation.plotly_chart(fig, 'city_funds')    # st.plotly_chart, timed, with the
+#                                                      # size of the figure's JSON payload
+#
+# Sections nest and are named by their path ('view:city_funds/load:melted_city_funds'),
+# with the time and number of calls per path. A section inside a st.cache_data function
+# only runs on a cache miss, so a view listed without its inner sections was served
+# from the cache. finish_run() snapshots memory: resident and peak RSS of the process and
+# the frames held by the data_store cache.
+#
+# With ?debug=1 in the URL (or DASHBOARD_DEBUG=1 in the environment) the run is shown in
+# a debug panel at the bottom of the page and appended as one JSON line to
+# data/perf/<app>.jsonl (DASHBOARD_PERF_LOG overrides the path) for offline comparison.
+# Otherwise nothing is shown or written, and a timer costs two perf_counter() calls.
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+import streamlit as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'data_preprocessing'))
+import data_store
+import schema
+from paths import DATA_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PERF_DIR = os.path.join(DATA_DIR, 'perf')
+
+# The run of the script executing in this thread (None outside start_run/finish_run)
+_run = contextvars.ContextVar('dashboard_run', default=None)
+
+
+def enabled():
+    # Debug panel and JSON lines requested for this session
+    if os.environ.get('DASHBOARD_DEBUG') == '1':
+        return True
+    try:
+        return st.query_params.get('debug') == '1'
+    except Exception:
+        # Not running under streamlit (bare mode or a plain import)
+        return False
+
+
+def log_path(app):
+    return os.environ.get('DASHBOARD_PERF_LOG') or os.path.join(PERF_DIR, f'{app}.jsonl')
+
+
+def start_run(app):
+    run = {
+        'app': app,
+        'run_id': uuid.uuid4().hex[:12],
+        'started': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'enabled': enabled(),
+        'start': time.perf_counter(),
+        'stack': [],
+        'sections': {},
+        'figures': [],
+    }
+    _run.set(run)
+    return run
+
+
+@contextmanager
+def section(name):
+    # Time a block under the current section path
+    run = _run.get()
+    if run is None:
+        yield
+        return
+    run['stack'].append(name)
+    path = '/'.join(run['stack'])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        run['stack'].pop()
+        totals = run['sections'].setdefault(path, {'ms': 0.0, 'calls': 0})
+        totals['ms'] += elapsed
+        totals['calls'] += 1
+
+
+def timed(name=None):
+    # Decorator: time every call of a function as a section (named after the function by default)
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with section(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _figure_name(fig, position):
+    title = fig.layout.title.text
+    return title if title else f'figure {position}'
+
+
+def plotly_chart(fig, name=None, **kwargs):
+    # st.plotly_chart, timed (serialization and send), with the figure's payload size when enabled
+    run = _run.get()
+    if run is None:
+        return st.plotly_chart(fig, **kwargs)
+    name = name or _figure_name(fig, len(run['figures']) + 1)
+    start = time.perf_counter()
+    with section(f'chart:{name}'):
+        element = st.plotly_chart(fig, **kwargs)
+    record = {'name': name, 'ms': round((time.perf_counter() - start) * 1000, 3)}
+    if run['enabled']:
+        record['bytes'] = len(fig.to_json())
+        record['traces'] = len(fig.data)
+    run['figures'].append(record)
+    return element
+
+
+def _rss_mb():
+    # Resident set size of the process (Linux), None where /proc isn't available
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def memory_snapshot():
+    frames = data_store.cached()
+    return {
+        'rss_mb': _rss_mb(),
+        'peak_rss_mb': _peak_rss_mb(),
+        'cached_frames': {name: round(schema.memory_usage(df) / 2**20, 3) for name, df in frames.items()},
+    }
+
+
+def _record(run):
+    return {
+        'app': run['app'],
+        'run_id': run['run_id'],
+        'started': run['started'],
+        'total_ms': round(run['total_ms'], 3),
+        'sections': [{'name': name, 'ms': round(totals['ms'], 3), 'calls': totals['calls']} for name, totals in run['sections'].items()],
+        'figures': run['figures'],
+        'memory': run['memory'],
+    }
+
+
+def write_record(record, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as log:
+        log.write(json.dumps(record) + '\n')
+
+
+def read_records(path):
+    # Runs logged in a JSON lines file, one row per run and section
+    with open(path) as log:
+        records = [json.loads(line) for line in log if line.strip()]
+    runs = pd.json_normalize(records, 'sections', ['app', 'run_id', 'started', 'total_ms'], record_prefix='section_')
+    return runs.astype({'total_ms': 'float64'})
+
+
+def _show(record):
+    with st.expander('Debug: run timings', expanded=True):
+        memory = record['memory']
+        columns = st.columns(4)
+        columns[0].metric('Script run', f"{record['total_ms']:.0f} ms")
+        columns[1].metric('Resident memory', f"{memory['rss_mb']:.0f} MB" if memory['rss_mb'] is not None else 'n/a')
+        columns[2].metric('Peak memory', f"{memory['peak_rss_mb']:.0f} MB" if memory['peak_rss_mb'] is not None else 'n/a')
+        columns[3].metric('Cached frames', f"{sum(memory['cached_frames'].values()):.1f} MB")
+        if record['sections']:
+            st.dataframe(pd.DataFrame(record['sections']).sort_values('ms', ascending=False), hide_index=True, use_container_width=True)
+        if record['figures']:
+            st.dataframe(pd.DataFrame(record['figures']), hide_index=True, use_container_width=True)
+        st.caption(f"Run {record['run_id']}, logged to {log_path(record['app'])}")
+
+
+def finish_run():
+    # Close the run: memory snapshot, then the debug panel and the JSON line when enabled
+    run = _run.get()
+    if run is None:
+        return None
+    _run.set(None)
+    run['total_ms'] = (time.perf_counter() - run['start']) * 1000
+    if not run['enabled']:
+        return None
+    run['memory'] = memory_snapshot()
+    record = _record(run)
+    write_record(record, log_path(run['app']))
+    _show(record)
+    return record
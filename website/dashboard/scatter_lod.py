@@ -0,0 +1,73 @@
+# Level of detail for the 3D cluster scatter plots.
+#
+# A 3D scatter ships every point (and its hover text) to the browser. sample() reduces a
+# clustered frame to a point budget while keeping what the plot is read for:
+#
+#   - the outliers: points farther from their cluster's center than OUTLIER_QUANTILE of
+#     the cluster, in log-dollar space (sign * log1p|x|) where the clusters were fitted;
+#     all of them, or the most extreme ones if they would take over MAX_OUTLIER_SHARE of the budget,
+#   - a stratified sample of the remaining points, each cluster getting a share of the
+#     budget proportional to its size but at least MIN_CLUSTER_POINTS,
+#   - the cluster centers, drawn as their own trace: the k-means centroids when
+#     financial_clusters.py has been run, otherwise the per-cluster medians (medians()).
+#
+# Every row gets a fixed random priority and the sample keeps the lowest priorities of each
+# cluster, so raising the budget (or filtering down to fewer clusters) only adds points
+# to what is already on screen.
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ['ASSET_AMT', 'INCOME_AMT', 'REVENUE_AMT']
+
+# Point budgets offered by the detail slider (None sends every point)
+DETAIL_LEVELS = {'Overview': 2_000, 'Medium': 10_000, 'High': 50_000, 'Full': None}
+OUTLIER_QUANTILE = 0.995
+MAX_OUTLIER_SHARE = 0.5
+MIN_CLUSTER_POINTS = 200
+SEED = 42
+
+
+def _log(values):
+    values = np.nan_to_num(np.asarray(values, dtype='float64'))
+    return np.sign(values) * np.log1p(np.abs(values))
+
+
+def outlier_scores(df, cluster='CLUSTER_KMEANS', features=FEATURES, quantile=OUTLIER_QUANTILE):
+    # Distance from the cluster median relative to the cluster's distance quantile (> 1 is an outlier)
+    x = pd.DataFrame(_log(df[features]), index=df.index)
+    labels = df[cluster]
+    distance = np.sqrt(((x - x.groupby(labels).transform('median')) ** 2).sum(axis=1))
+    threshold = distance.groupby(labels).transform('quantile', quantile)
+    return (distance / threshold.where(threshold > 0)).fillna(0).to_numpy()
+
+
+def medians(df, cluster='CLUSTER_KMEANS', features=FEATURES):
+    return df.groupby(cluster, observed=True)[features].median().reset_index()
+
+
+def quotas(sizes, budget, minimum=MIN_CLUSTER_POINTS):
+    # Points per cluster: proportional to size, at least `minimum` (or the whole cluster)
+    floor = np.minimum(sizes, minimum)
+    share = np.floor((sizes - floor) * max(budget - floor.sum(), 0) / max((sizes - floor).sum(), 1))
+    return (floor + share).astype(int)
+
+
+def sample(df, budget, cluster='CLUSTER_KMEANS', features=FEATURES, seed=SEED):
+    # (points, number of outliers among them) within about `budget` points
+    if budget is None or len(df) <= budget:
+        return df, 0
+    scores = outlier_scores(df, cluster, features)
+    is_outlier = scores > 1
+    limit = int(budget * MAX_OUTLIER_SHARE)
+    if is_outlier.sum() > limit:
+        is_outlier = scores > np.sort(scores)[-limit - 1]
+    rest = df[~is_outlier]
+    # Priorities follow the row labels, so they survive filtering
+    priority = pd.Series(np.random.default_rng(seed).random(rest.index.max() + 1)[rest.index], index=rest.index)
+    rank = priority.groupby(rest[cluster]).rank(method='first')
+    sizes = rest[cluster].value_counts()
+    quota = pd.Series(quotas(sizes.to_numpy(), budget - is_outlier.sum()), index=sizes.index)
+    keep = rank <= rest[cluster].map(quota)
+    points = pd.concat([df[is_outlier], rest[keep]]).sort_index()
+    return points, int(is_outlier.sum())
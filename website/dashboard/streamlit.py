@@ -1,4 +1,5 @@
 import os
+import sys
 import pandas as pd 
 import plotly.graph_objects as go 
 import plotly.express as px 
@@ -7,84 +8,49 @@ from datetime import datetime
 from matplotlib.ticker import FuncFormatter
 import matplotlib.pyplot as plt
 
+# Shared data layer and expense category engine live with the preprocessing scripts
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'data_preprocessing'))
+import data_store
+import expense_categories
+import instrumentation
 
-# Load and preprocess data
-@st.cache_data  
+
+# Section timings, figure sizes and memory of this run; shown and logged with ?debug=1 (see instrumentation.py)
+instrumentation.start_run('streamlit')
+
+# Load data (parsed once into data/store/ and shared across reruns, see data_store.py)
+@instrumentation.timed('load:form990_embf')
 def load_data():
-    df = pd.read_csv('../../data/form990_embf.csv')
-    df.drop(['Unnamed: 0'], axis=1, inplace=True)
-    return df
+    return data_store.load('form990_embf')
 
 df = load_data()
+version = data_store.signature('form990_embf')
+
+# Expense matrix, extracted once per data version and shared by every category scheme
+@st.cache_resource
+@instrumentation.timed()
+def load_expenses(version):
+    return expense_categories.expense_values(df)
 
-# Define expense categories
-def process_expenses(df):
-    df_expenses = df[[
-        'accntingfees', 'advrtpromo', 'benifitsmembrs', 'compnsatncurrofcr',
-        'compnsatnandothr', 'converconventmtng', 'deprcatndepletn', 'grntstogovt',
-        'grnsttoindiv', 'grntstofrgngovt', 'infotech', 'insurance',
-        'feesforsrvcinvstmgmt', 'legalfees', 'feesforsrvclobby', 'feesforsrvcmgmt',
-        'occupancy', 'officexpns', 'othremplyeebenef', 'othrexpnsa', 'othrexpnsb',
-        'othrexpnsc', 'othrexpnsd', 'othrexpnse', 'othrexpnsf', 'feesforsrvcothr',
-        'othrsalwages', 'pymtoaffiliates', 'payrolltx', 'pensionplancontrb',
-        'profndraising', 'royaltsexpns', 'totfuncexpns', 'travel',
-        'travelofpublicoffcl','lessdirfndrsng']]
-    
-    # Calculations for streamlit
-    columns_to_sum = df_expenses.columns.drop(['totfuncexpns', 'lessdirfndrsng'])
-    df_expenses['sum_expenses'] = df_expenses[columns_to_sum].sum(axis=1)
-
-    # Categorical sums
-    df_expenses['mission_related'] = df_expenses[['grntstogovt','grnsttoindiv','grntstofrgngovt','converconventmtng']].sum(axis=1)
-    df_expenses['admin_general'] = df_expenses[['compnsatncurrofcr','officexpns','insurance','occupancy']].sum(axis=1)  # trimmed for brevity
-    df_expenses['fundraising'] = df_expenses[['profndraising','advrtpromo','lessdirfndrsng']].sum(axis=1)
-    df_expenses['other'] = df_expenses[['deprcatndepletn','travel']].sum(axis=1)  # trimmed for brevity
-
-    return df_expenses
-
-# Create df
-df_expenses = process_expenses(df)
+# Mean and median of every category, computed once per scheme (see expense_categories.py)
+@instrumentation.timed()
+@st.cache_data
+def expense_statistics(scheme, skip_empty, version):
+    values, present = load_expenses(version)
+    return expense_categories.category_statistics(values, present, scheme, skip_empty=skip_empty)
 
 # Question 1
-mean_expense = round(df_expenses.totfuncexpns.mean()) 
+with instrumentation.section('mean_expense'):
+    mean_expense = round(df.totfuncexpns.mean()) 
 formatted_mean_expense = "{:,}".format(mean_expense)
 
 # Question 2
-def create_pie_chart(df_expenses, statistic='mean'):
-    if statistic == 'mean':
-        sizes = [df_expenses['mission_related'].mean(), df_expenses['admin_general'].mean(), 
-                 df_expenses['fundraising'].mean(), df_expenses['other'].mean()]
-    elif statistic == 'median':
-        sizes = [df_expenses['mission_related'].median(), df_expenses['admin_general'].median(),
-                 df_expenses['fundraising'].median(), df_expenses['other'].median()]
-
-    labels = ['Mission Related', 'Admin General', 'Fundraising', 'Other']
-    fig = px.pie(values=sizes, names=labels, title=f'Proportion of {statistic.capitalize()} Organization Expenses')
+@instrumentation.timed()
+def create_pie_chart(statistics, statistic='mean'):
+    fig = px.pie(values=statistics[statistic], names=statistics.index, title=f'Proportion of {statistic.capitalize()} Organization Expenses')
     return fig 
 
 # Question 3: What subsection of Admin is so costly? 
-# Column renaming
-column_names = {
-    'compnsatncurrofcr': 'Compensation of Officers',
-    'officexpns': 'Office Expenses',
-    'insurance': 'Insurance',
-    'occupancy': 'Occupancy',
-    'accntingfees': 'Accounting Fees',
-    'legalfees': 'Legal Fees',
-    'feesforsrvcmgmt': 'Management Service Fees',
-    'feesforsrvcinvstmgmt': 'Investment Management Fees',
-    'othrsalwages': 'Other Salaries and Wages',
-    'payrolltx': 'Payroll Taxes',
-    'pensionplancontrb': 'Pension Plan Contributions',
-    'othremplyeebenef': 'Other Employee Benefits',
-    'infotech': 'Information Technology',
-    'compnsatnandothr': 'Compensation and Other Benefits',
-    'travelofpublicoffcl': 'Travel and Entertainment for Public Officials',
-    'benifitsmembrs': 'Benefits to Members'
-}
-df_expenses.rename(columns=column_names, inplace=True)
-mean_admin_exp = df_expenses[list(column_names.values())].mean()
-med_admin_exp = df_expenses[list(column_names.values())].median()
 def millions_formatter(x, pos):
     if x >= 1e9:  # For billions
         return f'{x * 1e-9:.1f}B'
@@ -93,13 +59,10 @@ def millions_formatter(x, pos):
     else:
         return int(x)
 
-def create_bar_chart(df_expenses, statistic='mean'):
-    if statistic == 'mean':
-        data = df_expenses[list(column_names.values())].mean().sort_values()
-        title = "Mean Admin General Expenses by Category"
-    elif statistic == 'median':
-        data = df_expenses[list(column_names.values())].median().sort_values()
-        title = "Median Admin General Expenses by Category"
+@instrumentation.timed()
+def create_bar_chart(statistics, statistic='mean'):
+    data = statistics[statistic].sort_values()
+    title = f"{statistic.capitalize()} Admin General Expenses by Category"
 
     fig = px.bar(data, orientation='h', title=title, labels={'index': 'Admin Category', 'value': statistic.capitalize() + ' Expenses'})
     fig.update_layout(xaxis_tickformat='s')
@@ -135,17 +98,25 @@ st.write("This dashboard displays financial data extracted from Form 990 tax fil
 
 # Display data head
 if st.button('Show Data'):
-    st.write(df.head()) 
+    st.write(df.head().drop(columns=['Unnamed: 0'], errors='ignore'))
 
 st.write(f"Question 1: What is the mean expenses for tax exempt orgs over the last 3 years? ")
 st.write(f"{formatted_mean_expense}")
 
 st.write(f"Question 2: What is the mean/median percentage breakdown of expenses by category?  ")
 statistic2 = st.radio('Select Statistic', ['mean', 'median'], key=['radio1'])
-fig = create_pie_chart(df_expenses, statistic2)
-st.plotly_chart(fig)
+# Categories can be regrouped without re-reading the data
+with st.expander('Customize expense categories'):
+    scheme = {
+        category: st.multiselect(category, expense_categories.EXPENSE_COLUMNS, default=columns, key=f'category_{category}')
+        for category, columns in expense_categories.EXPENSE_SCHEME.items()
+    }
+fig = create_pie_chart(expense_statistics(scheme, False, version), statistic2)
+instrumentation.plotly_chart(fig)
 
 st.write(f"Question 3: What subsection of Admin is so costly? ")
 statistic3 = st.radio('Select Statistic', ['mean', 'median'], key=['radio2'])
-fig = create_bar_chart(df_expenses, statistic3)
-st.plotly_chart(fig)
+fig = create_bar_chart(expense_statistics(expense_categories.ADMIN_SCHEME, True, version), statistic3)
+instrumentation.plotly_chart(fig)
+
+instrumentation.finish_run()
@@ -0,0 +1,228 @@
+# Aggregate cube over the unioned EO BMF.
+#
+# The city dashboard used to read a dozen hand-exported CSVs (df_city_rulingyear,
+# df_nteename_groupby, melted_city_funds, df_filing_percentage, ...), each a different
+# slice of the same EO BMF data for a fixed list of cities. build_cube() makes one pass
+# over the data/ebmf/ partitions and materializes two tables in data/cube/:
+#
+#   counts.parquet          CITY x STATE x NTEE_MAJOR x RULING_YEAR x FILING_REQUIRED
+#                           -> EIN (organization count), ASSET_AMT/INCOME_AMT/REVENUE_AMT sums
+#   amount_buckets.parquet  CITY x STATE x NTEE_MAJOR x FUND_TYPE x BUCKET -> EIN
+#
+# amount_buckets is a quantile sketch per cell (see quantile_sketch.py): BUCKET is a
+# logarithmic bucket of the amount, so the bucket counts merge by simple addition and
+# medians and other percentiles for any roll-up come from summing bucket counts, with
+# every estimate within quantile_sketch.RELATIVE_ACCURACY of a true order statistic.
+#
+# Every batch is reduced on its own and the partial aggregates are summed at the end, so
+# the build runs in memory proportional to the cube, not to the EO BMF.
+# dashboard_slice() answers each of the old CSV slices for any set of cities, given as
+# "CITY, ST" labels (see cities.py); per-city rows are labelled the same way, so cities of
+# the same name in different states are never merged.
+#
+# Usage (from the repo root, after ebmf_union.py):
+#   python website/data_preprocessing/aggregate_cube.py
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import cities as city_labels
+import ebmf_union
+import ntee
+import quantile_sketch
+import schema
+from paths import DATA_DIR
+
+CUBE_DIR = os.path.join(DATA_DIR, 'cube')
+COUNTS_PATH = os.path.join(CUBE_DIR, 'counts.parquet')
+BUCKETS_PATH = os.path.join(CUBE_DIR, 'amount_buckets.parquet')
+
+FUND_TYPES = ['INCOME_AMT', 'ASSET_AMT', 'REVENUE_AMT']
+COUNT_DIMENSIONS = ['CITY', 'STATE', 'NTEE_MAJOR', 'RULING_YEAR', 'FILING_REQUIRED']
+BUCKET_DIMENSIONS = ['CITY', 'STATE', 'NTEE_MAJOR', 'FUND_TYPE', 'BUCKET']
+
+# FILING_REQ_CD values that don't require a Form 990 (EO BMF codebook): 00 not required,
+# 02 gross receipts normally under $25,000 (990-N e-Postcard only), 06 church,
+# 07 government 501(c)(1), 13 religious organization, 14 government instrumentality.
+NOT_REQUIRED_FILING_CODES = [0, 2, 6, 7, 13, 14]
+
+EBMF_COLUMNS = ['CITY', 'STATE', 'NTEE_CD', 'RULING', 'FILING_REQ_CD'] + FUND_TYPES
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _dimensions(batch):
+    ruling_year = pd.to_numeric(batch['RULING'], errors='coerce') // 100
+    return pd.DataFrame({
+        'CITY': batch['CITY'].astype('string').str.strip().str.upper(),
+        'STATE': batch['STATE'].astype('string').str.strip().str.upper(),
+        'NTEE_MAJOR': ntee.major_group(batch['NTEE_CD']),
+        'RULING_YEAR': ruling_year.where(ruling_year > 0).astype('Int16'),
+        'FILING_REQUIRED': ~batch['FILING_REQ_CD'].isin(NOT_REQUIRED_FILING_CODES),
+    }, index=batch.index)
+
+
+def _partial(batch):
+    # Reduce one batch of EO BMF rows to its (counts, buckets) contribution
+    dims = _dimensions(batch)
+    counts = dims.assign(EIN=1, **{fund: batch[fund] for fund in FUND_TYPES})
+    counts = counts.groupby(COUNT_DIMENSIONS, dropna=False, observed=True).sum(min_count=1).reset_index()
+
+    amounts = dims[['CITY', 'STATE', 'NTEE_MAJOR']].assign(**{fund: batch[fund] for fund in FUND_TYPES})
+    buckets = quantile_sketch.sketch(amounts, ['CITY', 'STATE', 'NTEE_MAJOR'], FUND_TYPES, 'FUND_TYPE', count='EIN')
+    return counts, buckets
+
+
+def merge(parts, dimensions):
+    # Sum partial aggregates that share dimensions (parts of one build, or of several builds)
+    combined = pd.concat(parts, ignore_index=True)
+    return combined.groupby(dimensions, dropna=False, observed=True).sum(min_count=1).reset_index()
+
+
+def build_cube(batch_rows=500_000):
+    counts, buckets = [], []
+    for record_batch in ebmf_union.ebmf_dataset().to_batches(columns=EBMF_COLUMNS, batch_size=batch_rows):
+        batch_counts, batch_buckets = _partial(record_batch.to_pandas())
+        counts.append(batch_counts)
+        buckets.append(batch_buckets)
+
+    counts = merge(counts, COUNT_DIMENSIONS).astype({'EIN': 'int64'})
+    buckets = merge(buckets, BUCKET_DIMENSIONS).astype({'EIN': 'int64'})
+
+    os.makedirs(CUBE_DIR, exist_ok=True)
+    counts = schema.apply(counts, 'cube_counts')
+    buckets = schema.apply(buckets, 'cube_buckets')
+    counts.to_parquet(COUNTS_PATH, index=False)
+    buckets.to_parquet(BUCKETS_PATH, index=False)
+    return counts, buckets
+
+
+def signature():
+    # Changes whenever the cube is rebuilt; None if it hasn't been built
+    try:
+        return tuple(os.stat(path).st_mtime_ns for path in (COUNTS_PATH, BUCKETS_PATH))
+    except FileNotFoundError:
+        return None
+
+
+def load_cube():
+    # (counts, buckets), cached for the life of the process like data_store.load()
+    sig = signature()
+    if sig is None:
+        raise FileNotFoundError(f'No aggregate cube in {CUBE_DIR}; run aggregate_cube.py')
+    with _lock:
+        cached = _cache.get('cube')
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    cube = (pd.read_parquet(COUNTS_PATH), pd.read_parquet(BUCKETS_PATH))
+    with _lock:
+        _cache['cube'] = (sig, cube)
+    return cube
+
+
+def _select(table, cities=None, ntee_majors=None):
+    mask = np.ones(len(table), dtype=bool)
+    if cities is not None:
+        mask &= city_labels.mask(table, cities)
+    if ntee_majors is not None:
+        mask &= table['NTEE_MAJOR'].isin(list(ntee_majors)).to_numpy()
+    return table[mask]
+
+
+def rollup(counts, by, cities=None, ntee_majors=None):
+    # Organization counts and amount sums rolled up to the `by` columns
+    selected = _select(counts, cities, ntee_majors)
+    measures = ['EIN'] + FUND_TYPES
+    return selected.groupby(by, observed=True)[measures].sum().reset_index()
+
+
+def amount_quantiles(buckets, by, q=0.5, cities=None, ntee_majors=None):
+    # Quantile q of each fund type per `by` group, estimated from the bucket counts
+    selected = _select(buckets, cities, ntee_majors)
+    estimates = quantile_sketch.quantiles(selected, list(by) + ['FUND_TYPE'], q, count='EIN')
+    return estimates.rename(columns={'VALUE': 'AMOUNT'})
+
+
+##################################################
+# The dashboard CSVs as cube slices
+
+def _named(frame):
+    return frame.assign(NTEE_NAME=ntee.major_name(frame['NTEE_MAJOR'])).drop(columns='NTEE_MAJOR')
+
+
+def _labelled(frame):
+    # CITY as "CITY, ST", in place of the CITY and STATE columns
+    return frame.assign(CITY=city_labels.label(frame['CITY'], frame['STATE'])).drop(columns='STATE')
+
+
+def city_rulingyear(counts, buckets, cities):
+    return rollup(counts, ['RULING_YEAR'], cities)[['RULING_YEAR', 'EIN']]
+
+
+def city_decade(counts, buckets, cities):
+    decades = rollup(counts, ['RULING_YEAR'], cities)
+    decades = decades.assign(RULING=decades['RULING_YEAR'] // 10 * 10)
+    return decades.groupby('RULING', as_index=False)['EIN'].sum()
+
+
+def nteename_groupby(counts, buckets, cities):
+    names = _named(rollup(counts, ['NTEE_MAJOR'], cities))
+    return names[['NTEE_NAME', 'EIN']].sort_values('EIN').reset_index(drop=True)
+
+
+def nteename_city_groupby(counts, buckets, cities):
+    names = _labelled(_named(rollup(counts, ['CITY', 'STATE', 'NTEE_MAJOR'], cities, ntee.ENV_CIVIL_RIGHTS)))
+    return names[['CITY', 'NTEE_NAME', 'EIN']].sort_values('EIN', ascending=False).reset_index(drop=True)
+
+
+def city_rulingname_all(counts, buckets, cities, top=5):
+    largest = rollup(counts, ['NTEE_MAJOR'], cities).nlargest(top, 'EIN')['NTEE_MAJOR']
+    names = _named(rollup(counts, ['RULING_YEAR', 'NTEE_MAJOR'], cities, largest))
+    return names[['RULING_YEAR', 'NTEE_NAME', 'EIN']]
+
+
+def city_rulingname_grouped(counts, buckets, cities):
+    names = _named(rollup(counts, ['RULING_YEAR', 'NTEE_MAJOR'], cities, ntee.ENV_CIVIL_RIGHTS))
+    return names[['RULING_YEAR', 'NTEE_NAME', 'EIN']]
+
+
+def melted_city_funds(counts, buckets, cities):
+    medians = _labelled(amount_quantiles(buckets, ['CITY', 'STATE'], 0.5, cities))
+    return medians.sort_values(['FUND_TYPE', 'AMOUNT'], ascending=[True, False]).reset_index(drop=True)
+
+
+def filing_percentage(counts, buckets, cities):
+    filing = _labelled(rollup(counts, ['CITY', 'STATE', 'FILING_REQUIRED'], cities))
+    filing = filing.pivot_table(index='CITY', columns='FILING_REQUIRED', values='EIN', aggfunc='sum', fill_value=0)
+    filing = filing.reindex(columns=[False, True], fill_value=0)
+    filing.columns = ['Not Required to File', 'Required to File']
+    filing['Total'] = filing.sum(axis=1)
+    filing['Percentage_Not_Required_to_File'] = filing['Not Required to File'] / filing['Total'] * 100
+    return filing.sort_values('Percentage_Not_Required_to_File', ascending=False).reset_index()
+
+
+SLICES = {
+    'df_city_rulingyear': city_rulingyear,
+    'df_city_decade': city_decade,
+    'df_nteename_groupby': nteename_groupby,
+    'df_nteename_city_groupby': nteename_city_groupby,
+    'df_city_rulingname_all': city_rulingname_all,
+    'df_city_rulingname_grouped': city_rulingname_grouped,
+    'melted_city_funds': melted_city_funds,
+    'df_filing_percentage': filing_percentage,
+}
+
+
+def dashboard_slice(name, cities):
+    # The frame the dashboard used to read from data/<name>.csv, for any set of cities
+    counts, buckets = load_cube()
+    return SLICES[name](counts, buckets, cities)
+
+
+if __name__ == '__main__':
+    counts, buckets = build_cube()
+    print(f'counts: {len(counts):,} cells, amount_buckets: {len(buckets):,} cells')
@@ -0,0 +1,53 @@
+# Cities of interest and "CITY, ST" labels.
+#
+# Many city names exist in several states (Portland OR and ME, Rochester NY and MN,
+# Washington DC and every Washington town), so a city is always a CITY x STATE pair.
+# The dashboards list and select cities by their label, "PORTLAND, OR"; mask() and
+# split() turn labels back into the pair to match both columns.
+#
+#   cities.label(df['CITY'], df['STATE'])     # "CITY, ST" of every row
+#   df[cities.mask(df, ['PORTLAND, OR'])]     # rows of Portland, Oregon only
+
+import pandas as pd
+
+SEPARATOR = ', '
+
+# The original cities of interest (df_org_locals.csv, which only has the city names)
+TARGET_CITIES = [
+    ('CHICAGO', 'IL'),
+    ('WASHINGTON', 'DC'),
+    ('SEATTLE', 'WA'),
+    ('PORTLAND', 'OR'),
+    ('RALEIGH', 'NC'),
+    ('NEW ORLEANS', 'LA'),
+    ('ALEXANDRIA', 'VA'),
+    ('ROCHESTER', 'NY'),
+    ('WICHITA', 'KS'),
+    ('SAVANNAH', 'GA'),
+    ('LAUREL', 'MD'),
+    ('NASHUA', 'NH'),
+    ('FORT LAUDERDALE', 'FL'),
+    ('LEWISTON', 'ID'),
+]
+
+
+def label(city, state):
+    # "CITY, ST" for scalars or Series
+    if isinstance(city, pd.Series):
+        return city.astype('string') + SEPARATOR + pd.Series(state, index=city.index).astype('string')
+    return f'{city}{SEPARATOR}{state}'
+
+
+def split(labels):
+    # (CITY, STATE) pairs of "CITY, ST" labels
+    return [tuple(name.rsplit(SEPARATOR, 1)) for name in labels]
+
+
+def target_labels():
+    return [label(city, state) for city, state in TARGET_CITIES]
+
+
+def mask(frame, labels):
+    # Rows of frame (with CITY and STATE columns) in one of the labelled cities
+    pairs = pd.MultiIndex.from_arrays([frame['CITY'].astype('string'), frame['STATE'].astype('string')])
+    return pairs.isin(split(labels))
@@ -1,21 +1,145 @@
-import pandas as pd
+# Export every CSV in a directory (the regional EO BMF files by default) to one Excel
+# workbook, one sheet per file.
+#
+# The workbook is written in openpyxl's write-only mode, so rows go straight to disk and
+# memory stays constant however large the inputs are. The CSVs are parsed in streaming
+# batches by pyarrow on background threads (up to WORKERS files ahead of the writer), each
+# behind a bounded queue. A file with more rows than an Excel sheet holds continues on
+# extra sheets: <name>, <name>_2, <name>_3, ...
+#
+# Usage (from the repo root):
+#   python website/data_preprocessing/csv_to_excel.py [csv directory] [output.xlsx]
+
 import os
+import queue
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.csv as pv
+from openpyxl import Workbook
+
+import ebmf_union
+
+# Excel limits: rows per sheet (including the header row) and sheet name length
+MAX_SHEET_ROWS = 1_048_576
+MAX_SHEET_NAME = 31
+INVALID_SHEET_CHARACTERS = re.compile(r'[\[\]:*?/\\]')
+
+WORKERS = 4
+BLOCK_SIZE = 16 << 20  # bytes of CSV per parsed batch
+PREFETCH_BATCHES = 2
+
+# Known EO BMF columns get fixed types, so later batches can't disagree with the types
+# inferred from the first one. Integer codes are read as float64: some exports write them
+# as '199704.0', and Excel stores every number as a double anyway.
+COLUMN_TYPES = {
+    field.name: pa.float64() if pa.types.is_integer(field.type) else field.type
+    for field in ebmf_union.EBMF_SCHEMA
+}
+
+_DONE = object()
+
+
+def sheet_name(name, part, used):
+    # Valid, unique sheet name for part (1-based) of a file
+    suffix = '' if part == 1 else f'_{part}'
+    base = INVALID_SHEET_CHARACTERS.sub('_', name)[:MAX_SHEET_NAME - len(suffix)]
+    candidate, n = base + suffix, 1
+    while candidate.lower() in used:
+        n += 1
+        tag = f'{suffix}~{n}'
+        candidate = base[:MAX_SHEET_NAME - len(tag)] + tag
+    used.add(candidate.lower())
+    return candidate
+
+
+def _put(batches, item, stop):
+    # Blocking put that gives up once the writer has stopped
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_batches(path, batches, stop):
+    # Producer: the schema, then the parsed batches of path, then the end marker
+    try:
+        reader = pv.open_csv(
+            path,
+            read_options=pv.ReadOptions(block_size=BLOCK_SIZE),
+            convert_options=pv.ConvertOptions(column_types=COLUMN_TYPES),
+        )
+        if not _put(batches, reader.schema, stop):
+            return
+        for batch in reader:
+            if not _put(batches, batch, stop):
+                return
+        _put(batches, _DONE, stop)
+    except Exception as error:
+        _put(batches, error, stop)
+
+
+def _next(batches):
+    item = batches.get()
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+
+def _rows(batch):
+    # Rows of a record batch as tuples of Python values (None for missing and NaN)
+    columns = [[None if value != value else value for value in column.to_pylist()] for column in batch.columns]
+    return zip(*columns)
+
+
+def export(csv_dir=ebmf_union.EBMF_SOURCE_DIR, output='output.xlsx', workers=WORKERS):
+    files = sorted(filename for filename in os.listdir(csv_dir) if filename.endswith('.csv'))
+    workbook = Workbook(write_only=True)
+    used = set()
+    sheets = {}
+    stop = threading.Event()
 
-# Define the path where the CSV files are stored
-path = './EBMF'  # Change to your path, e.g., '/Users/yourname/Desktop'
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Files are submitted in writing order, so the one being written always has a parser
+        queues = [queue.Queue(maxsize=PREFETCH_BATCHES) for _ in files]
+        for filename, batches in zip(files, queues):
+            pool.submit(_read_batches, os.path.join(csv_dir, filename), batches, stop)
 
-# Create a writer object from Pandas to write Excel files
-writer = pd.ExcelWriter('output.xlsx', engine='openpyxl')
+        try:
+            for filename, batches in zip(files, queues):
+                name = os.path.splitext(filename)[0]
+                header = _next(batches).names
+                part, sheet_rows = 0, MAX_SHEET_ROWS
+                while (batch := _next(batches)) is not _DONE:
+                    for row in _rows(batch):
+                        if sheet_rows == MAX_SHEET_ROWS:
+                            part += 1
+                            sheet = workbook.create_sheet(sheet_name(name, part, used))
+                            sheet.append(header)
+                            sheet_rows = 1
+                        sheet.append(row)
+                        sheet_rows += 1
+                if part == 0:
+                    # Header-only file
+                    part = 1
+                    workbook.create_sheet(sheet_name(name, part, used)).append(header)
+                sheets[filename] = part
+        finally:
+            # Unblock the parsers if the writer fails
+            stop.set()
 
-# Loop through all files in the directory
-for filename in os.listdir(path):
-    if filename.endswith('.csv'):  # Check if the file is a CSV
-        file_path = os.path.join(path, filename)
-        df = pd.read_csv(file_path)  # Read the CSV file
-        # Use the filename as the sheet name, stripping the '.csv' part
-        df.to_excel(writer, sheet_name=os.path.splitext(filename)[0], index=False)
+    workbook.save(output)
+    return sheets
 
-# Save the Excel file
-writer.save()
 
-print("Excel file created successfully!")
+if __name__ == '__main__':
+    sheets = export(*sys.argv[1:3])
+    for filename, parts in sheets.items():
+        print(f'{filename}: {parts} sheet(s)')
+    print("Excel file created successfully!")
@@ -0,0 +1,142 @@
+# Columnar store for the CSV artifacts in data/.
+#
+# Every data/<name>.csv is converted once into an uncompressed Feather (Arrow IPC)
+# file under data/store/, cast to the compact dtypes declared in schema.py (repeated
+# strings such as CITY, FUND_TYPE and NTEE_NAME as categoricals). The size and mtime of the source CSV are written into the
+# Feather metadata, so a file is only rebuilt when its CSV changes.
+#
+# Dashboards load frames through load(), which memory-maps the Feather file and keeps
+# the frame in a process-wide cache. Streamlit reruns the whole script on every widget
+# change, but the modules it imports stay loaded, so after the first run a load() is
+# just a stat() of the CSV and a dictionary lookup.
+#
+# Pipeline outputs that are already Parquet (data/<name>.parquet, e.g. the cluster
+# assignments) load through the same function and cache, memory-mapped, without conversion.
+#
+# Frames returned by load() are shared between reruns and sessions: treat them as
+# read-only and use .assign()/.astype() to derive new ones.
+#
+# Usage (from the repo root, rebuilds whatever is stale):
+#   python website/data_preprocessing/data_store.py
+
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import schema
+from paths import DATA_DIR
+
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+
+# Metadata key holding the (size, mtime) of the CSV a Feather file was built from.
+SIGNATURE_KEY = b'source_signature'
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def source_path(name):
+    return os.path.join(DATA_DIR, name + '.csv')
+
+
+def parquet_path(name):
+    return os.path.join(DATA_DIR, name + '.parquet')
+
+
+def _is_parquet(name):
+    return not os.path.exists(source_path(name)) and os.path.exists(parquet_path(name))
+
+
+def exists(name):
+    # data/<name>.csv or data/<name>.parquet is there to load
+    return os.path.exists(source_path(name)) or os.path.exists(parquet_path(name))
+
+
+def store_path(name):
+    return os.path.join(STORE_DIR, name + '.feather')
+
+
+def signature(name):
+    stat = os.stat(parquet_path(name) if _is_parquet(name) else source_path(name))
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def available():
+    # Names of all CSV artifacts in data/
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(DATA_DIR) if f.endswith('.csv'))
+
+
+def _stored_signature(path):
+    try:
+        stored = pa.ipc.open_file(pa.memory_map(path)).schema
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return (stored.metadata or {}).get(SIGNATURE_KEY, b'').decode()
+
+
+def convert(name, sig=None):
+    # Parse data/<name>.csv and write it to the store, tagged with the CSV signature
+    sig = sig or signature(name)
+    df = schema.apply(pd.read_csv(source_path(name), low_memory=False), name)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SIGNATURE_KEY: sig.encode()})
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    # Write next to the target and swap it in, so readers never see a half-written file
+    tmp_path = f'{store_path(name)}.{os.getpid()}.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, store_path(name))
+    return store_path(name)
+
+
+def ensure(name, sig=None):
+    # Convert data/<name>.csv if its Feather copy is missing or stale
+    sig = sig or signature(name)
+    path = store_path(name)
+    if _stored_signature(path) != sig:
+        convert(name, sig)
+    return path
+
+
+def load(name):
+    # Load data/<name>.csv (through the columnar store) or data/<name>.parquet as a DataFrame
+    sig = signature(name)
+    with _lock:
+        cached = _cache.get(name)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+
+    if _is_parquet(name):
+        table = pq.read_table(parquet_path(name), memory_map=True)
+    else:
+        path = ensure(name, sig)
+        # Numeric columns without nulls stay backed by the memory map (no copy)
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    df = table.to_pandas(split_blocks=True)
+
+    with _lock:
+        _cache[name] = (sig, df)
+    return df
+
+
+def cached():
+    # {name: frame} held by the cache
+    with _lock:
+        return {name: df for name, (_, df) in _cache.items()}
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+if __name__ == '__main__':
+    for name in available():
+        before = _stored_signature(store_path(name))
+        ensure(name)
+        status = 'up to date' if before == signature(name) else 'rebuilt'
+        print(f'{name}: {status}')
@@ -0,0 +1,100 @@
+# "Latest filing per EIN" deduplication.
+#
+# The notebooks used to parse tax_pd into datetimes and then run
+#   df.sort_values('tax_pd').drop_duplicates('ein', keep='last')
+# which sorts every row just to keep one per EIN. Here the period is parsed into an
+# integer YYYYMM and the newest row per key is picked with a hash-based max-by-key
+# reduction (groupby transform + drop_duplicates, no sort). The reduction is mergeable,
+# so it also runs over streamed chunks:
+#
+#   latest = dedup.LatestFilingDeduper(key='ein', period='tax_pd')
+#   for chunk in pd.read_csv(path, chunksize=250_000):
+#       latest.update(chunk)
+#   df = latest.result()
+#   print(f'{latest.dropped:,} older filings dropped')
+#
+# In the result the period column holds the int32 YYYYMM value; use period_to_datetime()
+# for the datetime the notebooks displayed. Rows whose period is missing or invalid get
+# MISSING_PERIOD and only survive when the EIN has no dated filing (sort_values put NaT
+# last, so the old code kept an undated row over a dated one).
+# Ties on the period keep the row seen last.
+
+import numpy as np
+import pandas as pd
+
+MISSING_PERIOD = -1
+
+# Pending rows are compacted once they outgrow this many rows or the current result
+COMPACT_ROWS = 1_000_000
+
+
+def period_to_int(values):
+    # Parse YYYYMM periods (202212, 202212.0, '202212', '202212.0') to int32
+    numeric = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    month = numeric % 100
+    valid = np.isfinite(numeric) & (numeric == np.floor(numeric)) & (month >= 1) & (month <= 12) & (numeric > 100000)
+    periods = np.full(len(numeric), MISSING_PERIOD, dtype=np.int32)
+    periods[valid] = numeric[valid]
+    return periods
+
+
+def period_to_datetime(periods):
+    # int YYYYMM -> first day of that month (NaT for MISSING_PERIOD)
+    periods = pd.Series(periods)
+    dates = pd.DataFrame({'year': periods // 100, 'month': periods % 100, 'day': 1}, dtype='float64')
+    dates.loc[periods == MISSING_PERIOD] = np.nan
+    return pd.to_datetime(dates, errors='coerce')
+
+
+def _latest(df, key, period):
+    # Keep the newest row per key; among equal periods the last one wins
+    newest = df.groupby(key, sort=False, dropna=False, observed=True)[period].transform('max')
+    df = df[df[period].to_numpy() == newest.to_numpy()]
+    return df.drop_duplicates(key, keep='last')
+
+
+class LatestFilingDeduper:
+
+    def __init__(self, key='ein', period='tax_pd'):
+        self.key = key
+        self.period = period
+        self.rows_seen = 0
+        self._result = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def update(self, chunk):
+        chunk = chunk.assign(**{self.period: period_to_int(chunk[self.period])})
+        self.rows_seen += len(chunk)
+        chunk = _latest(chunk, self.key, self.period)
+        self._pending.append(chunk)
+        self._pending_rows += len(chunk)
+
+        result_rows = 0 if self._result is None else len(self._result)
+        if self._pending_rows > max(COMPACT_ROWS, result_rows):
+            self._compact()
+        return self
+
+    def _compact(self):
+        frames = ([] if self._result is None else [self._result]) + self._pending
+        if frames:
+            # Earlier rows come first, so "last" still means latest in the stream
+            self._result = _latest(pd.concat(frames, ignore_index=True), self.key, self.period)
+        self._pending = []
+        self._pending_rows = 0
+
+    def result(self):
+        self._compact()
+        return self._result
+
+    @property
+    def dropped(self):
+        # Rows dropped so far (counting pending chunks as already reduced)
+        self._compact()
+        return self.rows_seen - (0 if self._result is None else len(self._result))
+
+
+def latest_per_key(df, key='ein', period='tax_pd'):
+    # One-shot version for a frame already in memory. Returns (deduplicated frame, rows dropped).
+    latest = LatestFilingDeduper(key, period).update(df)
+    return latest.result(), latest.dropped
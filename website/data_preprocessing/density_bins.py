@@ -0,0 +1,132 @@
+# Density bins for the EIN map.
+#
+# The density map used to plot df_org_locals.csv, one pre-aggregated point per city of
+# interest. build_bins() instead counts every located organization in the unioned EO BMF
+# into Web Mercator tile cells at each map zoom level in ZOOMS and writes
+#
+#   data/density/zoom=<z>/part-0.parquet    X, Y -> EIN (count), Latitude, Longitude
+#
+# At map zoom z the cells are the tiles of level z + CELL_LEVELS, i.e. (2^CELL_LEVELS)^2
+# cells per 256px map tile, and Latitude/Longitude is the centroid of the organizations
+# in the cell. The map reads one zoom level, so its payload depends on the zoom, not on
+# the number of organizations. Where a level still has more cells than the map can send,
+# coarsen() merges neighbouring cells (a tile level at a time) instead of dropping any.
+#
+# Organizations are located offline from their ZIP code (or CITY/STATE) by zip_geocoder.py.
+#
+# Usage (from the repo root, after ebmf_union.py):
+#   python website/data_preprocessing/density_bins.py
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+import ebmf_union
+import schema
+import zip_geocoder
+from paths import DATA_DIR
+
+DENSITY_DIR = os.path.join(DATA_DIR, 'density')
+
+ZOOMS = [3, 5, 7, 9]
+CELL_LEVELS = 3
+MAX_LATITUDE = 85.05112878  # Web Mercator limit
+ROW_GROUP_ROWS = 16_384
+
+EBMF_COLUMNS = ['CITY', 'STATE', 'ZIP']
+
+
+def cell(latitude, longitude, level):
+    # Web Mercator tile (x, y) of each point at a tile level
+    scale = 2 ** level
+    latitude = np.radians(np.clip(np.asarray(latitude, dtype='float64'), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitude, dtype='float64') + 180) / 360 * scale
+    y = (1 - np.log(np.tan(latitude) + 1 / np.cos(latitude)) / np.pi) / 2 * scale
+    return np.clip(x, 0, scale - 1).astype(np.int64), np.clip(y, 0, scale - 1).astype(np.int64)
+
+
+def locate(batch):
+    # (Latitude, Longitude) of each organization, NaN where it can't be placed
+    located = zip_geocoder.geocode(batch, persist=False)
+    return located['Latitude'].to_numpy(dtype='float64'), located['Longitude'].to_numpy(dtype='float64')
+
+
+def _partial(batch, zooms):
+    # Cell counts and coordinate sums of one batch, per zoom
+    latitude, longitude = locate(batch)
+    located = ~(np.isnan(latitude) | np.isnan(longitude))
+    latitude, longitude = latitude[located], longitude[located]
+    parts = {}
+    for zoom in zooms:
+        x, y = cell(latitude, longitude, zoom + CELL_LEVELS)
+        points = pd.DataFrame({'X': x, 'Y': y, 'EIN': 1, 'Latitude': latitude, 'Longitude': longitude})
+        parts[zoom] = points.groupby(['X', 'Y']).sum().reset_index()
+    return parts
+
+
+def build_bins(zooms=ZOOMS, batch_rows=500_000):
+    parts = {zoom: [] for zoom in zooms}
+    for record_batch in ebmf_union.ebmf_dataset().to_batches(columns=EBMF_COLUMNS, batch_size=batch_rows):
+        for zoom, part in _partial(record_batch.to_pandas(), zooms).items():
+            parts[zoom].append(part)
+    zip_geocoder.flush_lookup_cache()
+
+    # Build next to the target and swap it in, so the map never reads a half-written index
+    tmp_dir = DENSITY_DIR + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    summary = {}
+    for zoom in zooms:
+        bins = pd.concat(parts[zoom], ignore_index=True).groupby(['X', 'Y']).sum().reset_index()
+        # Coordinate sums -> centroid of the organizations in each cell
+        bins['Latitude'] /= bins['EIN']
+        bins['Longitude'] /= bins['EIN']
+        bins = schema.apply(bins.sort_values(['X', 'Y']), 'density_bins')
+        os.makedirs(os.path.join(tmp_dir, f'zoom={zoom}'))
+        bins.to_parquet(os.path.join(tmp_dir, f'zoom={zoom}', 'part-0.parquet'), index=False, row_group_size=ROW_GROUP_ROWS)
+        summary[zoom] = len(bins)
+    shutil.rmtree(DENSITY_DIR, ignore_errors=True)
+    os.replace(tmp_dir, DENSITY_DIR)
+    return summary
+
+
+def signature():
+    # Changes whenever the bins are rebuilt; None if they haven't been built
+    try:
+        return os.stat(DENSITY_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def available_zooms():
+    # Zoom levels with bins
+    return sorted(int(name.split('=')[1]) for name in os.listdir(DENSITY_DIR) if name.startswith('zoom='))
+
+
+def read_bins(zoom):
+    # Bins of one zoom level
+    dataset = ds.dataset(DENSITY_DIR, format='parquet', partitioning='hive')
+    return dataset.to_table(filter=ds.field('zoom') == zoom, columns=['X', 'Y', 'EIN', 'Latitude', 'Longitude']).to_pandas()
+
+
+def coarsen(bins, max_bins):
+    # At most max_bins bins: the cells of each 2^levels x 2^levels block merged into one,
+    # for the fewest levels that fit, with the centroid of all their organizations.
+    # Returns (bins, levels)
+    levels = 0
+    merged = bins
+    weighted = bins.assign(Latitude=bins['Latitude'] * bins['EIN'], Longitude=bins['Longitude'] * bins['EIN'])
+    while len(merged) > max_bins:
+        levels += 1
+        merged = weighted.assign(X=weighted['X'] // 2 ** levels, Y=weighted['Y'] // 2 ** levels)
+        merged = merged.groupby(['X', 'Y'], as_index=False)[['EIN', 'Latitude', 'Longitude']].sum()
+        merged['Latitude'] /= merged['EIN']
+        merged['Longitude'] /= merged['EIN']
+    return merged, levels
+
+
+if __name__ == '__main__':
+    for zoom, n in build_bins().items():
+        print(f'zoom {zoom}: {n:,} bins')
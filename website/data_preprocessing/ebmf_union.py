@@ -0,0 +1,178 @@
+# Exempt Organizations Business Master File (EO BMF) union.
+#
+# Scriptable version of EBMF_union.ipynb. Instead of reading every regional file into
+# memory and concatenating them, each region is streamed in chunks with explicit dtypes
+# and written to its own Parquet partition:
+#
+#   data/ebmf/region=<region>/part-0.parquet
+#
+# data/ebmf/_manifest.json records the SHA-256 of every regional CSV, so when the IRS
+# refreshes one region only that partition is rebuilt.
+#
+# join_form990() then left-joins the Form 990 extract against the partitions, again in
+# chunks, keeps the latest filing per EIN (see dedup.py) and writes
+# data/form990_embf.csv as the notebook did.
+#
+# Usage (from the repo root):
+#   python website/data_preprocessing/ebmf_union.py
+
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import dedup
+import schema
+import stage_manifest
+from paths import DATA_DIR
+
+EBMF_SOURCE_DIR = os.path.join(DATA_DIR, 'EBMF')
+EBMF_DIR = os.path.join(DATA_DIR, 'ebmf')
+MANIFEST_PATH = os.path.join(EBMF_DIR, '_manifest.json')
+
+# Partition name -> regional file in data/EBMF/
+REGIONS = {
+    'gulf_coast': 'exempt_orgs_gulf_coast.csv',
+    'intl': 'exempt_orgs_intl.csv',
+    'mid_atlantic': 'exempt_orgs_mid_atlantic.csv',
+    'puerto_rico': 'exempt_orgs_puerto_rico.csv',
+    'eo1': 'Regional Giving Data IRS eo1.csv',
+}
+
+CHUNK_ROWS = 250_000
+
+# EO BMF layout. Codes are small integers, periods are YYYYMM integers; all nullable
+# because some regions leave them blank.
+EBMF_SCHEMA = pa.schema([
+    ('EIN', pa.int64()),
+    ('NAME', pa.string()),
+    ('ICO', pa.string()),
+    ('STREET', pa.string()),
+    ('CITY', pa.string()),
+    ('STATE', pa.string()),
+    ('ZIP', pa.string()),
+    ('GROUP', pa.int16()),
+    ('SUBSECTION', pa.int8()),
+    ('AFFILIATION', pa.int8()),
+    ('CLASSIFICATION', pa.int16()),
+    ('RULING', pa.int32()),
+    ('DEDUCTIBILITY', pa.int8()),
+    ('FOUNDATION', pa.int8()),
+    ('ACTIVITY', pa.int32()),
+    ('ORGANIZATION', pa.int8()),
+    ('STATUS', pa.int8()),
+    ('TAX_PERIOD', pa.int32()),
+    ('ASSET_CD', pa.int8()),
+    ('INCOME_CD', pa.int8()),
+    ('FILING_REQ_CD', pa.int8()),
+    ('PF_FILING_REQ_CD', pa.int8()),
+    ('ACCT_PD', pa.int8()),
+    ('ASSET_AMT', pa.float64()),
+    ('INCOME_AMT', pa.float64()),
+    ('REVENUE_AMT', pa.float64()),
+    ('NTEE_CD', pa.string()),
+    ('SORT_NAME', pa.string()),
+])
+
+_PANDAS_DTYPES = {
+    pa.int64(): 'Int64', pa.int32(): 'Int32', pa.int16(): 'Int16', pa.int8(): 'Int8',
+    pa.float64(): 'float64', pa.string(): 'string',
+}
+EBMF_DTYPES = {field.name: _PANDAS_DTYPES[field.type] for field in EBMF_SCHEMA}
+
+# EO BMF fields carried into the Form 990 join
+JOIN_COLUMNS = ['EIN', 'ACTIVITY', 'NTEE_CD', 'SUBSECTION', 'AFFILIATION']
+
+
+def partition_path(region):
+    return os.path.join(EBMF_DIR, f'region={region}')
+
+
+def read_region_chunks(path, columns=None):
+    # Stream one regional CSV as typed chunks
+    usecols = columns or list(EBMF_DTYPES)
+    dtypes = {col: EBMF_DTYPES[col] for col in usecols}
+    return pd.read_csv(path, usecols=usecols, dtype=dtypes, chunksize=CHUNK_ROWS)
+
+
+def write_region(region, path):
+    # Write one region to its partition, one row group per chunk. Returns the row count.
+    out_dir = partition_path(region)
+    # Leading underscore keeps the dataset reader from picking up a half-written partition
+    tmp_dir = os.path.join(EBMF_DIR, f'_tmp_{region}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    rows = 0
+    with pq.ParquetWriter(os.path.join(tmp_dir, 'part-0.parquet'), EBMF_SCHEMA) as writer:
+        for chunk in read_region_chunks(path):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=EBMF_SCHEMA, preserve_index=False))
+            rows += len(chunk)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return rows
+
+
+def union_regions(force=False):
+    # Rebuild the partitions of regions whose CSV changed. Returns a summary frame.
+    manifest = stage_manifest.load_manifest(MANIFEST_PATH)
+    summary = []
+    for region, filename in REGIONS.items():
+        path = os.path.join(EBMF_SOURCE_DIR, filename)
+        if not os.path.exists(path):
+            summary.append({'region': region, 'status': 'missing', 'rows': None})
+            continue
+
+        sha256 = stage_manifest.file_sha256(path)
+        if not force and stage_manifest.is_current(manifest, region, sha256, partition_path(region)):
+            summary.append({'region': region, 'status': 'up to date', 'rows': manifest[region]['rows']})
+            continue
+
+        rows = write_region(region, path)
+        manifest[region] = {'source': filename, 'sha256': sha256, 'rows': rows}
+        # Save after every region so an interrupted run keeps the finished ones
+        stage_manifest.save_manifest(MANIFEST_PATH, manifest)
+        summary.append({'region': region, 'status': 'rebuilt', 'rows': rows})
+    return pd.DataFrame(summary)
+
+
+def ebmf_dataset():
+    return ds.dataset(EBMF_DIR, format='parquet', partitioning='hive')
+
+
+def read_ebmf(columns=None, filter=None):
+    # Read (a projection of) the unioned EO BMF from the partitions
+    return schema.apply(ebmf_dataset().to_table(columns=columns, filter=filter).to_pandas(), 'ebmf')
+
+
+def join_form990(form990_path=os.path.join(DATA_DIR, '22eoextract990.csv'),
+                 output_path=os.path.join(DATA_DIR, 'form990_embf.csv')):
+    # Left join the Form 990 extract against the EO BMF, streaming the extract in chunks
+    # and keeping only the latest filing per EIN as we go
+    embf_merged = read_ebmf(columns=JOIN_COLUMNS)
+
+    latest = dedup.LatestFilingDeduper(key='ein', period='tax_pd')
+    for form990 in pd.read_csv(form990_path, chunksize=CHUNK_ROWS):
+        form990_embf = pd.merge(form990, embf_merged, on='EIN', how='left')
+        # Standardize column names.
+        form990_embf.columns = [x.lower() for x in form990_embf.columns]
+        latest.update(form990_embf)
+    form990_embf = latest.result()
+    print(f'{latest.dropped:,} older filings dropped')
+
+    # Convert columns to appropriate data types.
+    form990_embf['tax_pd'] = dedup.period_to_datetime(form990_embf['tax_pd'])
+    form990_embf['ein'] = form990_embf['ein'].astype(str).str.replace(r'\.0$', '', regex=True)
+
+    form990_embf.to_csv(output_path)
+    return form990_embf.shape
+
+
+if __name__ == '__main__':
+    print(union_regions().to_string(index=False))
+    if os.path.exists(os.path.join(DATA_DIR, '22eoextract990.csv')):
+        print('form990_embf:', join_form990())
@@ -0,0 +1,99 @@
+# Form 990 expense categories for the financial dashboard (streamlit.py).
+#
+# A category scheme maps category names to the Form 990 expense columns they add up:
+#
+#   {'Mission Related': ['grntstogovt', 'grnsttoindiv', ...], 'Fundraising': [...], ...}
+#
+# category_matrix() turns a scheme into a 0/1 matrix (expense column x category), so the
+# categories of every filing come out of a single float32 matrix product with the expense
+# matrix instead of one DataFrame sum per category. The expense matrix is extracted once
+# (expense_values()); any other scheme, including one put together in the dashboard, is
+# applied to the same matrix without touching the data again.
+#
+# Missing amounts count as 0 in a category sum, as DataFrame.sum does. With
+# skip_empty=True a category is missing (NaN) for filings where all of its columns are,
+# which for one-column categories gives the same statistics as the raw column.
+
+import numpy as np
+import pandas as pd
+
+import quantile_sketch
+
+EXPENSE_COLUMNS = [
+    'accntingfees', 'advrtpromo', 'benifitsmembrs', 'compnsatncurrofcr',
+    'compnsatnandothr', 'converconventmtng', 'deprcatndepletn', 'grntstogovt',
+    'grnsttoindiv', 'grntstofrgngovt', 'infotech', 'insurance',
+    'feesforsrvcinvstmgmt', 'legalfees', 'feesforsrvclobby', 'feesforsrvcmgmt',
+    'occupancy', 'officexpns', 'othremplyeebenef', 'othrexpnsa', 'othrexpnsb',
+    'othrexpnsc', 'othrexpnsd', 'othrexpnse', 'othrexpnsf', 'feesforsrvcothr',
+    'othrsalwages', 'pymtoaffiliates', 'payrolltx', 'pensionplancontrb',
+    'profndraising', 'royaltsexpns', 'totfuncexpns', 'travel',
+    'travelofpublicoffcl', 'lessdirfndrsng',
+]
+
+# Breakdown of organization expenses (dashboard question 2)
+EXPENSE_SCHEME = {
+    'Mission Related': ['grntstogovt', 'grnsttoindiv', 'grntstofrgngovt', 'converconventmtng'],
+    'Admin General': ['compnsatncurrofcr', 'officexpns', 'insurance', 'occupancy'],
+    'Fundraising': ['profndraising', 'advrtpromo', 'lessdirfndrsng'],
+    'Other': ['deprcatndepletn', 'travel'],
+}
+
+# Admin general expense columns and their labels (dashboard question 3)
+ADMIN_COLUMNS = {
+    'compnsatncurrofcr': 'Compensation of Officers',
+    'officexpns': 'Office Expenses',
+    'insurance': 'Insurance',
+    'occupancy': 'Occupancy',
+    'accntingfees': 'Accounting Fees',
+    'legalfees': 'Legal Fees',
+    'feesforsrvcmgmt': 'Management Service Fees',
+    'feesforsrvcinvstmgmt': 'Investment Management Fees',
+    'othrsalwages': 'Other Salaries and Wages',
+    'payrolltx': 'Payroll Taxes',
+    'pensionplancontrb': 'Pension Plan Contributions',
+    'othremplyeebenef': 'Other Employee Benefits',
+    'infotech': 'Information Technology',
+    'compnsatnandothr': 'Compensation and Other Benefits',
+    'travelofpublicoffcl': 'Travel and Entertainment for Public Officials',
+    'benifitsmembrs': 'Benefits to Members',
+}
+ADMIN_SCHEME = {label: [column] for column, label in ADMIN_COLUMNS.items()}
+
+
+def expense_values(df, columns=EXPENSE_COLUMNS):
+    # (amounts, present): float32 expense matrix with missing amounts as 0, and where they were present
+    values = df[list(columns)].to_numpy(dtype=np.float32, na_value=np.nan)
+    present = ~np.isnan(values)
+    np.nan_to_num(values, copy=False)
+    return values, present
+
+
+def category_matrix(scheme, columns=EXPENSE_COLUMNS):
+    # 0/1 matrix of expense columns (rows) x categories (columns) for a scheme
+    position = {column: i for i, column in enumerate(columns)}
+    matrix = np.zeros((len(columns), len(scheme)), dtype=np.float32)
+    for j, members in enumerate(scheme.values()):
+        unknown = [column for column in members if column not in position]
+        if unknown:
+            raise ValueError(f'Unknown expense columns: {unknown}')
+        matrix[[position[column] for column in members], j] = 1
+    return matrix
+
+
+def categorize(values, present, scheme, columns=EXPENSE_COLUMNS, skip_empty=False):
+    # Category amounts of every filing, one column per category of the scheme
+    matrix = category_matrix(scheme, columns)
+    categories = values @ matrix
+    if skip_empty:
+        categories[~(present @ matrix.astype(bool))] = np.nan
+    return pd.DataFrame(categories, columns=list(scheme))
+
+
+def category_statistics(values, present, scheme, columns=EXPENSE_COLUMNS, skip_empty=False):
+    # Mean and median (from quantile sketches) of every category of the scheme
+    categories = categorize(values, present, scheme, columns, skip_empty)
+    return pd.DataFrame({
+        'mean': categories.astype('float64').mean(),
+        'median': quantile_sketch.column_quantiles(categories, categories.columns),
+    })
@@ -0,0 +1,185 @@
+# Financial-health clustering (CLUSTER_KMEANS) of the full EO BMF population.
+#
+# CLUSTER_KMEANS in df_env_city_cluster.csv / df_city_nteena_cluster.csv was fitted
+# offline on a filtered subset. fit() clusters every organization in data/ebmf/ instead:
+#
+#   - features are ASSET_AMT, INCOME_AMT and REVENUE_AMT, log-scaled (sign * log1p|x|,
+#     missing amounts as 0) and standardized,
+#   - the model is a MiniBatchKMeans with a fixed seed, fed batch by batch from the
+#     Parquet partitions (out of core), whose distance computations use all cores,
+#   - cluster labels are ordered by centroid size, so 0 is the smallest financial
+#     footprint and the last HIGH_IMPACT_CLUSTERS labels have the highest potential impact.
+#
+# write_assignments() also keeps a quantile sketch of every feature per cluster and NTEE
+# major group (data/cluster_sketches.parquet, see quantile_sketch.py), merged batch by
+# batch, for the dashboard's cluster medians.
+#
+# The scaler and centroids are saved to data/kmeans_model.json. assign() labels new
+# records (e.g. a monthly IRS drop) against the saved centroids and can fold them into
+# the centroids with the usual running-mean update, without re-clustering everything;
+# centers() turns them back into dollars for the dashboard. Only fit() needs
+# scikit-learn, so the dashboards can read the model without it.
+#
+# Usage (from the repo root, after ebmf_union.py):
+#   python website/data_preprocessing/financial_clusters.py
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ebmf_union
+import ntee
+import quantile_sketch
+import schema
+from paths import DATA_DIR
+
+MODEL_PATH = os.path.join(DATA_DIR, 'kmeans_model.json')
+ASSIGNMENTS_PATH = os.path.join(DATA_DIR, 'ebmf_clusters.parquet')
+HIGH_IMPACT_PATH = os.path.join(DATA_DIR, 'cluster_high_impact.parquet')
+SKETCHES_PATH = os.path.join(DATA_DIR, 'cluster_sketches.parquet')
+
+FEATURES = ['ASSET_AMT', 'INCOME_AMT', 'REVENUE_AMT']
+N_CLUSTERS = 3
+HIGH_IMPACT_CLUSTERS = 2
+RANDOM_STATE = 42
+EPOCHS = 3
+BATCH_ROWS = 100_000
+
+ORGANIZATION_COLUMNS = ['EIN', 'NAME', 'CITY', 'STATE', 'NTEE_CD']
+
+
+def log_features(df):
+    values = df[FEATURES].astype('float64').fillna(0).to_numpy()
+    return np.sign(values) * np.log1p(np.abs(values))
+
+
+def _batches(columns=FEATURES):
+    for batch in ebmf_union.ebmf_dataset().to_batches(columns=columns, batch_size=BATCH_ROWS):
+        yield batch.to_pandas()
+
+
+def fit():
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.preprocessing import StandardScaler
+
+    # Pass 1: scaler statistics
+    scaler = StandardScaler()
+    for batch in _batches():
+        scaler.partial_fit(log_features(batch))
+
+    # Passes 2..: mini-batch KMeans over the scaled batches
+    kmeans = MiniBatchKMeans(n_clusters=N_CLUSTERS, random_state=RANDOM_STATE, batch_size=BATCH_ROWS)
+    for _ in range(EPOCHS):
+        for batch in _batches():
+            kmeans.partial_fit(scaler.transform(log_features(batch)))
+
+    # Order clusters by the size of their centroid in log-dollar space
+    raw_centroids = scaler.inverse_transform(kmeans.cluster_centers_)
+    order = np.argsort(raw_centroids.sum(axis=1))
+    model = {
+        'features': FEATURES,
+        'random_state': RANDOM_STATE,
+        'scaler_mean': scaler.mean_.tolist(),
+        'scaler_scale': scaler.scale_.tolist(),
+        'centroids': kmeans.cluster_centers_[order].tolist(),
+        'counts': [0] * N_CLUSTERS,
+    }
+    # Pass 3: label everyone and record the cluster sizes
+    write_assignments(model)
+    save_model(model)
+    return model
+
+
+def save_model(model, path=MODEL_PATH):
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=2)
+
+
+def load_model(path=MODEL_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def centers(model):
+    # Centroid of every cluster in dollars: unscaled, then the log-scaling undone
+    logs = np.asarray(model['centroids']) * np.asarray(model['scaler_scale']) + np.asarray(model['scaler_mean'])
+    dollars = pd.DataFrame(np.sign(logs) * np.expm1(np.abs(logs)), columns=model['features'])
+    return dollars.rename_axis('CLUSTER_KMEANS').reset_index()
+
+
+def high_impact_labels(model):
+    return list(range(len(model['centroids'])))[-HIGH_IMPACT_CLUSTERS:]
+
+
+def _scaled(model, df):
+    return (log_features(df) - np.asarray(model['scaler_mean'])) / np.asarray(model['scaler_scale'])
+
+
+def predict(model, df):
+    # Nearest centroid for every row (one BLAS matrix product, multi-threaded)
+    x = _scaled(model, df)
+    centroids = np.asarray(model['centroids'])
+    distances = (x ** 2).sum(axis=1)[:, None] - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    return distances.argmin(axis=1).astype(np.int8)
+
+
+def assign(df, update=False, path=MODEL_PATH):
+    # Label new records against the saved centroids. With update=True the centroids move
+    # toward the new records (running mean weighted by cluster size) and are saved again;
+    # labels keep their meaning, so existing assignments stay valid.
+    model = load_model(path)
+    labels = predict(model, df)
+    if update:
+        x = _scaled(model, df)
+        centroids = np.asarray(model['centroids'])
+        counts = np.asarray(model['counts'], dtype='float64')
+        for label in np.unique(labels):
+            members = x[labels == label]
+            counts[label] += len(members)
+            centroids[label] += (members.sum(axis=0) - len(members) * centroids[label]) / counts[label]
+        model['centroids'] = centroids.tolist()
+        model['counts'] = counts.astype(int).tolist()
+        save_model(model, path)
+    return labels
+
+
+def write_assignments(model):
+    # Label every organization; writes data/ebmf_clusters.parquet (EIN, CLUSTER_KMEANS),
+    # the environmental/civil rights organizations in the high impact clusters and the
+    # feature sketches per cluster.
+    counts = np.zeros(len(model['centroids']), dtype=np.int64)
+    high_impact, sketches = [], []
+    assignment_schema = pa.schema([('EIN', pa.int64()), ('CLUSTER_KMEANS', pa.int8())])
+    with pq.ParquetWriter(ASSIGNMENTS_PATH, assignment_schema) as writer:
+        for batch in _batches(ORGANIZATION_COLUMNS + FEATURES):
+            labels = predict(model, batch)
+            counts += np.bincount(labels, minlength=len(counts))
+            assignments = pd.DataFrame({'EIN': batch['EIN'], 'CLUSTER_KMEANS': labels})
+            writer.write_table(pa.Table.from_pandas(assignments, schema=assignment_schema, preserve_index=False))
+
+            majors = ntee.major_group(batch['NTEE_CD'])
+            features = batch[FEATURES].assign(CLUSTER_KMEANS=labels, NTEE_MAJOR=majors)
+            sketches.append(quantile_sketch.sketch(features, ['CLUSTER_KMEANS', 'NTEE_MAJOR'], FEATURES, 'FUND_TYPE'))
+
+            keep = np.isin(labels, high_impact_labels(model)) & majors.isin(ntee.ENV_CIVIL_RIGHTS).to_numpy()
+            high_impact.append(batch.loc[keep, ['EIN', 'NAME', 'CITY', 'STATE'] + FEATURES].assign(
+                NTEE_NAME=ntee.major_name(majors[keep]).to_numpy(),
+                CLUSTER_KMEANS=labels[keep],
+            ))
+
+    model['counts'] = counts.tolist()
+    high_impact = pd.concat(high_impact, ignore_index=True)
+    high_impact = high_impact.sort_values(['CLUSTER_KMEANS', 'REVENUE_AMT'], ascending=False)
+    schema.apply(high_impact, 'cluster_high_impact').to_parquet(HIGH_IMPACT_PATH, index=False)
+    schema.apply(quantile_sketch.merge(sketches), 'cluster_sketches').to_parquet(SKETCHES_PATH, index=False)
+    return counts
+
+
+if __name__ == '__main__':
+    model = fit()
+    for label, count in enumerate(model['counts']):
+        print(f'cluster {label}: {count:,} organizations')
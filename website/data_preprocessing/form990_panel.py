@@ -0,0 +1,136 @@
+# Year-over-year financial panel of Form 990 filers.
+#
+# form990_union.py unions the yearly Form 990 extracts (one `year` per extract) and joins
+# them to the EO BMF. build_panel() turns that into one row per organization and year,
+# written to data/form990_panel.parquet:
+#
+#   EIN, year, CITY, STATE, NTEE_CD
+#   <metric>                    the amounts in PANEL_METRICS and the expense categories of
+#                               expense_categories.EXPENSE_SCHEME (mission_related, ...)
+#   <metric>_change             difference from the organization's previous year
+#   <metric>_growth             growth rate from the previous year
+#   <metric>_rolling_change     mean change over the last ROLLING_YEARS years
+#   <metric>_volatility         standard deviation of the organization's growth rates
+#
+# Changes and growth rates are null when the organization didn't file the year before
+# (growth rates also when the previous amount was 0). An organization filing twice in a
+# year keeps its latest tax period, as in dedup.py.
+#
+# The panel is a single polars lazy query: the per-organization trajectories are window
+# expressions over EIN ordered by year, which polars evaluates in parallel across cores,
+# and the result is streamed to Parquet. rollup() answers city, NTEE and cluster
+# questions from the panel alone, without going back to the Form 990 extracts.
+#
+# Usage (from the repo root, after form990_union.py):
+#   python website/data_preprocessing/form990_panel.py
+
+import os
+
+import polars as pl
+
+import cities as city_labels
+import expense_categories
+import form990_union
+from paths import DATA_DIR
+
+PANEL_PATH = os.path.join(DATA_DIR, 'form990_panel.parquet')
+# Cluster assignments written by financial_clusters.py
+CLUSTERS_PATH = os.path.join(DATA_DIR, 'ebmf_clusters.parquet')
+
+# Form 990 amounts tracked per organization: total functional expenses, total revenue
+# and total assets at the end of the year
+PANEL_METRICS = ['totfuncexpns', 'totrevenue', 'totassetsend']
+CATEGORY_METRICS = {name.lower().replace(' ', '_'): columns for name, columns in expense_categories.EXPENSE_SCHEME.items()}
+METRICS = PANEL_METRICS + list(CATEGORY_METRICS)
+
+ROLLING_YEARS = 2
+ORGANIZATION_COLUMNS = ['CITY', 'STATE', 'NTEE_CD']
+
+
+def _amounts(columns):
+    # Panel metrics from the Form 990 columns; metrics whose columns no extract has are null
+    amounts = [
+        pl.col(metric).cast(pl.Float64) if metric in columns else pl.lit(None, dtype=pl.Float64).alias(metric)
+        for metric in PANEL_METRICS
+    ]
+    for metric, members in CATEGORY_METRICS.items():
+        present = [pl.col(column).cast(pl.Float64) for column in members if column in columns]
+        # Missing amounts count as 0 in a category, as in expense_categories.py
+        amounts.append(pl.sum_horizontal(present).alias(metric) if present else pl.lit(None, dtype=pl.Float64).alias(metric))
+    return amounts
+
+
+def scan_filings():
+    # One row per EIN and year (the latest tax period) with the panel metrics
+    joined = form990_union.join_ebmf()
+    columns = joined.collect_schema().names()
+    filings = joined.select(
+        pl.col('ein').alias('EIN'),
+        pl.col('year').cast(pl.Int16),
+        pl.col('tax_pd').cast(pl.Float64, strict=False).fill_null(-1).alias('tax_pd'),
+        *ORGANIZATION_COLUMNS,
+        *_amounts(columns),
+    ).filter(pl.col('EIN').is_not_null())
+    latest = pl.col('tax_pd') == pl.col('tax_pd').max().over(['EIN', 'year'])
+    return filings.filter(latest).unique(['EIN', 'year'], keep='any').drop('tax_pd')
+
+
+def scan_panel_query():
+    # Lazy panel: per-organization changes, growth rates, rolling changes and volatility
+    by_ein = {'partition_by': 'EIN', 'order_by': 'year'}
+    consecutive = (pl.col('year') - pl.col('year').shift(1).over(**by_ein)) == 1
+    trajectories = []
+    for metric in METRICS:
+        previous = pl.col(metric).shift(1).over(**by_ein)
+        trajectories += [
+            pl.when(consecutive).then(pl.col(metric) - previous).alias(f'{metric}_change'),
+            pl.when(consecutive & (previous != 0)).then((pl.col(metric) - previous) / previous.abs()).alias(f'{metric}_growth'),
+        ]
+    windows = []
+    for metric in METRICS:
+        windows += [
+            pl.col(f'{metric}_change').rolling_mean(ROLLING_YEARS, min_samples=1).over(**by_ein).alias(f'{metric}_rolling_change'),
+            pl.col(f'{metric}_growth').std().over('EIN').alias(f'{metric}_volatility'),
+        ]
+    return (
+        scan_filings()
+        .with_columns(trajectories)
+        .with_columns(windows)
+        .with_columns(pl.col(ORGANIZATION_COLUMNS).cast(pl.Categorical))
+    )
+
+
+def build_panel(path=PANEL_PATH):
+    # Stream the panel to Parquet next to the target and swap it in
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    scan_panel_query().sort(['EIN', 'year']).sink_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return pl.scan_parquet(path).select(pl.len(), pl.col('EIN').n_unique()).collect().row(0)
+
+
+def scan_panel():
+    return pl.scan_parquet(PANEL_PATH)
+
+
+def rollup(by=('CITY', 'STATE', 'year'), metrics=PANEL_METRICS, cities=None):
+    # Organizations (EIN), totals, median growth rates and median volatility per group of
+    # `by` (columns of the panel, or CLUSTER_KMEANS), optionally for some "CITY, ST" only
+    panel = scan_panel()
+    if 'CLUSTER_KMEANS' in by:
+        panel = panel.join(pl.scan_parquet(CLUSTERS_PATH), on='EIN', how='inner')
+    if cities is not None:
+        city = pl.concat_str([pl.col('CITY').cast(pl.String), pl.col('STATE').cast(pl.String)], separator=city_labels.SEPARATOR)
+        panel = panel.filter(city.is_in(list(cities)))
+    aggregates = [pl.col('EIN').n_unique()]
+    for metric in metrics:
+        aggregates += [
+            pl.col(metric).sum(),
+            pl.col(f'{metric}_growth').median(),
+            pl.col(f'{metric}_volatility').median(),
+        ]
+    return panel.group_by(list(by)).agg(aggregates).sort(list(by)).collect().to_pandas()
+
+
+if __name__ == '__main__':
+    rows, organizations = build_panel()
+    print(f'form990_panel: {rows:,} organization-years, {organizations:,} organizations')
@@ -0,0 +1,138 @@
+# Multi-year Form 990 union and EO BMF join.
+#
+# Scriptable, lazy version of Form990_union.ipynb:
+#
+#   1. convert_years(): every data/Form990/<yy>form990.xlsx is converted once to
+#      data/form990/year=<yyyy>/part-0.parquet. The xlsx hashes are kept in
+#      data/form990/_manifest.json, so a year is only re-converted when its workbook
+#      changes. New years are picked up just by dropping the workbook into data/Form990/.
+#   2. scan_form990() / join_ebmf(): polars lazy queries over those partitions and the
+#      EO BMF partitions written by ebmf_union.py. The join is streamed straight into
+#      data/form990_embf.parquet (and the CSV the dashboards read), using all cores
+#      without ever holding the full multi-year table in memory.
+#
+# Usage (from the repo root, after ebmf_union.py):
+#   python website/data_preprocessing/form990_union.py
+
+import os
+import re
+import shutil
+
+import polars as pl
+
+import stage_manifest
+from paths import DATA_DIR
+
+XLSX_DIR = os.path.join(DATA_DIR, 'Form990')
+FORM990_DIR = os.path.join(DATA_DIR, 'form990')
+MANIFEST_PATH = os.path.join(FORM990_DIR, '_manifest.json')
+EBMF_DIR = os.path.join(DATA_DIR, 'ebmf')
+
+XLSX_PATTERN = re.compile(r'^(\d{2})form990\.xlsx$')
+
+# EO BMF fields carried into the Form 990 data
+EBMF_COLUMNS = ['EIN', 'NTEE_CD', 'CITY', 'STATE', 'ZIP']
+
+
+def workbooks():
+    # {year: path} for every <yy>form990.xlsx in data/Form990/
+    found = {}
+    for filename in sorted(os.listdir(XLSX_DIR)):
+        match = XLSX_PATTERN.match(filename)
+        if match:
+            found[2000 + int(match.group(1))] = os.path.join(XLSX_DIR, filename)
+    return found
+
+
+def partition_path(year):
+    return os.path.join(FORM990_DIR, f'year={year}')
+
+
+def _normalize(df):
+    # The workbooks don't agree on column types from year to year (and fastexcel's type
+    # inference trips over some of them), so everything is read as text and cast here:
+    # ein -> Int64, fully numeric columns -> Float64, anything else stays a string.
+    casts = []
+    for col in df.columns:
+        values = df[col].str.strip_chars()
+        if col == 'ein':
+            casts.append(values.cast(pl.Float64, strict=False).cast(pl.Int64).alias(col))
+            continue
+        numeric = values.cast(pl.Float64, strict=False)
+        if numeric.null_count() == values.null_count():
+            casts.append(numeric.alias(col))
+        else:
+            casts.append(values.alias(col))
+    return pl.DataFrame(casts)
+
+
+def convert_year(year, path):
+    df = _normalize(pl.read_excel(path, infer_schema_length=0))
+    df = df.with_columns(pl.lit(year, dtype=pl.Int16).alias('year'))
+
+    out_dir = partition_path(year)
+    tmp_dir = os.path.join(FORM990_DIR, f'_tmp_{year}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    df.write_parquet(os.path.join(tmp_dir, 'part-0.parquet'))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return df.height
+
+
+def convert_years(force=False):
+    # One-time xlsx -> Parquet conversion of every year whose workbook changed
+    manifest = stage_manifest.load_manifest(MANIFEST_PATH)
+    summary = []
+    for year, path in workbooks().items():
+        key = str(year)
+        sha256 = stage_manifest.file_sha256(path)
+        if not force and stage_manifest.is_current(manifest, key, sha256, partition_path(year)):
+            summary.append({'year': year, 'status': 'up to date', 'rows': manifest[key]['rows']})
+            continue
+        rows = convert_year(year, path)
+        manifest[key] = {'source': os.path.basename(path), 'sha256': sha256, 'rows': rows}
+        stage_manifest.save_manifest(MANIFEST_PATH, manifest)
+        summary.append({'year': year, 'status': 'rebuilt', 'rows': rows})
+    return pl.DataFrame(summary)
+
+
+def scan_form990():
+    # Lazy union of all converted years. Columns missing from a year come back null and
+    # differing types are widened, so later years with new fields still line up.
+    years = sorted(
+        entry for entry in os.listdir(FORM990_DIR) if entry.startswith('year=')
+    )
+    return pl.concat(
+        [pl.scan_parquet(os.path.join(FORM990_DIR, entry, '*.parquet')) for entry in years],
+        how='diagonal_relaxed',
+    )
+
+
+def scan_ebmf(columns=EBMF_COLUMNS):
+    # Only the region=<region> partitions: ebmf_union writes into _tmp_<region> first, which
+    # pyarrow's dataset reader skips but a plain glob would not
+    return pl.scan_parquet(os.path.join(EBMF_DIR, 'region=*', '*.parquet'), hive_partitioning=True).select(columns)
+
+
+def join_ebmf():
+    # Lazy left join of the unioned Form 990 data against the EO BMF, in the row order of
+    # the Form 990 data (so row positions, e.g. from an ntee.NteeIndex, are stable)
+    embf_filtered = scan_ebmf().rename({'EIN': 'ein'})
+    return scan_form990().join(embf_filtered, on='ein', how='left', maintain_order='left')
+
+
+def write_form990_embf(parquet_path=os.path.join(DATA_DIR, 'form990_embf.parquet'),
+                       csv_path=os.path.join(DATA_DIR, 'form990_embf.csv')):
+    # Stream the join to Parquet, then stream that out as the CSV the dashboards read
+    join_ebmf().sink_parquet(parquet_path)
+    if csv_path:
+        # The notebook wrote the pandas index as a nameless first column, which the
+        # dashboards drop as 'Unnamed: 0'; keep that layout.
+        pl.scan_parquet(parquet_path).with_row_index(name='').sink_csv(csv_path)
+    return pl.scan_parquet(parquet_path).select(pl.len()).collect().item()
+
+
+if __name__ == '__main__':
+    print(convert_years())
+    print('form990_embf rows:', write_form990_embf())
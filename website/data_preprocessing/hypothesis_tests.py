@@ -0,0 +1,251 @@
+# Batched hypothesis tests: every group vs the rest, for every fund type at once.
+#
+# hypothesis_testing_results.csv holds three Welch t-tests (target vs non-target cities,
+# one per fund type) computed from df_combined.csv. This module runs the same kind of
+# comparison for whole families of groups:
+#
+#   CITY_TARGET  the cities of interest vs all other cities, one observation per city:
+#                the city totals of data/ebmf/ per CITY x STATE, or df_combined.csv (one
+#                row per city name and fund type, as in hypothesis_testing_results.csv)
+#                before ebmf_union.py has been run
+#   CITY         each city ("CITY, ST", see cities.py) vs all other cities' organizations
+#                (data/ebmf/)
+#   NTEE_MAJOR   each NTEE major group vs all other organizations (data/ebmf/)
+#
+# For each family the group statistics (n, mean, centered sum of squares) come from a few
+# np.bincount calls, so the Welch t-tests of all groups and fund types are array operations.
+# The permutation test shuffles the group labels once per resample and scores every group
+# and fund type from the same shuffle with bincount as well; the resamples are split into
+# chunks with independent seeds (SeedSequence.spawn) and run in a process pool.
+#
+# p-values are corrected for multiple comparisons within each family (Benjamini-Hochberg
+# and Holm). The results are written to data/hypothesis_tests.parquet, which the dashboard
+# reads instead of the static three-row table.
+#
+# Missing amounts count as 0, as in df_combined.csv.
+#
+# Usage (from the repo root, after ebmf_union.py for the CITY and NTEE_MAJOR families):
+#   python website/data_preprocessing/hypothesis_tests.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import cities
+import ebmf_union
+import ntee
+import schema
+from paths import DATA_DIR
+
+RESULTS_PATH = os.path.join(DATA_DIR, 'hypothesis_tests.parquet')
+
+FUND_TYPES = ['INCOME_AMT', 'ASSET_AMT', 'REVENUE_AMT']
+
+N_RESAMPLES = 10_000
+CHUNK_RESAMPLES = 250
+SEED = 42
+
+# Groups with fewer observations are not tested (they still count towards "the rest")
+MIN_GROUP_SIZE = 30
+
+RESULT_COLUMNS = [
+    'FAMILY', 'GROUP', 'FUND_TYPE', 'N_GROUP', 'N_REST', 'MEAN_GROUP', 'MEAN_REST',
+    'T_STAT', 'DF', 'P_VALUE', 'P_PERMUTATION', 'P_VALUE_BH', 'P_VALUE_HOLM', 'P_PERMUTATION_BH',
+]
+
+
+def encode(labels, min_size=1):
+    # Integer codes for the groups with at least min_size members; the others (and missing
+    # labels) get code len(groups), i.e. they are only ever part of "the rest".
+    labels = pd.Series(labels)
+    sizes = labels.value_counts()
+    groups = sizes.index[sizes >= min_size].sort_values()
+    codes = pd.Categorical(labels, categories=groups).codes.astype(np.int64)
+    codes[codes < 0] = len(groups)
+    return codes, groups
+
+
+def group_stats(codes, values, k):
+    # n, mean and centered sum of squares of each of the k groups (and the rest bucket k),
+    # one column per fund type
+    n = np.bincount(codes, minlength=k + 1).astype('float64')
+    sums = np.stack([np.bincount(codes, weights=values[:, f], minlength=k + 1) for f in range(values.shape[1])], axis=1)
+    means = sums / np.maximum(n, 1)[:, None]
+    centered = values - means[codes]
+    ss = np.stack([np.bincount(codes, weights=centered[:, f] ** 2, minlength=k + 1) for f in range(values.shape[1])], axis=1)
+    return n, means, ss
+
+
+def welch(codes, values, k):
+    # Welch t-test of each group vs everyone else, for all groups and fund types at once
+    n, means, ss = group_stats(codes, values, k)
+    n_total = n.sum()
+    mean_total = values.mean(axis=0)
+    ss_total = ss.sum(axis=0) + (n[:, None] * (means - mean_total) ** 2).sum(axis=0)
+
+    n_group, mean_group, ss_group = n[:k, None], means[:k], ss[:k]
+    n_rest = n_total - n_group
+    mean_rest = (mean_total * n_total - mean_group * n_group) / n_rest
+    # Between-group decomposition of the total sum of squares
+    ss_rest = ss_total - ss_group - n_group * (mean_group - mean_total) ** 2 - n_rest * (mean_rest - mean_total) ** 2
+    ss_rest = np.maximum(ss_rest, 0)
+
+    se_group = ss_group / (n_group - 1) / n_group
+    se_rest = ss_rest / (n_rest - 1) / n_rest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (mean_group - mean_rest) / np.sqrt(se_group + se_rest)
+        df = (se_group + se_rest) ** 2 / (se_group ** 2 / (n_group - 1) + se_rest ** 2 / (n_rest - 1))
+    p = 2 * stats.t.sf(np.abs(t), df)
+    return {
+        'N_GROUP': np.broadcast_to(n_group, t.shape), 'N_REST': np.broadcast_to(n_rest, t.shape),
+        'MEAN_GROUP': mean_group, 'MEAN_REST': mean_rest, 'T_STAT': t, 'DF': df, 'P_VALUE': p,
+    }
+
+
+def _mean_differences(sums, n_group, totals, n_total):
+    # Difference between each group's mean and the mean of everyone else
+    return sums / n_group - (totals - sums) / (n_total - n_group)
+
+
+# Worker state, set once per process so the arrays are not pickled for every chunk
+_codes = _values = None
+
+
+def _init_worker(codes, values):
+    global _codes, _values
+    _codes, _values = codes, values
+
+
+def _exceedances(seed, n_resamples, k, observed):
+    # Count of resamples whose |mean difference| reaches the observed one, per group and fund type
+    rng = np.random.default_rng(seed)
+    n_group = np.bincount(_codes, minlength=k + 1)[:k, None].astype('float64')
+    totals = _values.sum(axis=0)
+    n_total = len(_codes)
+    threshold = np.abs(observed) * (1 - 1e-12)
+    counts = np.zeros(observed.shape, dtype=np.int64)
+    for _ in range(n_resamples):
+        shuffled = _codes[rng.permutation(n_total)]
+        sums = np.stack([np.bincount(shuffled, weights=_values[:, f], minlength=k + 1)[:k] for f in range(_values.shape[1])], axis=1)
+        counts += np.abs(_mean_differences(sums, n_group, totals, n_total)) >= threshold
+    return counts
+
+
+def permutation_pvalues(codes, values, k, n_resamples=N_RESAMPLES, seed=SEED, workers=None):
+    # Two-sided permutation p-values for the difference in means of each group vs the rest
+    n, means, _ = group_stats(codes, values, k)
+    observed = _mean_differences(means[:k] * n[:k, None], n[:k, None], values.sum(axis=0), len(codes))
+
+    chunks = [CHUNK_RESAMPLES] * (n_resamples // CHUNK_RESAMPLES)
+    if n_resamples % CHUNK_RESAMPLES:
+        chunks.append(n_resamples % CHUNK_RESAMPLES)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    counts = np.zeros(observed.shape, dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(codes, values)) as pool:
+        futures = [pool.submit(_exceedances, s, size, k, observed) for s, size in zip(seeds, chunks)]
+        for future in futures:
+            counts += future.result()
+    return (counts + 1) / (n_resamples + 1)
+
+
+def benjamini_hochberg(p):
+    # False discovery rate adjusted p-values (NaN stays NaN)
+    p = np.asarray(p, dtype='float64')
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    values = p[valid]
+    m = len(values)
+    order = np.argsort(values)[::-1]
+    ranked = values[order] * m / np.arange(m, 0, -1)
+    result = np.empty(m)
+    result[order] = np.minimum(np.minimum.accumulate(ranked), 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def holm(p):
+    # Family-wise error rate adjusted p-values (NaN stays NaN)
+    p = np.asarray(p, dtype='float64')
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    values = p[valid]
+    m = len(values)
+    order = np.argsort(values)
+    ranked = values[order] * (m - np.arange(m))
+    result = np.empty(m)
+    result[order] = np.minimum(np.maximum.accumulate(ranked), 1)
+    adjusted[valid] = result
+    return adjusted
+
+
+def run_family(family, labels, values, fund_types=FUND_TYPES, min_size=MIN_GROUP_SIZE,
+               n_resamples=N_RESAMPLES, seed=SEED, workers=None):
+    # Test every group in labels against the rest, for every column of values
+    codes, groups = encode(labels, min_size)
+    k = len(groups)
+    if k == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    values = np.ascontiguousarray(values, dtype='float64')
+
+    columns = welch(codes, values, k)
+    if n_resamples:
+        columns['P_PERMUTATION'] = permutation_pvalues(codes, values, k, n_resamples, seed, workers)
+    else:
+        columns['P_PERMUTATION'] = np.full((k, len(fund_types)), np.nan)
+
+    results = pd.DataFrame({
+        'FAMILY': family,
+        'GROUP': np.repeat(np.asarray(groups, dtype=str), len(fund_types)),
+        'FUND_TYPE': np.tile(fund_types, k),
+        **{name: np.asarray(column).ravel() for name, column in columns.items()},
+    })
+    results['P_VALUE_BH'] = benjamini_hochberg(results['P_VALUE'])
+    results['P_VALUE_HOLM'] = holm(results['P_VALUE'])
+    results['P_PERMUTATION_BH'] = benjamini_hochberg(results['P_PERMUTATION'])
+    return results[RESULT_COLUMNS]
+
+
+def city_target_family(ebmf=None, **kwargs):
+    # Cities of interest vs the other cities, from the EO BMF city totals when given
+    if ebmf is not None:
+        wide = ebmf.groupby(['CITY', 'STATE'], observed=True)[FUND_TYPES].sum().reset_index()
+        target = cities.mask(wide, cities.target_labels())
+    else:
+        combined = schema.apply(pd.read_csv(os.path.join(DATA_DIR, 'df_combined.csv')), 'df_combined')
+        wide = combined.pivot_table(index=['CITY', 'CITY_TARGET'], columns='FUND_TYPE', values='AMOUNT', aggfunc='sum', observed=True).reset_index()
+        target = (wide['CITY_TARGET'] == 1).to_numpy()
+    labels = pd.Series('1', index=wide.index).where(target)
+    return run_family('CITY_TARGET', labels, wide[FUND_TYPES].fillna(0), min_size=1, **kwargs)
+
+
+def ebmf_families(ebmf, **kwargs):
+    # Each city and each NTEE major group vs all other organizations in the EO BMF
+    values = ebmf[FUND_TYPES].astype('float64').fillna(0).to_numpy()
+    return [
+        run_family('CITY', cities.label(ebmf['CITY'], ebmf['STATE']), values, **kwargs),
+        run_family('NTEE_MAJOR', ntee.major_name(ntee.major_group(ebmf['NTEE_CD'])), values, **kwargs),
+    ]
+
+
+def run_all(n_resamples=N_RESAMPLES, seed=SEED, workers=None):
+    kwargs = dict(n_resamples=n_resamples, seed=seed, workers=workers)
+    if os.path.exists(ebmf_union.EBMF_DIR):
+        ebmf = ebmf_union.read_ebmf(columns=['CITY', 'STATE', 'NTEE_CD'] + FUND_TYPES)
+        families = [city_target_family(ebmf, **kwargs)] + ebmf_families(ebmf, **kwargs)
+    else:
+        families = [city_target_family(**kwargs)]
+    results = pd.concat(families, ignore_index=True)
+    results = schema.apply(results, 'hypothesis_tests')
+    results.to_parquet(RESULTS_PATH, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    results = run_all()
+    for family, tests in results.groupby('FAMILY', sort=False):
+        significant = (tests['P_VALUE_BH'] < 0.05).sum()
+        print(f'{family}: {len(tests):,} tests, {significant:,} significant after BH correction')
@@ -0,0 +1,206 @@
+# National Taxonomy of Exempt Entities (NTEE) major groups and codes.
+#
+# The first letter of an NTEE code is its major group; these are the NTEE_NAME labels
+# used throughout the dashboards. The letter and the first digit are the subsector
+# (C3: natural resources conservation) and the letter and both digits the full code
+# (C32: water resources, wetlands conservation & management).
+#
+# The EO BMF repeats a few thousand distinct codes over millions of rows, so everything
+# here works on the distinct codes and maps the result back to the rows with integer
+# codes: NTEE codes are never string-scanned row by row. NteeIndex keeps those integer
+# codes plus a prefix tree over the sorted distinct codes, so subgroup counts are a
+# dictionary lookup and filters a gather over integers:
+#
+#   index = ntee.NteeIndex(df['NTEE_CD'])
+#   index.count('C')                        # environmental organizations
+#   index.counts(['C0', 'C3', 'C32'])       # every subgroup at once
+#   df[index.mask(ntee.ENV_CIVIL_RIGHTS)]   # C* or R*
+#   index.names()                           # NTEE code name of every row
+
+import numpy as np
+import pandas as pd
+
+NTEE_MAJOR_NAMES = {
+    'A': 'Arts, Culture and Humanities',
+    'B': 'Education',
+    'C': 'Environment',
+    'D': 'Animal-Related',
+    'E': 'Health Care',
+    'F': 'Mental Health & Crisis Intervention',
+    'G': 'Voluntary Health Associations & Medical Disciplines',
+    'H': 'Medical Research',
+    'I': 'Crime & Legal-Related',
+    'J': 'Employment',
+    'K': 'Food, Agriculture and Nutrition',
+    'L': 'Housing & Shelter',
+    'M': 'Public Safety, Disaster Preparedness and Relief',
+    'N': 'Recreation & Sports',
+    'O': 'Youth Development',
+    'P': 'Human Services',
+    'Q': 'International, Foreign Affairs and National Security',
+    'R': 'Civil Rights, Social Action & Advocacy',
+    'S': 'Community Improvement & Capacity Building',
+    'T': 'Philanthropy, Voluntarism and Grantmaking Foundations',
+    'U': 'Science & Technology',
+    'V': 'Social Science',
+    'W': 'Public & Societal Benefit',
+    'X': 'Religion-Related',
+    'Y': 'Mutual & Membership Benefit',
+    'Z': 'Unknown',
+}
+
+MAJOR_GROUPS = list(NTEE_MAJOR_NAMES)
+
+# Common codes, the same in every major group (C01, R01, ...)
+COMMON_CODE_NAMES = {
+    '01': 'Alliances & Advocacy',
+    '02': 'Management & Technical Assistance',
+    '03': 'Professional Societies & Associations',
+    '05': 'Research Institutes & Public Policy Analysis',
+    '11': 'Single Organization Support',
+    '12': 'Fund Raising & Fund Distribution',
+    '19': 'Support N.E.C.',
+}
+
+# Codes of the environmental and civil rights major groups
+NTEE_CODE_NAMES = {
+    'C20': 'Pollution Abatement & Control',
+    'C27': 'Recycling',
+    'C30': 'Natural Resources Conservation & Protection',
+    'C32': 'Water Resources, Wetlands Conservation & Management',
+    'C34': 'Land Resources Conservation',
+    'C35': 'Energy Resources Conservation & Development',
+    'C36': 'Forest Conservation',
+    'C40': 'Botanical, Horticultural & Landscape Services',
+    'C41': 'Botanical Gardens & Arboreta',
+    'C42': 'Garden Clubs',
+    'C50': 'Environmental Beautification',
+    'C60': 'Environmental Education',
+    'C99': 'Environment N.E.C.',
+    'R20': 'Civil Rights',
+    'R22': 'Minority Rights',
+    'R23': "Disabled Persons' Rights",
+    'R24': "Women's Rights",
+    'R25': "Seniors' Rights",
+    'R26': 'Lesbian & Gay Rights',
+    'R28': "Children's Rights",
+    'R30': 'Intergroup & Race Relations',
+    'R40': 'Voter Education & Registration',
+    'R60': 'Civil Liberties',
+    'R61': 'Reproductive Rights',
+    'R62': 'Right to Life',
+    'R63': 'Censorship, Freedom of Speech & Press',
+    'R67': 'Right to Die & Euthanasia',
+    'R99': 'Civil Rights, Social Action & Advocacy N.E.C.',
+}
+
+# Environmental and civil rights major groups
+ENV_CIVIL_RIGHTS = ('C', 'R')
+
+
+def _factorize(codes):
+    # (integer code of each row into the sorted distinct normalized codes, -1 when
+    # missing; those codes). Only the distinct raw values are normalized.
+    values = codes if isinstance(codes, pd.Series) else pd.Series(np.asarray(codes, dtype=object))
+    raw_codes, raw = pd.factorize(values)
+    clean = pd.Series(np.asarray(raw, dtype=object), dtype='string').str.strip().str.upper()
+    clean = clean.where(clean.str.len() > 0)
+    vocabulary = np.array(sorted(set(clean.dropna())), dtype=object)
+    clean_codes = pd.Index(vocabulary).get_indexer(clean.fillna(''))
+    row_codes = np.append(clean_codes, -1)[raw_codes].astype(np.int32)
+    return row_codes, vocabulary
+
+
+def _take(values, codes):
+    # values[code] for each row, None where the code is -1
+    return pd.Series(np.append(np.asarray(values, dtype=object), None)[codes], dtype=object)
+
+
+def code_name(code):
+    # Name of one NTEE code: its own, its common code's or its major group's
+    major = NTEE_MAJOR_NAMES.get(code[:1])
+    if code[:3] in NTEE_CODE_NAMES:
+        return NTEE_CODE_NAMES[code[:3]]
+    if major is not None and code[1:3] in COMMON_CODE_NAMES:
+        return f'{major} - {COMMON_CODE_NAMES[code[1:3]]}'
+    return major
+
+
+def major_group(codes):
+    # First letter of each NTEE code (None when missing or not a letter)
+    row_codes, vocabulary = _factorize(codes)
+    letters = [code[0] if code[0] in NTEE_MAJOR_NAMES else None for code in vocabulary]
+    majors = _take(letters, row_codes).astype('string')
+    if isinstance(codes, pd.Series):
+        majors = majors.set_axis(codes.index).rename(codes.name)
+    return majors
+
+
+def major_name(letters):
+    # NTEE_NAME for a Series of major group letters
+    return pd.Series(letters).map(NTEE_MAJOR_NAMES)
+
+
+class NteeIndex:
+
+    def __init__(self, codes):
+        self.codes, self.vocabulary = _factorize(codes)
+        self.size = len(self.codes)
+
+        # Prefix tree over the sorted distinct codes: every prefix covers a contiguous
+        # range [lo, hi) of them
+        self.tree = {'': (0, len(self.vocabulary))}
+        for i, code in enumerate(self.vocabulary):
+            for end in range(1, len(code) + 1):
+                lo, _ = self.tree.get(code[:end], (i, i))
+                self.tree[code[:end]] = (lo, i + 1)
+
+        # Rows per distinct code, cumulated, so a range's row count is one subtraction
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.codes[self.codes >= 0], minlength=len(self.vocabulary)), out=self.offsets[1:])
+        self._order = None
+
+        # Integer codes of the coarser levels (-1 when missing)
+        majors = np.array([MAJOR_GROUPS.index(code[0]) if code[0] in NTEE_MAJOR_NAMES else -1 for code in self.vocabulary])
+        self.major = np.append(majors, -1)[self.codes].astype(np.int8)
+        self.subsectors = np.array(sorted({code[:2] for code in self.vocabulary}), dtype=object)
+        subsectors = pd.Index(self.subsectors).get_indexer([code[:2] for code in self.vocabulary])
+        self.subsector = np.append(subsectors, -1)[self.codes].astype(np.int16)
+
+    def _range(self, prefix):
+        return self.tree.get(prefix.strip().upper(), (0, 0))
+
+    def count(self, prefix):
+        # Rows whose code starts with prefix
+        lo, hi = self._range(prefix)
+        return int(self.offsets[hi] - self.offsets[lo])
+
+    def counts(self, prefixes):
+        return pd.Series({prefix: self.count(prefix) for prefix in prefixes}, dtype='int64')
+
+    def mask(self, prefixes):
+        # Boolean row mask of the codes starting with prefix (or any of several prefixes)
+        selected = np.zeros(len(self.vocabulary) + 1, dtype=bool)
+        for prefix in [prefixes] if isinstance(prefixes, str) else prefixes:
+            lo, hi = self._range(prefix)
+            selected[lo:hi] = True
+        return selected[self.codes]
+
+    def rows(self, prefix):
+        # Positions of the rows whose code starts with prefix, in code order
+        if self._order is None:
+            # Rows sorted by code, the missing ones (code -1) first
+            self._order = np.argsort(self.codes, kind='stable')
+        missing = self.size - self.offsets[-1]
+        lo, hi = self._range(prefix)
+        return self._order[missing + self.offsets[lo]:missing + self.offsets[hi]]
+
+    def frame(self):
+        # Integer NTEE_MAJOR, NTEE_SUBSECTOR and NTEE_CODE of every row
+        return pd.DataFrame({'NTEE_MAJOR': self.major, 'NTEE_SUBSECTOR': self.subsector, 'NTEE_CODE': self.codes})
+
+    def names(self, level='code'):
+        # NTEE code name (level='code') or NTEE_NAME (level='major') of every row
+        if level == 'major':
+            return _take(list(NTEE_MAJOR_NAMES.values()), self.major)
+        return _take([code_name(code) for code in self.vocabulary], self.codes)
@@ -0,0 +1,9 @@
+# Data directory of the pipeline stages and the dashboards.
+#
+# Everything is read from and written under DATA_DIR: the repo's data/ by default, or
+# the directory in PHILANTHROPY_DATA_DIR (e.g. the synthetic data of website/benchmarks/).
+# The variable is read once, when this module is first imported.
+
+import os
+
+DATA_DIR = os.environ.get('PHILANTHROPY_DATA_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
@@ -0,0 +1,205 @@
+# Column profiles of the raw IRS extracts for the data-exploration notebooks.
+#
+# The notebooks used to read a whole extract (e.g. 22eoextract990.csv) with pandas and
+# then call describe(), isna().sum() and value_counts() once per group of columns,
+# rescanning the frame every time. profile(path) computes everything they show in one
+# pass over the file:
+#
+#   rows, columns, dtypes
+#   per column: non-missing, missing and distinct counts, mean/std/min/quartiles/max
+#   of numeric columns, and the TOP_VALUES most frequent values (the top/freq of
+#   describe() for string columns)
+#   the first HEAD_ROWS rows of the cleaned frame
+#
+# The pass is a single polars lazy query: the CSV is parsed in chunks on all cores and
+# every aggregate is evaluated over the same scan. With key/period the extract is first
+# reduced to the latest filing per key, with the semantics of dedup.py.
+#
+# The profile is written to data/profiles/<file>.<hash>.json, keyed by the SHA-256 of the
+# file and the options, so the notebooks (and every Quarto render) read a few kilobytes
+# of JSON instead of re-parsing the extract until the file changes. describe(),
+# missing(), value_counts(), metadata() and head() turn a profile back into the frames
+# the notebooks display.
+#
+# Usage (from the repo root):
+#   python website/data_preprocessing/profiling.py data/22eoextract990.csv [key period]
+
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+import polars as pl
+
+import dedup
+import stage_manifest
+from paths import DATA_DIR
+
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+
+# Bump when the profile layout changes, so older cached profiles are recomputed
+PROFILE_VERSION = 2
+TOP_VALUES = 20
+HEAD_ROWS = 5
+# Rows polars reads to infer the column types; the whole file when that isn't enough
+INFER_SCHEMA_ROWS = 100_000
+QUANTILES = {'25%': 0.25, '50%': 0.5, '75%': 0.75}
+
+
+def _period(period):
+    # YYYYMM periods as integers, MISSING_PERIOD where invalid (see dedup.period_to_int)
+    numeric = pl.col(period).cast(pl.Float64, strict=False)
+    month = numeric % 100
+    valid = numeric.is_finite() & (numeric == numeric.floor()) & (month >= 1) & (month <= 12) & (numeric > 100000)
+    return pl.when(valid).then(numeric).otherwise(dedup.MISSING_PERIOD).cast(pl.Int32).alias(period)
+
+
+def scan(path):
+    # Lazy frame of the extract with lower-case column names
+    try:
+        frame = pl.scan_csv(path, infer_schema_length=INFER_SCHEMA_ROWS).rename(str.lower)
+        frame.collect_schema()
+    except pl.exceptions.ComputeError:
+        frame = pl.scan_csv(path, infer_schema_length=None).rename(str.lower)
+    return frame
+
+
+def latest_per_key(frame, key, period):
+    # dedup.latest_per_key on a lazy frame: the newest period per key, the last row among
+    # equal periods, undated rows only for keys without a dated one
+    frame = frame.with_columns(_period(period))
+    return frame.filter(pl.col(period) == pl.col(period).max().over(key)).unique(key, keep='last', maintain_order=True)
+
+
+def _aggregates(name, dtype):
+    column = pl.col(name)
+    aggregates = [
+        column.count().alias(f'{name}|count'),
+        column.null_count().alias(f'{name}|missing'),
+        column.drop_nulls().n_unique().alias(f'{name}|unique'),
+        column.drop_nulls().value_counts(sort=True).head(TOP_VALUES).implode().alias(f'{name}|values'),
+    ]
+    if dtype.is_numeric():
+        aggregates += [
+            column.mean().alias(f'{name}|mean'),
+            column.std().alias(f'{name}|std'),
+            column.min().cast(pl.Float64).alias(f'{name}|min'),
+            *[column.quantile(q, 'linear').alias(f'{name}|{label}') for label, q in QUANTILES.items()],
+            column.max().cast(pl.Float64).alias(f'{name}|max'),
+        ]
+    return aggregates
+
+
+def _jsonable(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def compute(path, key=None, period=None):
+    # Profile of the extract at path (see the top of this file) in one pass
+    raw = scan(path)
+    frame = raw if key is None else latest_per_key(raw, key, period)
+    columns = frame.collect_schema()
+    aggregates = [pl.len().alias('|rows')]
+    for name, dtype in columns.items():
+        aggregates += _aggregates(name, dtype)
+    queries = [frame.select(aggregates), frame.head(HEAD_ROWS)]
+    if key is not None:
+        queries.append(raw.select(pl.len()))
+    # One scan shared by the queries (polars eliminates the common subplan)
+    results = pl.collect_all(queries)
+    row = results[0].row(0, named=True)
+
+    stats, values = {}, {}
+    for name, dtype in columns.items():
+        fields = ['count', 'missing', 'unique'] + (['mean', 'std', 'min', *QUANTILES, 'max'] if dtype.is_numeric() else [])
+        stats[name] = {field: row[f'{name}|{field}'] for field in fields}
+        values[name] = [[_jsonable(entry[name]), entry['count']] for entry in row[f'{name}|values']]
+        if not dtype.is_numeric():
+            top = values[name][0] if values[name] else [None, None]
+            stats[name].update({'top': top[0], 'freq': top[1]})
+    return {
+        'version': PROFILE_VERSION,
+        'source': os.path.basename(path),
+        'key': key,
+        'period': period,
+        'rows': row['|rows'],
+        'rows_read': results[2].item() if key is not None else row['|rows'],
+        'columns': list(columns),
+        'dtypes': {name: str(dtype).lower() for name, dtype in columns.items()},
+        'stats': stats,
+        'values': values,
+        'head': [{name: _jsonable(value) for name, value in record.items()} for record in results[1].to_dicts()],
+    }
+
+
+def profile_path(path, sha256, key=None, period=None):
+    options = hashlib.sha256(json.dumps([PROFILE_VERSION, key, period]).encode()).hexdigest()
+    return os.path.join(PROFILE_DIR, f'{os.path.basename(path)}.{sha256[:16]}.{options[:8]}.json')
+
+
+def profile(path, key=None, period=None, refresh=False):
+    # Cached profile of the extract at path, computed on the first call for this content
+    cached_path = profile_path(path, stage_manifest.file_sha256(path), key, period)
+    if not refresh and os.path.exists(cached_path):
+        with open(cached_path) as f:
+            return json.load(f)
+
+    result = compute(path, key, period)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = f'{cached_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f)
+    os.replace(tmp_path, cached_path)
+    return result
+
+
+##################################################
+# Frames for the notebooks
+
+NUMERIC_STATS = ['count', 'mean', 'std', 'min', *QUANTILES, 'max']
+STRING_STATS = ['count', 'unique', 'top', 'freq']
+
+
+def _is_numeric(profile, column):
+    return 'mean' in profile['stats'][column]
+
+
+def describe(profile, columns):
+    # DataFrame.describe() of the columns: numeric statistics when any column is numeric
+    # (the other columns are left out, as describe() does), count/unique/top/freq otherwise
+    numeric = [column for column in columns if _is_numeric(profile, column)]
+    columns, rows = (numeric, NUMERIC_STATS) if numeric else (columns, STRING_STATS)
+    return pd.DataFrame({column: [profile['stats'][column][stat] for stat in rows] for column in columns}, index=rows)
+
+
+def missing(profile, columns):
+    return pd.Series({column: profile['stats'][column]['missing'] for column in columns}, name='missing')
+
+
+def value_counts(profile, column):
+    return pd.DataFrame(profile['values'][column], columns=[column, 'count'])
+
+
+def metadata(profile):
+    # Type, distinct count and missing count of every column
+    return pd.DataFrame({
+        'Column Name': profile['columns'],
+        'Data Type': [profile['dtypes'][column] for column in profile['columns']],
+        'Unique Values': [profile['stats'][column]['unique'] for column in profile['columns']],
+        'Missing Values': [profile['stats'][column]['missing'] for column in profile['columns']],
+    })
+
+
+def head(profile):
+    return pd.DataFrame(profile['head'], columns=profile['columns'])
+
+
+if __name__ == '__main__':
+    path = sys.argv[1]
+    key, period = (sys.argv[2], sys.argv[3]) if len(sys.argv) > 3 else (None, None)
+    result = profile(path, key, period, refresh=True)
+    print(f"{result['source']}: {result['rows']:,} rows ({result['rows_read']:,} read), {len(result['columns'])} columns")
+    print(metadata(result).to_string(index=False))
@@ -0,0 +1,107 @@
+# Mergeable quantile sketches for the median-based financial views.
+#
+# A sketch is the histogram of a column over logarithmic buckets (DDSketch-style): bucket k
+# holds the amounts with |x| in (GAMMA^(k-2), GAMMA^(k-1)], negative amounts use -k and
+# |x| < 1 falls into bucket 0. Sketches are stored per group as long frames
+#
+#   <group columns> x COLUMN x BUCKET -> COUNT
+#
+# so sketches of different years, regions or batches merge by adding counts (merge()),
+# and a sketch never grows beyond a few thousand buckets per group and column.
+#
+# Error bound: quantiles() returns the lower order statistic at rank floor(q * (n - 1)),
+# i.e. the same value as DataFrame.quantile(q, interpolation='lower'), to within a relative
+# error of RELATIVE_ACCURACY (1%). Amounts under 1 in absolute value are reported as 0.
+# Pandas' default median averages the two middle values of an even-sized group, so it can
+# differ from the sketch by more than 1% when those two values are far apart.
+#
+# group_quantiles() and column_quantiles() take exact=True to compute the same statistic
+# from the raw values instead; relative_errors() compares both on a frame for validation.
+
+import numpy as np
+import pandas as pd
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+ZERO_BUCKET = 0
+MISSING_BUCKET = np.iinfo(np.int16).min
+
+
+def bucket(values):
+    # Signed log bucket of each amount: 0 for |x| < 1, +-k for |x| in (GAMMA^(k-2), GAMMA^(k-1)]
+    values = np.asarray(values, dtype='float64')
+    magnitude = np.abs(values)
+    buckets = np.full(len(values), ZERO_BUCKET, dtype=np.int16)
+    positive = magnitude >= 1
+    keys = np.ceil(np.log(magnitude[positive]) / np.log(GAMMA)).astype(np.int16) + 1
+    buckets[positive] = np.sign(values[positive]).astype(np.int16) * keys
+    buckets[np.isnan(values)] = MISSING_BUCKET
+    return buckets
+
+
+def bucket_value(buckets):
+    # Representative amount of each bucket (relative error <= RELATIVE_ACCURACY)
+    buckets = np.asarray(buckets, dtype='float64')
+    values = np.sign(buckets) * 2 * GAMMA ** (np.abs(buckets) - 1) / (GAMMA + 1)
+    return np.where(buckets == MISSING_BUCKET, np.nan, values)
+
+
+def sketch(df, by, columns, column_name='COLUMN', count='COUNT'):
+    # Sketch of each of columns per `by` group, as a long frame
+    by = list(by)
+    long = df[by + list(columns)].melt(id_vars=by, var_name=column_name, value_name='VALUE')
+    long = long[by + [column_name]].assign(BUCKET=bucket(long['VALUE']), **{count: 1})
+    return long.groupby(by + [column_name, 'BUCKET'], dropna=False, observed=True)[count].sum().reset_index()
+
+
+def merge(sketches, count='COUNT'):
+    # Sum sketches of the same groups (batches, years, regions, ...)
+    combined = pd.concat(sketches, ignore_index=True)
+    keys = [col for col in combined.columns if col != count]
+    return combined.groupby(keys, dropna=False, observed=True)[count].sum().reset_index()
+
+
+def quantiles(sketches, by, q=0.5, count='COUNT'):
+    # Quantile q of every `by` group (VALUE); by usually includes the column name column
+    by = list(by)
+    selected = sketches[sketches['BUCKET'] != MISSING_BUCKET]
+    summary = selected.groupby(by + ['BUCKET'], observed=True)[count].sum().reset_index()
+    summary = summary[summary[count] > 0].sort_values(by + ['BUCKET'])
+
+    # Lower order statistic at rank q * (n - 1): first bucket whose cumulative count passes it
+    cumulative = summary.groupby(by, observed=True)[count].cumsum()
+    total = summary.groupby(by, observed=True)[count].transform('sum')
+    rank = np.floor(q * (total - 1))
+    hits = summary[cumulative > rank].drop_duplicates(by)
+    return hits[by].assign(VALUE=bucket_value(hits['BUCKET'])).reset_index(drop=True)
+
+
+def group_quantiles(df, by, columns, q=0.5, exact=False):
+    # df.groupby(by)[columns].quantile(q, interpolation='lower'), from sketches unless exact
+    by, columns = list(by), list(columns)
+    if exact:
+        return df.groupby(by, observed=True)[columns].quantile(q, interpolation='lower').reset_index()
+    estimates = quantiles(sketch(df, by, columns), by + ['COLUMN'], q)
+    wide = estimates.pivot(index=by, columns='COLUMN', values='VALUE')
+    return wide.reindex(columns=columns).rename_axis(columns=None).reset_index()
+
+
+def column_quantiles(df, columns, q=0.5, exact=False):
+    # df[columns].quantile(q, interpolation='lower') as a Series, from sketches unless exact
+    columns = list(columns)
+    if exact:
+        return df[columns].quantile(q, interpolation='lower')
+    estimates = quantiles(sketch(df, [], columns), ['COLUMN'], q)
+    return estimates.set_index('COLUMN')['VALUE'].reindex(columns).rename(q)
+
+
+def relative_errors(df, by, columns, q=0.5):
+    # Sketch estimate vs exact quantile for every group and column, with the relative error
+    by = list(by)
+    estimate = group_quantiles(df, by, columns, q).melt(id_vars=by, var_name='COLUMN', value_name='ESTIMATE')
+    exact = group_quantiles(df, by, columns, q, exact=True).melt(id_vars=by, var_name='COLUMN', value_name='EXACT')
+    errors = estimate.merge(exact, on=by + ['COLUMN'])
+    # Amounts under 1 are reported as 0 and are outside the relative error bound
+    relative = (errors['ESTIMATE'] - errors['EXACT']).abs() / errors['EXACT'].abs()
+    errors['RELATIVE_ERROR'] = relative.where(errors['EXACT'].abs() >= 1, 0)
+    return errors
@@ -0,0 +1,208 @@
+# Declared dtypes for the datasets in data/ and the pipeline outputs.
+#
+# pd.read_csv loads every code column as int64/float64 and every string column as an
+# object/str column that repeats the same few CITY, STATE, FUND_TYPE and NTEE_NAME values
+# on every row. DATASETS declares, per dataset, compact dtypes for its columns:
+#
+#   - categoricals for repeated strings, with fixed dictionaries where the values are
+#     known in advance (FUND_TYPE, NTEE_NAME); values outside a fixed dictionary are
+#     appended to it rather than lost,
+#   - the smallest integer type for EO BMF codes and counts (nullable Int8/Int16/... when
+#     the column has missing values),
+#   - float32 for coordinates and years that can be missing; dollar amounts stay float64.
+#
+# apply() casts a frame to its declared dtypes (and downcasts undeclared columns the same
+# way); data_store.py applies it to every CSV it converts and the pipeline stages apply it
+# before writing Parquet, so the Arrow files carry the compact types and every loader gets
+# them back. memory_report() measures what a frame, or a set of frames, holds in memory.
+#
+# Usage (from the repo root, compares every data/*.csv as parsed by pandas and as declared here):
+#   python website/data_preprocessing/schema.py
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import ntee
+from paths import DATA_DIR
+
+
+FUND_TYPE = pd.CategoricalDtype(['INCOME_AMT', 'ASSET_AMT', 'REVENUE_AMT'])
+NTEE_NAME = pd.CategoricalDtype(list(ntee.NTEE_MAJOR_NAMES.values()))
+NTEE_MAJOR = pd.CategoricalDtype(list(ntee.NTEE_MAJOR_NAMES))
+CATEGORY = 'category'
+
+# String columns with fewer distinct values than this share of rows become categoricals;
+# in frames shorter than MIN_CATEGORY_ROWS the dictionary would cost more than it saves.
+CATEGORY_MAX_RATIO = 0.5
+MIN_CATEGORY_ROWS = 1_000
+
+AMOUNTS = {'ASSET_AMT': 'float64', 'INCOME_AMT': 'float64', 'REVENUE_AMT': 'float64'}
+
+# EO BMF layout (see ebmf_union.EBMF_SCHEMA)
+EBMF = {
+    'EIN': 'int64',
+    'CITY': CATEGORY,
+    'STATE': CATEGORY,
+    'GROUP': 'int16',
+    'SUBSECTION': 'int8',
+    'AFFILIATION': 'int8',
+    'CLASSIFICATION': 'int16',
+    'DEDUCTIBILITY': 'int8',
+    'FOUNDATION': 'int8',
+    'ACTIVITY': 'int32',
+    'ORGANIZATION': 'int8',
+    'STATUS': 'int8',
+    'TAX_PERIOD': 'int32',
+    'ASSET_CD': 'int8',
+    'INCOME_CD': 'int8',
+    'FILING_REQ_CD': 'int8',
+    'PF_FILING_REQ_CD': 'int8',
+    'ACCT_PD': 'int8',
+    'NTEE_CD': CATEGORY,
+    **AMOUNTS,
+}
+
+CLUSTERS = {**EBMF, 'RULING': CATEGORY, 'RULING_YEAR': 'float32', 'NTEE_NAME': NTEE_NAME, 'CLUSTER_KMEANS': 'int8'}
+
+DATASETS = {
+    # Dashboard CSVs
+    'df_combined': {'CITY': CATEGORY, 'FUND_TYPE': FUND_TYPE, 'AMOUNT': 'float64', 'CITY_TARGET': 'int8'},
+    'melted_city_funds': {'CITY': CATEGORY, 'FUND_TYPE': FUND_TYPE, 'AMOUNT': 'float64'},
+    'df_org_locals': {'CITY': CATEGORY, 'COUNT': 'int32', 'Latitude': 'float32', 'Longitude': 'float32'},
+    'df_city_rulingyear': {'RULING_YEAR': 'float32', 'EIN': 'int32'},
+    'df_city_decade': {'RULING': 'float32', 'EIN': 'int32'},
+    'df_city_rulingname': {'RULING_YEAR': 'int16', 'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_city_rulingname_all': {'RULING_YEAR': 'int16', 'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_city_rulingname_env': {'RULING_YEAR': 'int16', 'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_city_rulingname_grouped': {'RULING_YEAR': 'float32', 'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_nteename_groupby': {'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_nteename_city_groupby': {'CITY': CATEGORY, 'NTEE_NAME': NTEE_NAME, 'EIN': 'int32'},
+    'df_filing_agg': {'CITY': CATEGORY, 'FILING_REQ_CD': CATEGORY, 'EIN': 'int32'},
+    'df_filing_percentage': {
+        'CITY': CATEGORY, 'Not Required to File': 'int32', 'Required to File': 'int32', 'Total': 'int32',
+        'Percentage_Not_Required_to_File': 'float64',
+    },
+    'df_filing_ratio': {'CITY': CATEGORY, 'Not Required to File': 'int32', 'Required to File': 'int32', 'RATIO': 'float64'},
+    'df_env_city_cluster': CLUSTERS,
+    'df_city_nteena_cluster': CLUSTERS,
+    'hypothesis_testing_results': {'Fund Type': FUND_TYPE, 'T-stat': 'float64', 'P-value': 'float64'},
+    'zip_centroids': {'ZIP': 'string', 'CITY': CATEGORY, 'STATE': CATEGORY, 'Latitude': 'float32', 'Longitude': 'float32'},
+    'form990_embf': {'ein': 'int64', 'tax_pd': CATEGORY, 'activity': 'int32', 'ntee_cd': CATEGORY, 'subsection': 'int8', 'affiliation': 'int8'},
+
+    # Pipeline outputs
+    'ebmf': EBMF,
+    'cluster_high_impact': {
+        'EIN': 'int64', 'CITY': CATEGORY, 'STATE': CATEGORY, **AMOUNTS, 'NTEE_NAME': NTEE_NAME, 'CLUSTER_KMEANS': 'int8',
+    },
+    'cluster_sketches': {'CLUSTER_KMEANS': 'int8', 'NTEE_MAJOR': NTEE_MAJOR, 'FUND_TYPE': FUND_TYPE, 'BUCKET': 'int16', 'COUNT': 'int32'},
+    'cube_counts': {
+        'CITY': CATEGORY, 'STATE': CATEGORY, 'NTEE_MAJOR': NTEE_MAJOR, 'RULING_YEAR': 'int16',
+        'FILING_REQUIRED': 'bool', 'EIN': 'int32', **AMOUNTS,
+    },
+    'cube_buckets': {
+        'CITY': CATEGORY, 'STATE': CATEGORY, 'NTEE_MAJOR': NTEE_MAJOR, 'FUND_TYPE': FUND_TYPE, 'BUCKET': 'int16', 'EIN': 'int32',
+    },
+    'hypothesis_tests': {
+        'FAMILY': CATEGORY, 'FUND_TYPE': FUND_TYPE, 'N_GROUP': 'int32', 'N_REST': 'int32',
+    },
+    'density_bins': {'X': 'int32', 'Y': 'int32', 'EIN': 'int32', 'Latitude': 'float32', 'Longitude': 'float32'},
+}
+
+
+def _categorical(values, dtype):
+    if isinstance(dtype, str):
+        return values.astype(CATEGORY)
+    # Fixed dictionary, extended with any values it doesn't know
+    unknown = pd.Index(values.dropna().unique()).difference(dtype.categories)
+    if len(unknown):
+        dtype = pd.CategoricalDtype(list(dtype.categories) + sorted(unknown))
+    return values.astype(dtype)
+
+
+def _integer(values, dtype):
+    # Integer dtype, nullable (Int8, ...) when there are missing values; values out of the
+    # declared range are kept as int64 instead of wrapping around
+    limits = np.iinfo(dtype)
+    if values.min() < limits.min or values.max() > limits.max:
+        dtype = 'int64'
+    if values.isna().any():
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def _is_category(dtype):
+    return isinstance(dtype, pd.CategoricalDtype) or dtype == CATEGORY
+
+
+def cast(values, dtype):
+    # One column to a declared dtype
+    if _is_category(dtype):
+        if len(values) < MIN_CATEGORY_ROWS:
+            return values
+        return _categorical(values, dtype)
+    if dtype.startswith('int') and pd.api.types.is_numeric_dtype(values):
+        return _integer(values, dtype)
+    return values.astype(dtype)
+
+
+def downcast(values):
+    # Compact dtype for an undeclared column
+    if pd.api.types.is_bool_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='integer')
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        # Dictionary-encode repeated strings; leave near-unique columns (e.g. NAME) alone
+        if len(values) >= MIN_CATEGORY_ROWS and values.nunique() < CATEGORY_MAX_RATIO * len(values):
+            return values.astype(CATEGORY)
+    return values
+
+
+def dtypes(name):
+    # Declared dtypes of a dataset (empty for unknown datasets)
+    return DATASETS.get(name, {})
+
+
+def apply(df, name=None):
+    # df with its declared dtypes, undeclared columns downcast
+    declared = dtypes(name)
+    return df.assign(**{
+        col: cast(df[col], declared[col]) if col in declared else downcast(df[col])
+        for col in df.columns
+    })
+
+
+def memory_usage(df):
+    # Bytes held by df, strings included
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def memory_report(frames):
+    # Rows, columns and resident memory of each frame in a {name: DataFrame} dict
+    report = pd.DataFrame([
+        {'dataset': name, 'rows': len(df), 'columns': df.shape[1], 'MB': memory_usage(df) / 2**20}
+        for name, df in frames.items()
+    ]).set_index('dataset')
+    report['bytes per row'] = (report['MB'] * 2**20 / report['rows'].clip(lower=1)).round(1)
+    return report
+
+
+def column_report(df):
+    # dtype and resident memory of each column of a frame
+    usage = df.memory_usage(index=False, deep=True)
+    return pd.DataFrame({'dtype': df.dtypes.astype(str), 'MB': usage / 2**20}).sort_values('MB', ascending=False)
+
+
+if __name__ == '__main__':
+    raw, declared = {}, {}
+    for filename in sorted(os.listdir(DATA_DIR)):
+        if filename.endswith('.csv'):
+            name = os.path.splitext(filename)[0]
+            raw[name] = pd.read_csv(os.path.join(DATA_DIR, filename), low_memory=False)
+            declared[name] = apply(raw[name], name)
+    report = memory_report(raw)[['rows', 'MB']].join(memory_report(declared)[['MB']], rsuffix=' declared')
+    report['reduction'] = (report['MB'] / report['MB declared']).round(1)
+    print(report.round(2).to_string())
+    print(f"total: {report['MB'].sum():.1f} MB -> {report['MB declared'].sum():.1f} MB")
@@ -0,0 +1,40 @@
+# Content hashes for pipeline inputs.
+#
+# A stage keeps a small JSON manifest next to its output that maps each input to the
+# SHA-256 of the file it was built from. On the next run only inputs whose hash
+# changed (or whose output is missing) are reprocessed.
+
+import hashlib
+import json
+import os
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_current(manifest, key, sha256, output_path):
+    # True when key was last built from the same content and its output still exists
+    entry = manifest.get(key)
+    return entry is not None and entry.get('sha256') == sha256 and os.path.exists(output_path)
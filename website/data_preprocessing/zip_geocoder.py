@@ -0,0 +1,220 @@
+# Offline ZIP-centroid geocoder for EO BMF records.
+#
+# data/zip_centroids.csv is a bundled table of ZIP5 centroids (ZIP, CITY, STATE,
+# Latitude, Longitude; ~42.8k ZIP codes, including PO box and unique ZIPs). geocode()
+# attaches coordinates to every row of a frame with array operations only, no API calls
+# and no network access:
+#
+#   - ZIP strings are normalized: ZIP+4 ("97232-4103") and 9-digit ZIPs are cut to ZIP5,
+#     ZIPs that lost their leading zeros (2134, 2134.0) are zero-padded,
+#   - a ZIP5 in the table gets its centroid (precision 'zip5'),
+#   - an unknown ZIP5 gets the centroid of its 3-digit prefix area ('zip3'),
+#   - rows without a usable ZIP fall back to the centroid of their CITY and STATE ('city').
+#
+# The resolution of every distinct raw ZIP string is kept in data/geocode_cache.parquet,
+# so repeated runs over the EO BMF (millions of rows, a few hundred thousand distinct
+# ZIP+4 strings) only resolve strings they haven't seen. The cache is tied to the
+# signature of the centroid table and starts over when the table changes. It is read once
+# per process and kept in memory; batched callers resolve with persist=False and write it
+# back once with flush_lookup_cache().
+#
+# Usage (from the repo root, after ebmf_union.py; writes data/ebmf_locations.parquet):
+#   python website/data_preprocessing/zip_geocoder.py
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ebmf_union
+import schema
+from paths import DATA_DIR
+
+CENTROIDS_PATH = os.path.join(DATA_DIR, 'zip_centroids.csv')
+CACHE_PATH = os.path.join(DATA_DIR, 'geocode_cache.parquet')
+LOCATIONS_PATH = os.path.join(DATA_DIR, 'ebmf_locations.parquet')
+
+# Metadata key holding the centroid table signature a cache was built against
+SIGNATURE_KEY = b'centroids_signature'
+
+EARTH_RADIUS_KM = 6371.0088
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def normalize_zip(values):
+    # ZIP5 string of each value (ZIP+4, 9-digit and zero-stripped ZIPs included), NA if unusable
+    zips = pd.Series(values).astype('string').str.strip()
+    # 2134.0 from a float column
+    zips = zips.str.replace(r'\.0+$', '', regex=True)
+    zips = zips.str.split('-', n=1).str[0].str.replace(r'\D', '', regex=True)
+    # 9 digits without the dash are ZIP+4; 3-4 digits lost their leading zeros
+    zips = zips.where(zips.str.len() != 9, zips.str[:5])
+    zips = zips.where(~zips.str.len().isin([3, 4]), zips.str.zfill(5))
+    return zips.where(zips.str.len() == 5)
+
+
+def signature():
+    stat = os.stat(CENTROIDS_PATH)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def centroids():
+    # (zip5, zip3, city) lookup tables, cached for the life of the process
+    sig = signature()
+    with _lock:
+        cached = _cache.get('centroids')
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+
+    table = schema.apply(pd.read_csv(CENTROIDS_PATH, dtype={'ZIP': str}), 'zip_centroids')
+    coordinates = ['Latitude', 'Longitude']
+    zip5 = table.set_index('ZIP')[coordinates]
+    zip3 = table.groupby(table['ZIP'].str[:3])[coordinates].mean()
+    city = table.groupby(['CITY', 'STATE'], observed=True)[coordinates].mean()
+    tables = (zip5, zip3, city)
+    with _lock:
+        _cache['centroids'] = (sig, tables)
+    return tables
+
+
+def _resolve(raw):
+    # Latitude, Longitude and precision of each distinct raw ZIP string
+    zip5_table, zip3_table, _ = centroids()
+    zips = normalize_zip(raw)
+    exact = zips.map(zip5_table['Latitude']).notna()
+    prefix = zips.str[:3]
+    use_zip3 = ~exact & prefix.isin(zip3_table.index)
+    latitude = zips.map(zip5_table['Latitude']).where(exact, prefix.map(zip3_table['Latitude']))
+    longitude = zips.map(zip5_table['Longitude']).where(exact, prefix.map(zip3_table['Longitude']))
+    precision = np.select([exact.to_numpy(dtype=bool), use_zip3.to_numpy(dtype=bool)], ['zip5', 'zip3'], None)
+    return pd.DataFrame({
+        'ZIP': pd.Series(raw, dtype='string').to_numpy(),
+        'Latitude': latitude.to_numpy(dtype='float64', na_value=np.nan),
+        'Longitude': longitude.to_numpy(dtype='float64', na_value=np.nan),
+        'GEOCODE_PRECISION': precision,
+    })
+
+
+def load_lookup_cache():
+    # Persistent raw ZIP -> coordinates cache; empty if missing or built against another table
+    try:
+        table = pq.read_table(CACHE_PATH)
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    if (table.schema.metadata or {}).get(SIGNATURE_KEY, b'').decode() != signature():
+        return None
+    return table.to_pandas()
+
+
+def save_lookup_cache(lookup):
+    table = pa.Table.from_pandas(lookup, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SIGNATURE_KEY: signature().encode()})
+    tmp_path = f'{CACHE_PATH}.{os.getpid()}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, CACHE_PATH)
+
+
+def _lookup_cache():
+    # (signature, raw ZIP -> resolution frame, unsaved) kept for the life of the process;
+    # the persistent cache is only read on first use and when the centroid table changes
+    sig = signature()
+    with _lock:
+        cached = _cache.get('lookup')
+    if cached is not None and cached[0] == sig:
+        return cached
+    lookup = load_lookup_cache()
+    if lookup is None:
+        lookup = _resolve(np.array([], dtype=object))
+    cached = (sig, lookup.set_index('ZIP'), False)
+    with _lock:
+        _cache['lookup'] = cached
+    return cached
+
+
+def flush_lookup_cache():
+    # Write the in-process lookup back to the persistent cache if it has unsaved ZIPs
+    sig, lookup, unsaved = _lookup_cache()
+    if unsaved:
+        save_lookup_cache(lookup.reset_index())
+        with _lock:
+            _cache['lookup'] = (sig, lookup, False)
+
+
+def lookup_zips(raw, persist=True):
+    # Resolution of each distinct raw ZIP string, through the lookup cache. Only new strings
+    # are resolved; with persist=False they are written by the next flush_lookup_cache().
+    raw = pd.Series(pd.unique(pd.Series(raw, dtype='string').dropna()), dtype='string')
+    sig, lookup, unsaved = _lookup_cache()
+    missing = raw[~raw.isin(lookup.index)]
+    if len(missing):
+        lookup = pd.concat([lookup, _resolve(missing.to_numpy()).set_index('ZIP')])
+        with _lock:
+            _cache['lookup'] = (sig, lookup, True)
+        if persist:
+            flush_lookup_cache()
+    return lookup
+
+
+def geocode(df, zip_column='ZIP', city_column='CITY', state_column='STATE', persist=True):
+    # Latitude, Longitude and GEOCODE_PRECISION for every row of df (same index)
+    zips = df[zip_column].astype('string')
+    lookup = lookup_zips(zips, persist)
+    located = pd.DataFrame({
+        'Latitude': zips.map(lookup['Latitude']),
+        'Longitude': zips.map(lookup['Longitude']),
+        'GEOCODE_PRECISION': zips.map(lookup['GEOCODE_PRECISION']),
+    }, index=df.index).astype({'Latitude': 'float64', 'Longitude': 'float64', 'GEOCODE_PRECISION': object})
+
+    # City and state fallback for rows without a usable ZIP
+    if city_column in df and state_column in df:
+        _, _, city_table = centroids()
+        unplaced = located['Latitude'].isna()
+        places = pd.MultiIndex.from_arrays([
+            df.loc[unplaced, city_column].astype('string').str.strip().str.upper(),
+            df.loc[unplaced, state_column].astype('string').str.strip().str.upper(),
+        ])
+        matched = city_table.reindex(places)
+        located.loc[unplaced, 'Latitude'] = matched['Latitude'].to_numpy()
+        located.loc[unplaced, 'Longitude'] = matched['Longitude'].to_numpy()
+        located.loc[unplaced & located['Latitude'].notna(), 'GEOCODE_PRECISION'] = 'city'
+    located['GEOCODE_PRECISION'] = located['GEOCODE_PRECISION'].where(located['Latitude'].notna(), None)
+    return located
+
+
+def haversine_km(latitude, longitude, to_latitude, to_longitude):
+    # Great-circle distance in km, element-wise (broadcasts a single point against arrays)
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype='float64')) for v in (latitude, longitude, to_latitude, to_longitude))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def within_km(located, latitude, longitude, km):
+    # Rows of a geocoded frame within km of a point
+    return located[haversine_km(located['Latitude'], located['Longitude'], latitude, longitude) <= km]
+
+
+def geocode_ebmf(batch_rows=500_000):
+    # EIN -> Latitude, Longitude, GEOCODE_PRECISION for the whole unioned EO BMF
+    locations_schema = pa.schema([
+        ('EIN', pa.int64()), ('Latitude', pa.float64()), ('Longitude', pa.float64()), ('GEOCODE_PRECISION', pa.string()),
+    ])
+    precision = pd.Series(dtype='int64')
+    with pq.ParquetWriter(LOCATIONS_PATH, locations_schema) as writer:
+        for record_batch in ebmf_union.ebmf_dataset().to_batches(columns=['EIN', 'CITY', 'STATE', 'ZIP'], batch_size=batch_rows):
+            batch = record_batch.to_pandas()
+            located = geocode(batch, persist=False)
+            located.insert(0, 'EIN', batch['EIN'])
+            writer.write_table(pa.Table.from_pandas(located, schema=locations_schema, preserve_index=False))
+            precision = precision.add(located['GEOCODE_PRECISION'].value_counts(dropna=False), fill_value=0)
+    flush_lookup_cache()
+    return precision.astype('int64')
+
+
+if __name__ == '__main__':
+    for level, count in geocode_ebmf().items():
+        print(f'{level}: {count:,} organizations')